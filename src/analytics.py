@@ -0,0 +1,149 @@
+"""
+Analytics
+
+This module calculates the consumption analytics of a user car from its log
+history. The date, odometer, fuel quantity and fuel price columns are read
+straight into NumPy arrays without loading the log entries as ORM objects, and
+every series is calculated with array operations.
+
+The fuel from a fill up is used until the next fill up, the same as the average
+consumption of the trip calculator. So each fill up, except the first and the
+last, has the distance driven to the next fill up and the fuel added at it:
+
+    consumption - L/100km of each fill up
+
+    rolling_consumption - L/100km of the last ``window`` fill ups, weighted by distance
+
+    cost_per_km - cost of the fuel of each fill up per km driven on it
+
+    fuel_price, rolling_fuel_price - the price paid and its rolling average
+
+Query string parameters:
+
+    window - fill ups in the rolling averages, 1 to 100 (default 5)
+"""
+from itertools import chain
+import numpy as np
+from marshmallow import EXCLUDE, fields
+from marshmallow.validate import Range
+from init import db, ma
+from models.log import LogEntry, LogEntrySchema
+
+# decimal places of the series
+ROUND_DECIMALS = 3
+
+SECONDS_PER_MONTH = 30 * 86400
+
+
+class AnalyticsSchema(ma.Schema):
+    """
+    Analytics schema for the analytics route
+
+    Used to validate the query string parameters of the request
+    """
+    window = fields.Integer(validate=Range(1, 100), load_default=5)
+    class Meta:
+        """
+        Defining the fields in a tuple and ordering the fields
+        """
+        fields = ('window',)
+        unknown = EXCLUDE
+
+
+def load_history(user_car_id: int) -> np.ndarray:
+    """
+    Read the log history of the user car into an array ordered by date, the
+    columns are date_added, current_odo, fuel_quantity and fuel_price
+    """
+    stmt = db.select(
+        LogEntry.date_added, LogEntry.current_odo, LogEntry.fuel_quantity, LogEntry.fuel_price
+    ).filter_by(user_car_id=user_car_id).order_by(LogEntry.date_added, LogEntry.id)
+    rows = db.session.execute(stmt).all()
+    # numpy reads a flat iterator of the values faster than the row objects
+    return np.fromiter(
+        chain.from_iterable(rows), dtype=np.float64, count=len(rows) * 4
+    ).reshape(-1, 4)
+
+
+def rolling_ratio(numerator: np.ndarray, denominator: np.ndarray, window: int) -> np.ndarray:
+    """
+    The ratio of the rolling sums of two series over the window, the first
+    values use the values available
+    """
+    numerator_sums = np.cumsum(numerator)
+    denominator_sums = np.cumsum(denominator)
+    numerator_sums[window:] = numerator_sums[window:] - numerator_sums[:-window]
+    denominator_sums[window:] = denominator_sums[window:] - denominator_sums[:-window]
+    return safe_divide(numerator_sums, denominator_sums)
+
+
+def safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """
+    Divide the arrays, NaN where the denominator isn't positive
+    """
+    result = np.full(numerator.shape, np.nan)
+    np.divide(numerator, denominator, out=result, where=denominator > 0)
+    return result
+
+
+def to_list(values: np.ndarray) -> list:
+    """
+    Round the array and convert it to a list, NaN values become None
+    """
+    rounded = np.round(values, ROUND_DECIMALS)
+    finite = np.isfinite(values)
+    if finite.all():
+        return rounded.tolist()
+    rounded = rounded.astype(object)
+    rounded[~finite] = None
+    return rounded.tolist()
+
+
+def consumption_analytics(user_car_id: int, window: int) -> dict:
+    """
+    Calculate the consumption analytics of the user car
+
+    Returns a dict of the summary and the series, or None if the user car has
+    2 or less log entries
+    """
+    history = load_history(user_car_id)
+    if len(history) <= 2:
+        return None
+    dates, odometers, fuel, prices = history.T
+    # the fill ups between the first and the last, and the distance to the next fill up
+    distances = odometers[2:] - odometers[1:-1]
+    fill_fuel = fuel[1:-1]
+    fill_prices = prices[1:-1]
+    fill_cost = fill_fuel * fill_prices
+    consumption = safe_divide(fill_fuel * 100, distances)
+    cost_per_km = safe_divide(fill_cost, distances)
+    # the price trend is the slope of the prices paid over time
+    if np.ptp(dates) > 0:
+        price_trend = np.polyfit(dates - dates[0], prices, 1)[0] * SECONDS_PER_MONTH
+    else:
+        price_trend = 0.0
+    total_distance = float(odometers[-1] - odometers[1])
+    return {
+        'summary': {
+            'log_count': len(history),
+            'avg_consumption': round(float(fill_fuel.sum()) * 100 / total_distance, 2)
+                               if total_distance > 0 else None,
+            'avg_cost_per_km': round(float(fill_cost.sum()) / total_distance, ROUND_DECIMALS)
+                               if total_distance > 0 else None,
+            'avg_fuel_price': round(float(prices.mean()), ROUND_DECIMALS),
+            'fuel_price_trend_per_month': round(float(price_trend), ROUND_DECIMALS),
+            'window': window
+        },
+        'series': {
+            'date': LogEntrySchema.timestamps_to_dates(dates[1:-1].astype(np.int64).tolist()),
+            'odometer': odometers[1:-1].astype(np.int64).tolist(),
+            'distance': distances.astype(np.int64).tolist(),
+            'consumption': to_list(consumption),
+            'rolling_consumption': to_list(rolling_ratio(fill_fuel * 100, distances, window)),
+            'cost_per_km': to_list(cost_per_km),
+            'fuel_price': to_list(fill_prices),
+            'rolling_fuel_price': to_list(
+                rolling_ratio(fill_prices, np.ones_like(fill_prices), window)
+            )
+        }
+    }
@@ -14,6 +14,12 @@ from blueprints.auth_bp import auth_bp
 from blueprints.cli_bp import cli_bp
 from blueprints.car_bp import car_bp
 from blueprints.log_bp import log_bp
+from blueprints.admin_bp import admin_bp
+from instrumentation import init_instrumentation
+from metrics import init_metrics, metrics
+from password_hashing import PasswordHashingBusy, init_password_hashing
+from report_jobs import init_report_jobs
+from serialization import init_serialization
 import config
 
 def create_app():
@@ -27,33 +33,51 @@ def create_app():
     else:
         app.config.from_object('config.DevConfig')
         environ['FLASK_DEBUG'] = config.DevConfig.FLASK_DEBUG
+    # encode the responses with orjson if it's installed
+    init_serialization(app)
     app.json.sort_keys = False
     # initialise the database instance from the init.py file
     db.init_app(app)
     ma.init_app(app)
     jwt.init_app(app)
     bcrypt.init_app(app)
+    init_password_hashing(app)
+    init_report_jobs(app)
     # register blueprints
     app.register_blueprint(auth_bp)
     app.register_blueprint(cli_bp)
     app.register_blueprint(car_bp)
     app.register_blueprint(log_bp)
+    app.register_blueprint(admin_bp)
+    # count the SQL statements of each request, if it's turned on in the config
+    init_instrumentation(app)
+    # record the request metrics and serve them at /metrics
+    init_metrics(app)
     # handle errors
     @app.errorhandler(400)
     def bad_request(err):
+        metrics.record_error('BadRequest')
         return {'bad_request': 'No JSON object Found in request body'}, 400
 
 
     @app.errorhandler(IntegrityError)
     def integrity_error(err):
+        metrics.record_error('IntegrityError')
         return {'integrity_error': 'Data already exists in database'}, 400
 
     @app.errorhandler(UnsupportedMediaType)
     def unsupported_request(err):
+        metrics.record_error('UnsupportedMediaType')
         return {'bad_request': 'No JSON object Found in request body'}
 
     @app.errorhandler(ValidationError)
     def validation_error(err):
+        metrics.record_error('ValidationError')
         return {'valiadtion_error': err.messages}, 400
 
+    @app.errorhandler(PasswordHashingBusy)
+    def password_hashing_busy(err):
+        metrics.record_error('PasswordHashingBusy')
+        return {'too_many_requests': 'Server is busy, try again later'}, 429, {'Retry-After': '1'}
+
     return app
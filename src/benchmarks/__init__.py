@@ -0,0 +1,17 @@
+"""
+Benchmarks
+
+This package measures the hot routes of the API against a local seeded database.
+The routes are driven through the Flask test client and through a threaded local
+WSGI server, and the results are written as JSON that can be compared between
+commits.
+
+Run from the src directory:
+
+    ``python -m benchmarks --database sqlite:////tmp/bench.db --output results.json``
+
+    ``python -m benchmarks --baseline results.json --threshold 0.2``
+
+An empty database is created and seeded with ``flask cli seed-scale`` first. The
+add_log_entry scenario writes to the database, it runs after the read scenarios.
+"""
@@ -0,0 +1,103 @@
+"""
+Benchmark command line
+
+Runs the benchmark suite and writes the results as JSON. When a baseline is
+given the results are compared with it and the exit code is 1 if any scenario
+regressed by more than the threshold.
+
+    ``python -m benchmarks --help``
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from benchmarks import suite
+from benchmarks.suite import SCENARIOS
+
+
+def parse_args(args: list) -> argparse.Namespace:
+    """
+    Parse the command line arguments
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default='sqlite:////tmp/fuel_log_benchmark.db',
+                        help='database URI, seeded if it has no load testing users')
+    parser.add_argument('--users', type=int, default=100, help='users to seed')
+    parser.add_argument('--logs-per-car', type=int, default=500, help='log entries to seed')
+    parser.add_argument('--password', default='password123', help='password of the seeded users')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='warm up requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='clients of the server mode')
+    parser.add_argument('--mode', choices=('test_client', 'server', 'both'), default='both')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed regression as a fraction, 0.2 is 20%%')
+    return parser.parse_args(args)
+
+
+def git_commit() -> str:
+    """
+    The current git commit, None outside of a git checkout
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(args: list) -> int:
+    """
+    Run the benchmarks, returns the exit code
+    """
+    options = parse_args(args)
+    # the config is read from the environment when the app is imported
+    os.environ['ENVIRONMENT'] = 'dev'
+    os.environ['DB_URI_DEV'] = options.database
+    os.environ.setdefault('JWT_KEY', 'benchmark')
+    from app import create_app
+    app = create_app()
+    context = suite.prepare(app, options.users, options.logs_per_car, options.password)
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'database': options.database.split(':', 1)[0],
+            'requests': options.requests,
+            'warmup': options.warmup,
+            'concurrency': options.concurrency
+        },
+        'results': {}
+    }
+    if options.mode in ('test_client', 'both'):
+        results['results']['test_client'] = suite.run_test_client(
+            app, context, options.scenarios, options.requests, options.warmup
+        )
+    if options.mode in ('server', 'both'):
+        results['results']['server'] = suite.run_server(
+            app, context, options.scenarios, options.requests, options.warmup,
+            options.concurrency
+        )
+    output = json.dumps(results, indent=2)
+    print(output)
+    if options.output:
+        with open(options.output, 'w', encoding='utf8') as file:
+            file.write(output + '\n')
+    if options.baseline:
+        with open(options.baseline, encoding='utf8') as file:
+            regressions = suite.compare(results, json.load(file), options.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
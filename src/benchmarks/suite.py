@@ -0,0 +1,251 @@
+"""
+Benchmark Suite
+
+This module contains the benchmark scenarios, the runners for the test client
+and the threaded WSGI server, and the comparison of the results with a baseline.
+
+Each scenario is measured for the number of requests given, after the warm up
+requests. The results of a scenario are:
+
+    p50_ms, p95_ms, p99_ms - latency percentiles in milliseconds
+
+    rps - requests per second
+
+    sql_per_request - SQL statements executed per request
+
+    errors - responses that aren't 2xx
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from sqlalchemy import event
+from werkzeug.serving import make_server
+from init import db
+from models.user import User
+from models.user_car import UserCar
+
+# the scenarios in the order they're run, the writes run last
+SCENARIOS = (
+    'login', 'get_all_cars', 'get_log_entries', 'calculate_avg_consuption',
+    'expenditure_summary', 'add_log_entry'
+)
+
+# the results compared with the threshold, and if a higher value is worse
+COMPARED_METRICS = {
+    'p50_ms': True,
+    'p95_ms': True,
+    'rps': False
+}
+
+
+class StatementCounter:
+    """
+    Counts the SQL statements executed by the engine, the count is shared by
+    all threads
+    """
+    def __init__(self, engine):
+        self.count = 0
+        self.lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self.increment)
+
+    def increment(self, *args):
+        """
+        Engine event listener, adds one to the count
+        """
+        with self.lock:
+            self.count += 1
+
+
+def prepare(app, users: int, logs_per_car: int, password: str) -> dict:
+    """
+    Create and seed the database if it has no load testing users, then log in
+    the first load testing user
+
+    Returns the context of the scenarios: the login body, the token and the
+    user car id
+    """
+    runner = app.test_cli_runner()
+    with app.app_context():
+        db.create_all()
+        stmt = db.select(User).where(User.email.like('loadtest%')).order_by(User.id).limit(1)
+        if db.session.scalar(stmt) is None:
+            result = runner.invoke(args=[
+                'cli', 'seed-scale', '--users', str(users),
+                '--logs-per-car', str(logs_per_car), '--password', password
+            ])
+            print(result.output.strip())
+        user = db.session.scalar(stmt)
+        user_car_id = db.session.scalar(
+            db.select(UserCar.id).filter_by(user_id=user.id).order_by(UserCar.id).limit(1)
+        )
+        login = {'email': user.email, 'password': password}
+    response = app.test_client().post('/login', json=login)
+    return {'login': login, 'token': response.json['token'], 'user_car_id': user_car_id}
+
+
+def scenario_requests(context: dict) -> dict:
+    """
+    The request of each scenario as a tuple of (method, path, json body, authorized)
+    """
+    car_id = context['user_car_id']
+    return {
+        'login': ('POST', '/login', context['login'], False),
+        'get_all_cars': ('GET', '/cars/', None, True),
+        'get_log_entries': ('GET', f'/logs/me/{car_id}/', None, True),
+        'calculate_avg_consuption': (
+            'POST', f'/logs/me/{car_id}/trip/calculator/',
+            {'distance': 300, 'fuel_price': 1.9}, True
+        ),
+        'expenditure_summary': (
+            'POST', f'/logs/me/{car_id}/expenditure/',
+            {'from_date': '2020-01-01', 'to_date': '2022-12-31'}, True
+        ),
+        'add_log_entry': (
+            'POST', f'/logs/me/{car_id}/',
+            {'current_odo': 10 ** 7, 'fuel_quantity': 50, 'fuel_price': 1.9}, True
+        )
+    }
+
+
+def percentile(values: list, percent: float) -> float:
+    """
+    The nearest rank percentile of the sorted values
+    """
+    index = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(latencies: list, elapsed: float, statements: int, errors: int) -> dict:
+    """
+    Summarize the measurements of a scenario
+    """
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        'sql_per_request': round(statements / len(latencies), 2),
+        'errors': errors
+    }
+
+
+def run_test_client(app, context: dict, scenarios: list, requests: int, warmup: int) -> dict:
+    """
+    Run the scenarios one request at a time through the Flask test client
+    """
+    client = app.test_client()
+    headers = {'Authorization': f"Bearer {context['token']}"}
+    counter = StatementCounter(get_engine(app))
+    results = {}
+    for name, (method, path, body, authorized) in scenario_requests(context).items():
+        if name not in scenarios:
+            continue
+        def send():
+            return client.open(
+                path, method=method, json=body, headers=headers if authorized else None
+            )
+        for _ in range(warmup):
+            send()
+        latencies = []
+        errors = 0
+        counter.count = 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            request_started = time.perf_counter()
+            response = send()
+            latencies.append(time.perf_counter() - request_started)
+            errors += not 200 <= response.status_code < 300
+        elapsed = time.perf_counter() - started
+        results[name] = summarize(latencies, elapsed, counter.count, errors)
+    event.remove(get_engine(app), 'before_cursor_execute', counter.increment)
+    return results
+
+
+def run_server(app, context: dict, scenarios: list, requests: int, warmup: int,
+               concurrency: int) -> dict:
+    """
+    Run the scenarios through a threaded WSGI server on a local port, with
+    concurrent clients
+    """
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    counter = StatementCounter(get_engine(app))
+    results = {}
+    try:
+        for name, (method, path, body, authorized) in scenario_requests(context).items():
+            if name not in scenarios:
+                continue
+            headers = {'Content-Type': 'application/json'}
+            if authorized:
+                headers['Authorization'] = f"Bearer {context['token']}"
+            data = json.dumps(body).encode() if body is not None else None
+            def send():
+                request = Request(base_url + path, data=data, headers=headers, method=method)
+                request_started = time.perf_counter()
+                try:
+                    with urlopen(request) as response:
+                        response.read()
+                        status = response.status
+                except HTTPError as err:
+                    status = err.code
+                return time.perf_counter() - request_started, status
+            with ThreadPoolExecutor(concurrency) as pool:
+                list(pool.map(lambda _: send(), range(warmup)))
+                counter.count = 0
+                started = time.perf_counter()
+                responses = list(pool.map(lambda _: send(), range(requests)))
+                elapsed = time.perf_counter() - started
+            errors = sum(not 200 <= status < 300 for _, status in responses)
+            results[name] = summarize(
+                [latency for latency, _ in responses], elapsed, counter.count, errors
+            )
+    finally:
+        server.shutdown()
+        event.remove(get_engine(app), 'before_cursor_execute', counter.increment)
+    return results
+
+
+def get_engine(app):
+    """
+    The engine of the app's database
+    """
+    with app.app_context():
+        return db.engine
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare the results with the baseline results
+
+    A latency is a regression when it's higher than the baseline by more than the
+    threshold (0.2 is 20%), requests per second when it's lower by more than the
+    threshold. Any increase in the SQL statements per request is a regression
+
+    Returns a list of the regressions as strings
+    """
+    regressions = []
+    for mode, scenarios in results['results'].items():
+        for name, result in scenarios.items():
+            old = baseline.get('results', {}).get(mode, {}).get(name)
+            if old is None:
+                continue
+            for metric, higher_is_worse in COMPARED_METRICS.items():
+                change = (result[metric] - old[metric]) / old[metric] if old[metric] else 0
+                if (change if higher_is_worse else -change) > threshold:
+                    regressions.append(
+                        f'{mode} {name} {metric}: {old[metric]} -> {result[metric]} '
+                        f'({change:+.1%})'
+                    )
+            if result['sql_per_request'] > old['sql_per_request']:
+                regressions.append(
+                    f"{mode} {name} sql_per_request: {old['sql_per_request']} -> "
+                    f"{result['sql_per_request']}"
+                )
+    return regressions
@@ -0,0 +1,69 @@
+"""Admin Blueprint
+
+Contains the diagnostics routes for the admin.
+
+Routes:
+
+    GET '/admin/pool/' - ADMIN only: the connection pool settings and live pool stats
+    of each database bind, to size the workers against the database connection limit
+"""
+from os import getpid
+from flask import Blueprint, current_app
+from flask_jwt_extended import jwt_required
+from init import db
+from metrics import pool_stats
+from blueprints.auth_bp import verify_user
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+# the engine options reported by the pool diagnostics
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle', 'pool_pre_ping')
+
+
+@admin_bp.route('/pool/')
+@jwt_required()
+def get_pool_diagnostics():
+    """
+    Pool diagnostics view function
+
+    Returns the connection pool settings of the app config, and for each database
+    bind the pool class and live stats of this worker process. The PostgreSQL
+    binds also report the connection limit of the server and its open connections
+    """
+    # verify the user
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in or registered"}, 403
+    if not user.is_admin:
+        return {"unauthorized" : "Admin access only"}, 401
+    # read the stats before the database is queried, so they aren't changed by it
+    stats = pool_stats()
+    options = current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    binds = {}
+    for bind, engine in db.engines.items():
+        name = bind or 'default'
+        binds[name] = {
+            'dialect': engine.dialect.name,
+            'pool': type(engine.pool).__name__,
+            **stats[name]
+        }
+        if engine.dialect.name == 'postgresql':
+            binds[name]['server'] = server_connections(engine)
+    return {
+        'pid': getpid(),
+        'engine_options': {option: options[option] for option in POOL_OPTIONS if option in options},
+        'statement_timeout': 'connect_args' in options,
+        'binds': binds
+    }
+
+
+def server_connections(engine) -> dict:
+    """
+    The connection limit of the PostgreSQL server and the connections open to the database
+    """
+    with engine.connect() as connection:
+        max_connections = connection.exec_driver_sql('SHOW max_connections').scalar()
+        connections = connection.exec_driver_sql(
+            'SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()'
+        ).scalar()
+    return {'max_connections': int(max_connections), 'connections': connections}
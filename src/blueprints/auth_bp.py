@@ -13,9 +13,12 @@ Routes:
 from datetime import timedelta
 from flask import Blueprint, request
 from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required
-from init import bcrypt, db
+from init import db
 from models.user import User, UserSchema
-from models.user_car import UserCar
+from identity_cache import get_user, get_user_car, invalidate_user
+from password_hashing import password_hasher
+from serialization import serializer
+from projections import select_users
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -52,7 +55,7 @@ def user_register():
         first_name= user_info.get('first_name', None),
         last_name= user_info.get('last_name', None),
         email= user_info['email'],
-        password= bcrypt.generate_password_hash(user_info['password']).decode('utf8')
+        password= password_hasher.generate(user_info['password'])
     )
     # add and commit the new user
     db.session.add(new_user)
@@ -60,7 +63,7 @@ def user_register():
     # return the user info and success message
     return {
             "msg": "Successfully created new user",
-            "user_info": UserSchema(exclude=['password']).dump(new_user)
+            "user_info": serializer(UserSchema, exclude=['password']).dump(new_user)
             }, 201
 
 
@@ -87,12 +90,17 @@ def user_login():
     stmt = db.select(User).filter_by(email=user_info['email'])
     user = db.session.scalar(stmt)
     # check if user exists
-    if user and bcrypt.check_password_hash(user.password, user_info['password']):
+    if user and password_hasher.check(user.password, user_info['password']):
+        # rehash the password if the work factor has changed
+        if password_hasher.needs_rehash(user.password):
+            user.password = password_hasher.generate(user_info['password'])
+            db.session.commit()
+            invalidate_user(user.id)
         # give user access token, token created using flask_jwt_extended
         token = create_access_token(identity=user.id, expires_delta=timedelta(minutes=120))
         return {
                 "token": token, 
-                "user": UserSchema(exclude=['id', 'password']).dump(user)
+                "user": serializer(UserSchema, exclude=['id', 'password']).dump(user)
                }
     return {"invalid_user_info" : "Invalid email address or password"}, 401
 
@@ -108,10 +116,10 @@ def get_users():
     if not user:
         return {"forbidden": "You must be logged in or registered"}, 403
     if user.is_admin:
-        # select all users from the users table
-        stmt = db.select(User)
-        users = db.session.scalars(stmt).all()
-        return UserSchema(many=True, exclude=['password', 'cars']).dump(users)
+        # select the columns of all users from the users table
+        stmt = select_users()
+        users = db.session.execute(stmt).all()
+        return serializer(UserSchema, many=True, exclude=['password', 'cars']).dump(users)
     return {"unauthorized" : "Admin access only"}, 401
 
 
@@ -137,6 +145,7 @@ def delete_user(user_id):
         if admin_delete_user.id == user_id and not admin_delete_user.is_admin:
             db.session.delete(admin_delete_user)
             db.session.commit()
+            invalidate_user(user_id)
             return {'deleted': 'user successfully deleted'}
         # users can't delete other users only admin
         if not admin_delete_user.is_admin:
@@ -145,6 +154,7 @@ def delete_user(user_id):
         user_to_delete = User.query.filter_by(id=user_id).first()
         db.session.delete(user_to_delete)
         db.session.commit()
+        invalidate_user(user_id)
         return {'admin_deleted': 'user successfully deleted'}
     return {"invalid_user" : "User not found"}, 404
 
@@ -160,15 +170,13 @@ def verify_user_car(car_id: int) -> dict:
     Returns the user object
     """
     # get a user object based on the car id and return to calling function
-    stmt = db.select(UserCar).filter_by(user_id=get_jwt_identity()).filter_by(id=car_id)
-    user = db.session.scalar(stmt)
-    return user
+    # the user's cars are cached, see identity_cache.py
+    return get_user_car(get_jwt_identity(), car_id)
 
 def verify_user() -> dict:
     """
     Verify that user exists using the JWT token linked to the user ID
     """
     # get a user object and return to the calling function
-    stmt = db.select(User).filter_by(id=get_jwt_identity())
-    user = db.session.scalar(stmt)
-    return user
+    # the user is cached, see identity_cache.py
+    return get_user(get_jwt_identity())
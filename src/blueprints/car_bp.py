@@ -28,7 +28,12 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from init import db
 from models.car import Car, CarSchema
 from models.user_car import UserCar, UserCarSchema
+from models.report_job import ReportJob
 from blueprints.auth_bp import verify_user
+from identity_cache import invalidate_user, invalidate_all
+from catalog_cache import catalog_cache, catalog_response
+from serialization import serializer
+from projections import select_cars, select_user_cars, user_car_records
 
 car_bp = Blueprint('car', __name__, url_prefix='/cars')
 
@@ -43,10 +48,9 @@ def get_all_cars():
     # verify the user
     user = verify_user()
     if user:
-        # select all from the cars table
-        stmt = db.select(Car)
-        cars = db.session.scalars(stmt).all()
-        return CarSchema(many=True, exclude=['user_car']).dump(cars)
+        # select the columns of all the cars, the response is cached
+        stmt = select_cars()
+        return catalog_response(('all',), stmt) or []
     return {"forbidden": "You must be logged in to access resource"}, 403
 
 @car_bp.route('/<int:car_id>/')
@@ -68,7 +72,7 @@ def get_a_car(car_id):
         stmt = db.select(Car).filter_by(id=car_id)
         car = db.session.scalar(stmt)
         if car:
-            return CarSchema(exclude=['user_car']).dump(car)
+            return serializer(CarSchema, exclude=['user_car']).dump(car)
         return {'not_found': "Car not found"}, 404
     return {"forbidden": "You must be logged in to access resource"}, 403
 
@@ -92,15 +96,16 @@ def get_cars_by_make_model(make, model):
     if not user:
         return {"forbidden": "You must be logged in to access resource"}, 403
     # searching for cars using the .where() method, by model and make
-    stmt = db.select(Car).where(
+    stmt = select_cars().where(
         db.and_(
             Car.make == make.capitalize(),
             Car.model == model.capitalize()
         )
     )
-    cars = db.session.scalars(stmt).all()
-    if cars:
-        return CarSchema(many=True, exclude=['user_car']).dump(cars)
+    # the response is cached
+    response = catalog_response(('make_model', make.capitalize(), model.capitalize()), stmt)
+    if response:
+        return response
     return {'not_found': "Car make or model not found"}, 404
 
 
@@ -121,10 +126,11 @@ def get_cars_by_make(make):
     if not user:
         return {"forbidden": "You must be logged in to access resource"}, 403
     # searching for cars using the .where() method, for the make
-    stmt = db.select(Car).where(Car.make == make.capitalize())
-    cars = db.session.scalars(stmt).all()
-    if cars:
-        return CarSchema(many=True, exclude=['user_car']).dump(cars)
+    stmt = select_cars().where(Car.make == make.capitalize())
+    # the response is cached
+    response = catalog_response(('make', make.capitalize()), stmt)
+    if response:
+        return response
     return {'not_found': "Car make not found"}, 404
 
 # add a new car
@@ -134,15 +140,11 @@ def add_new_car():
     """
     Add a new Car
 
-    Allows the user to add a new car of their choice. The function first searches for
-    the card that the user has sent through the body request.
+    Allows the user to add a new car of their choice. The car is inserted into the
+    'cars' table if it doesn't exist, or the existing car is used, in one upsert
+    statement that returns the car id.
 
-    If the car exists in the 'cars' table, the car is added to the user's car list.
-
-    If the car doesn't exist, the car is first added to the 'cars' table. The databse is
-    queried again and the newly added car is selected.
-
-    The car is then added to the user's car list
+    The car is then added to the user's car list in the same transaction
 
     Request body:
 
@@ -166,52 +168,26 @@ def add_new_car():
         return {"forbidden": "You must be logged in to access resource"}, 403
     # load the request using the Car schema
     car_info = CarSchema().load(request.json)
-    # query the database to see if the car already exists
-    stmt = db.select(Car).where(
-        db.and_(
-            Car.make == car_info['make'],
-            Car.model == car_info['model'],
-            Car.model_trim == car_info['model_trim'],
-            Car.year == car_info['year'],
-            Car.tank_size == car_info['tank_size']
-        )
+    # add the car to the catalog if it doesn't exist and get its id
+    car_id, inserted = Car.upsert(car_info)
+    # add the car to the user's cars list in the same transaction
+    new_user_car = UserCar(
+        user_id= get_jwt_identity(),
+        car_id= car_id,
+        logs= []
     )
-    add_car = db.session.scalar(stmt)
-    if not add_car:
-        # add the car to the cars list if it doesn't exists
-        new_car = Car(
-            make= car_info['make'],
-            model= car_info['model'],
-            model_trim= car_info['model_trim'],
-            year= car_info['year'],
-            tank_size= car_info['tank_size']
-        )
-        # add and commit the car
-        db.session.add(new_car)
-        db.session.commit()
-        # query the database again and select the newly added car
-        new_stmt = db.select(Car).order_by(Car.id.desc())
-        recent_car = db.session.scalars(new_stmt).first()
-        # add the car to the user's cars list
-        new_user_car = UserCar(
-            user_id= get_jwt_identity(),
-            car_id= recent_car.id
-        )
-        # add and commit the car to user cars
-        db.session.add(new_user_car)
-        db.session.commit()
-        return UserCarSchema(exclude=['user_id']).dump(new_user_car)
-
-    if add_car:
-        # add the car to the user's cars list
-        new_user_car = UserCar(
-            user_id= get_jwt_identity(),
-            car_id= add_car.id
-        )
-        # add and commit the car to user cars
-        db.session.add(new_user_car)
-        db.session.commit()
-        return UserCarSchema(exclude=['user_id']).dump(new_user_car)
+    db.session.add(new_user_car)
+    db.session.flush()
+    # dump the new id with the loaded car before committing, so neither the user car
+    # nor its car are loaded again
+    user_car_info = serializer(UserCarSchema, exclude=['user_id']).dump(
+        {'id': new_user_car.id, 'car': car_info, 'logs': []}
+    )
+    db.session.commit()
+    if inserted:
+        catalog_cache.bump()
+    invalidate_user(get_jwt_identity())
+    return user_car_info
 
 
 # get user cars
@@ -227,11 +203,11 @@ def get_user_cars():
     user = verify_user()
     if not user:
         return {"forbidden": "You must be logged in to access resource"}, 403
-    # query the database and filter by the user id
-    stmt = db.select(UserCar).filter_by(user_id=user.id)
-    user_cars = db.session.scalars(stmt).all()
+    # query the database for the user's car ids and the columns of their cars
+    stmt = select_user_cars(user.id)
+    user_cars = user_car_records(db.session.execute(stmt))
     if user_cars:
-        return UserCarSchema(many=True, only=['id','car']).dump(user_cars)
+        return serializer(UserCarSchema, many=True, only=['id','car']).dump(user_cars)
     return {"not_found": "User has no cars added to their list"}, 404
 
 # get user cars
@@ -251,7 +227,7 @@ def get_user_car(car_id):
     stmt = db.select(UserCar).filter_by(user_id=user.id).filter_by(id=car_id)
     user_car = db.session.scalar(stmt)
     if user_car:
-        return UserCarSchema(only=['id','car']).dump(user_car)
+        return serializer(UserCarSchema, only=['id','car']).dump(user_car)
     return {"not_found": "User car not found"}, 404
 
 
@@ -283,6 +259,7 @@ def delete_user_car(user_car_id):
         # delete and commit the selected car
         db.session.delete(user_car)
         db.session.commit()
+        invalidate_user(user.id)
         return {'deleted': 'removed car from user list'}
     return {'not_found': "User car not found"}, 404
 
@@ -309,12 +286,17 @@ def delete_car(car_id):
     stmt = db.select(Car).filter_by(id= car_id)
     car = db.session.scalar(stmt)
     if car:
+        # the reports of the car's user cars are stale, before the user cars are deleted
+        ReportJob.invalidate_car(car_id)
         # find in user cars as well and delete the user car record
         stmt = db.delete(UserCar).filter_by(car_id= car_id)
         db.session.execute(stmt)
         # delete car from cars table
         db.session.delete(car)
         db.session.commit()
+        catalog_cache.bump()
+        # the car was removed from every user's list
+        invalidate_all()
         return {'admin_deleted': 'car successfully deleted'}
     return {'not_found': 'Car not found'}, 404
 
@@ -348,7 +330,10 @@ def update_car_info(car_id):
         car.model_trim= car_info.get('model_trim', car.model_trim)
         car.year= car_info.get('year', car.year)
         car.tank_size= car_info.get('tank_size', car.tank_size)
+        # the reports of the car's user cars are stale
+        ReportJob.invalidate_car(car_id)
         # commit the update
         db.session.commit()
-        return CarSchema(exclude=['user_car']).dump(car)
+        catalog_cache.bump()
+        return serializer(CarSchema, exclude=['user_car']).dump(car)
     return {'not_found': 'Car not found'}, 404
@@ -7,29 +7,182 @@ The following commands are run in the CLI. To invoke a command in the blue print
 
 Commands:
 
-    ``create`` - create tables in the database
+    ``create`` - create tables in the database, and the indexes and constraints missing from
+    existing tables, and build the log rollups and consumption stats missing for existing
+    log entries
 
     ``drop`` - drop the existing tables in the database
 
     ``seed`` - seed the existing tables in the database
+
+    ``rebuild-stats`` - rebuild the consumption stats of every user car from the log entries
+
+    ``rebuild-rollups`` - rebuild the monthly log rollups of every user car from the log entries
+
+    ``explain`` - fail if the query plan of a hot query has a sequential scan of a large table
+
+    ``clear-report-jobs`` - delete the finished report jobs that are stale, failed or old
+
+    ``seed-scale`` - seed the database with synthetic users, user cars, log entries and trips
+    for load testing
 """
+import random
+import sys
 from datetime import datetime, timezone, timedelta
 from time import timezone as tz
+import click
 from flask import Blueprint
 from models.user import User
 from models.car import Car
 from models.log import LogEntry
 from models.user_car import UserCar
 from models.trip import Trip
+from models.consumption_stats import ConsumptionStats
+from models.log_rollup import LogRollup
+from models.report_job import ReportJob, ReportJobChunk, DONE, FAILED
+from query_plans import MIN_ROWS, check_query_plans
 from init import db, bcrypt
 
 cli_bp = Blueprint('cli', __name__)
 
+# rows inserted per executemany batch by seed-scale
+SEED_BATCH_SIZE = 5000
+
+# the synthetic catalog of seed-scale: make, model, trim and tank size, one car per year.
+# The names pass the CarSchema validation so the cars can be updated through the API
+SEED_CATALOG = (
+    ('Toyota', 'Corolla', 'Ascent', 50),
+    ('Toyota', 'Hilux', 'SR5', 80),
+    ('Toyota', 'Landcruiser', '200 series', 138),
+    ('Ford', 'Ranger', 'XLT', 80),
+    ('Ford', 'Focus', 'Trend', 52),
+    ('Mazda', 'BT50', 'XT', 80),
+    ('Mazda', 'Mazda3', 'G20', 51),
+    ('Hyundai', 'Tucson', 'Active', 62),
+    ('Mitsubishi', 'Triton', 'GLX', 75),
+    ('Volkswagen', 'Golf', 'Comfortline', 50)
+)
+SEED_YEARS = range(2005, 2024)
+
 @cli_bp.cli.command('create')
 def create_tables():
     '''Create the tables in the database using the defined models'''
     db.create_all()
+    # create_all skips the tables that exist, so the constraints and indexes added
+    # to the models since the tables were created are created here
+    if add_unique_trips():
+        print('Duplicate trips removed and unique trips constraint added')
+    created = create_missing_indexes()
     print('Tables created')
+    if created:
+        print(f'Indexes created: {", ".join(created)}')
+    # the log entries added before the rollups existed aren't in the rollups
+    rebuilt = backfill_rollups()
+    if rebuilt:
+        print(f'Log rollups built for {rebuilt} user cars')
+    rebuilt = backfill_stats()
+    if rebuilt:
+        print(f'Consumption stats built for {rebuilt} user cars')
+
+
+def add_unique_trips() -> bool:
+    """
+    Add the unique (user_car_id, fuel_price, distance) constraint of the trips to
+    a user_trips table created without it, Trip.add_once inserts with ON CONFLICT
+    on these columns. The duplicate trips of each user car are removed first,
+    keeping the oldest. The constraint is added as a unique index, SQLite can't
+    add a constraint to an existing table
+
+    Returns True if the constraint was added
+    """
+    columns = ['user_car_id', 'fuel_price', 'distance']
+    existing = db.inspect(db.engine)
+    unique = [
+        constraint['column_names']
+        for constraint in existing.get_unique_constraints('user_trips')
+    ] + [
+        index['column_names'] for index in existing.get_indexes('user_trips') if index['unique']
+    ]
+    if any(sorted(names) == sorted(columns) for names in unique):
+        return False
+    oldest = db.select(db.func.min(Trip.id)).group_by(
+        Trip.user_car_id, Trip.fuel_price, Trip.distance
+    )
+    db.session.execute(db.delete(Trip).where(Trip.id.not_in(oldest)))
+    db.session.execute(db.text(
+        'CREATE UNIQUE INDEX uq_user_trips_user_car_id_fuel_price_distance '
+        f'ON user_trips ({", ".join(columns)})'
+    ))
+    db.session.commit()
+    return True
+
+
+def create_missing_indexes() -> list:
+    """
+    Create the indexes of the models that are missing from the existing tables
+
+    Returns the names of the indexes created
+    """
+    existing = db.inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        names = {index['name'] for index in existing.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in names:
+                index.create(db.engine)
+                created.append(index.name)
+    return created
+
+
+def backfill_rollups() -> int:
+    """
+    Rebuild the monthly rollups of the user cars whose rollups don't count all
+    their log entries, such as the log entries added before the rollups table
+    was created. The expenditure reports read the whole months from the rollups
+
+    Returns the number of user cars rebuilt
+    """
+    rollups = db.select(
+        LogRollup.user_car_id, db.func.sum(LogRollup.log_count).label('log_count')
+    ).group_by(LogRollup.user_car_id)
+    user_car_ids = miscounted_user_cars(rollups)
+    for user_car_id in user_car_ids:
+        LogRollup.rebuild(user_car_id)
+    db.session.commit()
+    return len(user_car_ids)
+
+
+def backfill_stats() -> int:
+    """
+    Rebuild the consumption stats of the user cars whose stats are missing or
+    don't count all their log entries. The trip calculators build missing
+    stats when they're used, this builds them before the upgraded app serves
+    requests
+
+    Returns the number of user cars rebuilt
+    """
+    stats = db.select(ConsumptionStats.user_car_id, ConsumptionStats.log_count)
+    user_car_ids = miscounted_user_cars(stats)
+    for user_car_id in user_car_ids:
+        ConsumptionStats.rebuild(user_car_id)
+    db.session.commit()
+    return len(user_car_ids)
+
+
+def miscounted_user_cars(counts) -> list:
+    """
+    The ids of the user cars with log entries whose log count in the counts
+    statement, selecting (user_car_id, log_count), is missing or different from
+    the number of their log entries
+    """
+    logs = db.select(
+        LogEntry.user_car_id, db.func.count(LogEntry.id).label('log_count')
+    ).group_by(LogEntry.user_car_id).subquery()
+    counts = counts.subquery()
+    stmt = db.select(logs.c.user_car_id).outerjoin(
+        counts, logs.c.user_car_id == counts.c.user_car_id
+    ).where(db.func.coalesce(counts.c.log_count, 0) != logs.c.log_count)
+    return db.session.scalars(stmt).all()
 
 
 @cli_bp.cli.command('drop')
@@ -169,6 +322,11 @@ def seed_tables():
     # add and commit the list
     db.session.add_all(logs)
     db.session.commit()
+    # build the consumption stats and monthly rollups for the user cars
+    for user_car in user_cars:
+        ConsumptionStats.rebuild(user_car.id)
+        LogRollup.rebuild(user_car.id)
+    db.session.commit()
     # seed the user trips table
     user_trips = [
         Trip(
@@ -190,3 +348,241 @@ def seed_tables():
     db.session.add_all(user_trips)
     db.session.commit()
     print('Tables seeded')
+
+
+@cli_bp.cli.command('rebuild-stats')
+def rebuild_stats():
+    """
+    Rebuild the consumption stats of every user car from scratch using the log entries
+    """
+    stmt = db.select(UserCar.id)
+    user_car_ids = db.session.scalars(stmt).all()
+    for user_car_id in user_car_ids:
+        ConsumptionStats.rebuild(user_car_id)
+    db.session.commit()
+    print(f'Consumption stats rebuilt for {len(user_car_ids)} user cars')
+
+
+@cli_bp.cli.command('rebuild-rollups')
+def rebuild_rollups():
+    """
+    Rebuild the monthly log rollups of every user car from scratch using the log entries
+    """
+    stmt = db.select(UserCar.id)
+    user_car_ids = db.session.scalars(stmt).all()
+    for user_car_id in user_car_ids:
+        LogRollup.rebuild(user_car_id)
+    db.session.commit()
+    print(f'Log rollups rebuilt for {len(user_car_ids)} user cars')
+
+
+@cli_bp.cli.command('explain')
+@click.option('--min-rows', default=MIN_ROWS, show_default=True,
+              help='Only fail on sequential scans of tables with at least this many rows')
+def explain_queries(min_rows):
+    """
+    Explain the hot queries of the routes and fail if a plan has a sequential
+    scan of a large table
+    """
+    results = check_query_plans(min_rows)
+    if results is None:
+        print('No user cars to explain the queries with, seed the database first')
+        return
+    failed = 0
+    for name, plan, scanned in results:
+        print(f'{"SEQ SCAN" if scanned else "OK":<9}{name}')
+        if scanned:
+            failed += 1
+            for line in plan:
+                print(f'         {line}')
+    if failed:
+        print(f'{failed} queries with a sequential scan of a table with {min_rows} or more rows')
+        sys.exit(1)
+    print('No sequential scans of large tables')
+
+
+@cli_bp.cli.command('clear-report-jobs')
+@click.option('--days', default=7, show_default=True,
+              help='Also delete the jobs that finished more than this many days ago')
+def clear_report_jobs(days):
+    """
+    Delete the finished report jobs that are stale or failed, or finished more than
+    days ago. The pending and running jobs are kept
+    """
+    finished_before = datetime.now().timestamp() - days * 24 * 60 * 60
+    cleared = db.select(ReportJob.id).where(
+        db.and_(
+            ReportJob.status.in_([DONE, FAILED]),
+            db.or_(
+                ReportJob.stale.is_(True),
+                ReportJob.status == FAILED,
+                ReportJob.finished_at < finished_before
+            )
+        )
+    )
+    # delete the result chunks first, SQLite doesn't cascade the foreign keys
+    db.session.execute(db.delete(ReportJobChunk).where(ReportJobChunk.job_id.in_(cleared)))
+    deleted = db.session.execute(db.delete(ReportJob).where(ReportJob.id.in_(cleared))).rowcount
+    db.session.commit()
+    print(f'Report jobs deleted: {deleted}')
+
+
+@cli_bp.cli.command('seed-scale')
+@click.option('--users', default=1000, show_default=True, help='Number of users')
+@click.option('--cars-per-user', default=2, show_default=True, help='User cars of each user')
+@click.option('--logs-per-car', default=500, show_default=True, help='Log entries of each user car')
+@click.option('--trips-per-car', default=10, show_default=True, help='Trips of each user car')
+@click.option('--password', default='password123', show_default=True,
+              help='Password of every user')
+@click.option('--seed', default=0, show_default=True, help='Random seed of the generated data')
+def seed_scale(users, cars_per_user, logs_per_car, trips_per_car, password, seed):
+    """
+    Seed the database with synthetic data for load testing
+
+    The users log in with loadtest<n>@fuellogapi.com and the same password, it's
+    hashed once. Each user car has log entries with increasing dates and odometer
+    readings ending today. The rows are inserted in batches with Core inserts and
+    the ids are assigned here, so the consumption stats and monthly rollups are
+    built while the log entries are generated.
+    """
+    rand = random.Random(seed)
+    password_hash = bcrypt.generate_password_hash(password).decode('utf8')
+    # add the catalog cars that don't exist yet
+    existing = set(db.session.execute(db.select(Car.make, Car.model, Car.model_trim, Car.year)))
+    catalog = [
+        {'make': make, 'model': model, 'model_trim': model_trim, 'year': year,
+         'tank_size': tank_size}
+        for make, model, model_trim, tank_size in SEED_CATALOG
+        for year in SEED_YEARS
+        if (make, model, model_trim, year) not in existing
+    ]
+    if catalog:
+        db.session.execute(db.insert(Car), catalog)
+    cars = db.session.execute(db.select(Car.id, Car.tank_size)).all()
+    # the ids of the new rows follow the existing rows
+    user_id, user_car_id, log_id, trip_id = (
+        db.session.scalar(db.select(db.func.coalesce(db.func.max(model.id), 0)))
+        for model in (User, UserCar, LogEntry, Trip)
+    )
+    first_log_id = log_id
+    now = datetime.now().timestamp()
+    buffers = {User: [], UserCar: [], LogEntry: [], Trip: [], ConsumptionStats: [], LogRollup: []}
+    for _ in range(users):
+        user_id += 1
+        buffers[User].append({
+            'id': user_id, 'first_name': 'Load', 'last_name': f'Test {user_id}',
+            'email': f'loadtest{user_id}@fuellogapi.com', 'password': password_hash,
+            'is_admin': False
+        })
+        for _ in range(cars_per_user):
+            user_car_id += 1
+            car_id, tank_size = rand.choice(cars)
+            buffers[UserCar].append({'id': user_car_id, 'user_id': user_id, 'car_id': car_id})
+            logs, stats, rollups = seed_log_entries(
+                rand, user_car_id, log_id, tank_size, logs_per_car, now
+            )
+            log_id += len(logs)
+            buffers[LogEntry].extend(logs)
+            buffers[ConsumptionStats].append(stats)
+            buffers[LogRollup].extend(rollups)
+            # the trips of a user car are unique
+            trips = set()
+            while len(trips) < trips_per_car:
+                trips.add((round(rand.uniform(1.5, 2.3), 2), rand.randint(5, 1500)))
+            for fuel_price, distance in trips:
+                trip_id += 1
+                buffers[Trip].append({
+                    'id': trip_id, 'user_car_id': user_car_id,
+                    'fuel_price': fuel_price, 'distance': distance
+                })
+            if len(buffers[LogEntry]) >= SEED_BATCH_SIZE:
+                seed_insert(buffers)
+    seed_insert(buffers)
+    reset_sequences(User, UserCar, LogEntry, Trip)
+    db.session.commit()
+    print(f'Seeded {users} users, {users * cars_per_user} user cars, '
+          f'{log_id - first_log_id} log entries and {users * cars_per_user * trips_per_car} trips')
+
+
+def seed_log_entries(rand: random.Random, user_car_id: int, log_id: int,
+                     tank_size: int, count: int, now: float) -> tuple:
+    """
+    Generate the log entries of a user car, with the consumption stats and
+    monthly rollups of the entries
+
+    The fill ups are 3 to 14 days apart and end today, each fill up adds between a
+    third of the tank and a full tank and the distance driven on it follows the
+    car's consumption
+
+    Returns a tuple of the log entries, the stats and the rollups as dicts
+    """
+    consumption = rand.uniform(6, 14)
+    odo = rand.randint(0, 200000)
+    fuel_price = rand.uniform(1.6, 2.0)
+    gaps = [rand.randint(3 * 86400, 14 * 86400) for _ in range(count)]
+    date_added = now - sum(gaps)
+    logs = []
+    rollups = {}
+    month_end = 0
+    for gap in gaps:
+        log_id += 1
+        date_added += gap
+        fuel_quantity = rand.randint(max(tank_size // 3, 1), tank_size)
+        odo += int(fuel_quantity / consumption * 100)
+        fuel_price = min(max(fuel_price + rand.uniform(-0.08, 0.08), 1.2), 2.6)
+        log = {
+            'id': log_id, 'user_car_id': user_car_id, 'date_added': int(date_added),
+            'current_odo': odo, 'fuel_quantity': fuel_quantity,
+            'fuel_price': round(fuel_price, 2)
+        }
+        logs.append(log)
+        # the dates increase, so the month only changes when its end is passed
+        if log['date_added'] >= month_end:
+            month = LogRollup.month_of(log['date_added'])
+            month_end = LogRollup.month_range(month)[1]
+            rollup = rollups[month] = {
+                'user_car_id': user_car_id, 'month': month, 'log_count': 0,
+                'total_cost': 0, 'total_litres': 0, 'min_odo': odo, 'max_odo': odo
+            }
+        rollup['log_count'] += 1
+        rollup['total_cost'] += log['fuel_price'] * fuel_quantity
+        rollup['total_litres'] += fuel_quantity
+        rollup['max_odo'] = odo
+    stats = {'user_car_id': user_car_id, 'log_count': len(logs),
+             'total_fuel': sum(log['fuel_quantity'] for log in logs)}
+    stats.update(
+        first_odo=logs[0]['current_odo'] if logs else None,
+        first_fuel=logs[0]['fuel_quantity'] if logs else None,
+        second_odo=logs[1]['current_odo'] if len(logs) > 1 else None,
+        last_odo=logs[-1]['current_odo'] if logs else None,
+        last_fuel=logs[-1]['fuel_quantity'] if logs else None,
+        last_date=logs[-1]['date_added'] if logs else None,
+        last_log_id=logs[-1]['id'] if logs else None
+    )
+    return logs, stats, list(rollups.values())
+
+
+def seed_insert(buffers: dict):
+    """
+    Insert the buffered rows of each model in batches and empty the buffers,
+    the models are inserted in the order of their foreign keys
+    """
+    for model, rows in buffers.items():
+        for start in range(0, len(rows), SEED_BATCH_SIZE):
+            db.session.execute(db.insert(model), rows[start:start + SEED_BATCH_SIZE])
+        rows.clear()
+
+
+def reset_sequences(*models):
+    """
+    Move the id sequences of the models past the ids inserted by seed-scale,
+    only PostgreSQL uses sequences
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in models:
+        table = model.__tablename__
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"(SELECT coalesce(max(id), 1) FROM {table}))"
+        ))
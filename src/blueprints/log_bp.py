@@ -11,6 +11,8 @@ Routes:
 
     POST '/me/<int:car_id>/' : add a new log for the selected car
 
+    POST '/me/<int:car_id>/import/' : add many logs for the selected car from a JSON array or CSV
+
     PUT/PATCH '/me/<int:car_id>/<int:log_id>/' : update the selected log for the user car
 
     DELETE '/me/<int:car_id>/<int:log_id>/' : delete the selected log entry for the user car
@@ -18,27 +20,76 @@ Routes:
     POST '/me/<int:car_id>/trip/calculator/' : adds a trip to the trips entity and 
     calulates the trip cost
 
+    POST '/me/<int:car_id>/trip/calculator/batch/' : calculates the cost of many trips
+    without saving them
+
+    POST '/me/trip/calculator/batch/' : calculates the cost of many trips of any of the
+    user's cars without saving them
+
+    GET '/me/<int:car_id>/analytics/' : get the consumption, cost and fuel price series of
+    the user car's fill ups
+
     GET '/me/<int:car_id>/trips/' : get the trips for a user car
 
+    GET '/me/<int:car_id>/export/' : export the log entries and trips of a user car
+
+    GET '/me/export/' : export the log entries and trips of all the user's cars
+
     DELETE '/me/<int:car_id>/trips/<int:trip_id>' : delete the selected trip for the user car
 
     PUT/PATCH '/me/<int:car_id>/trips/<int:trip_id>' : update the selected trip for the user car
 
     GET '/me/<int:car_id>/expenditure/from/<int:from_day>/<int:from_month>/<int:from_year>/to/
     <int:to_day>/<int:to_month>/<int:to_year>/' : get the expenditure summary for a time period
+
+    POST '/me/<int:car_id>/expenditure/report/' : get the expenditure for each week, month or
+    year of a time period
+
+    POST '/me/<int:car_id>/expenditure/compare/periods/' : compare the expenditure of many
+    time periods
+
+    POST '/me/<int:car_id>/expenditure/report/jobs/' : start the expenditure report of a time
+    period as a background job
+
+    POST '/me/<int:car_id>/export/jobs/' : start the export of a user car as a background job
+
+    POST '/me/export/jobs/' : start the export of all the user's cars as a background job
+
+    GET '/me/jobs/<int:job_id>/' : get the status of a report job
+
+    GET '/me/jobs/<int:job_id>/result/' : download the result of a finished report job
 """
+import csv
 from datetime import datetime
-from flask import Blueprint, request
+from io import StringIO
+import numpy as np
+from flask import Blueprint, Response, current_app, request, stream_with_context, url_for
+from marshmallow.exceptions import ValidationError
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from init import db
-from models.log import LogEntry, LogEntrySchema, ExpenditureSchema, ExpenditureCompareSchema
+from models.log import LogEntry, LogEntrySchema, LogEntryImportSchema, ExpenditureSchema, \
+                        ExpenditureCompareSchema, ExpenditureReportSchema, ExpenditurePeriodsSchema
 from models.car import CarSchema
-from models.trip import Trip, TripSchema
-from models.user_car import UserCarSchema
+from models.trip import Trip, TripSchema, TripQuoteSchema, TripBatchSchema
+from models.user_car import UserCar, UserCarSchema
+from models.consumption_stats import ConsumptionStats
+from models.log_rollup import LogRollup
+from models.report_job import ReportJob, ReportJobSchema, DONE, FAILED
 from blueprints.auth_bp import verify_user_car, verify_user
+from pagination import PageSchema, page_ndjson, paginate
+from serialization import serializer
+from projections import log_entry_records, select_log_entries
+from replicas import read_replica
+from export import ExportSchema, MIMETYPES, export_chunks, export_history
+from reports import bucketed_expenditure, compare_expenditure
+from analytics import AnalyticsSchema, consumption_analytics
+from report_jobs import report_job, report_job_runner, result_chunks
 
 log_bp = Blueprint('log', __name__, url_prefix='/logs')
 
+# number of log entries inserted in each executemany by the import
+IMPORT_BATCH_SIZE = 1000
+
 # get user's log for selected car
 @log_bp.route('/me/<int:car_id>/')
 @jwt_required()
@@ -46,11 +97,15 @@ def get_log_entries(car_id):
     """
     Log Entries for car
 
-    Get all the log entries for specified user car
+    Get all the log entries for specified user car, ordered by date added
 
     Variables:
 
             <car_id> (int)
+
+    Query string:
+
+            limit (int), after (str), format ('json' or 'ndjson'), see pagination.py
     """
     # verify the user
     user = verify_user()
@@ -59,11 +114,17 @@ def get_log_entries(car_id):
     # query the database for user car's id
     user_car = verify_user_car(car_id)
     if user_car:
-        # query the database and filter logs by user_car_id
-        stmt = db.select(LogEntry).filter_by(user_car_id=user_car.id)
-        log_entries = db.session.scalars(stmt).all()
+        page = PageSchema().load(request.args)
+        # query the database for the columns of the user car's logs, the rows
+        # are made into records with the user car
+        stmt = select_log_entries(user_car.id)
+        keys = (LogEntry.date_added, LogEntry.id)
+        load = log_entry_records(user_car)
+        if page['format'] == 'ndjson':
+            return page_ndjson(stmt, keys, page, serializer(LogEntrySchema), load)
+        log_entries, headers = paginate(stmt, keys, page, load)
         if log_entries:
-            return LogEntrySchema(many=True).dump(log_entries)
+            return serializer(LogEntrySchema, many=True).dump(log_entries), headers
         return {'not_found': 'No log entries for user car'}, 404
     return {'not_found': 'User car not found'}, 404
 
@@ -92,7 +153,7 @@ def get_log_entry(car_id, log_id):
         stmt = db.select(LogEntry).filter_by(user_car_id=user_car.id).filter_by(id=log_id)
         log_entry = db.session.scalar(stmt)
         if log_entry:
-            return LogEntrySchema().dump(log_entry)
+            return serializer(LogEntrySchema).dump(log_entry)
         return {'not_found': 'Log entry not found for user car'}, 404
     return {'not_found': 'User car not found'}, 404
 
@@ -125,12 +186,110 @@ def add_log_entry(car_id):
             fuel_price= log_entry_info['fuel_price'],
             user_car_id= car_id
         )
-        # add and commit new log entry
+        # lock the user car's consumption stats before adding the entry
+        stats = ConsumptionStats.for_user_car(car_id, lock=True)
+        # add the new log entry and update the stats and rollup in the same transaction
         db.session.add(new_log_entry)
+        db.session.flush()
+        stats.add_entry(new_log_entry)
+        LogRollup.add_entry(new_log_entry)
+        # the cached reports of the user car are stale
+        ReportJob.invalidate(car_id)
         db.session.commit()
-        return LogEntrySchema().dump(new_log_entry)
+        return serializer(LogEntrySchema).dump(new_log_entry)
     return {'not_found':  "User car not found"}, 404
 
+# import log entries
+@log_bp.route('/me/<int:car_id>/import/', methods=['POST'])
+@jwt_required()
+def import_log_entries(car_id):
+    """
+    Import Log Entries
+
+    Add many log entries for the specified user car in one transaction. The log
+    entries are sent as a JSON array or as CSV, either as the request body with
+    the 'text/csv' content type or as a file upload in the 'file' field.
+
+    The valid log entries are inserted in batches and the invalid entries are
+    returned with their errors, keyed by their position in the list.
+
+    Variables:
+
+            <car_id> (int)
+
+    Request body:
+
+        a list of log entries, the CSV header names the fields:
+
+            [
+                {
+                    "current_odo": "odometer reading",
+
+                    "fuel_quantity": "fuel added",
+
+                    "fuel_price": "price per litre",
+
+                    "date_added": "Optional: date of the fill up YYYY-MM-DD"
+                }
+            ]
+    """
+    # verify the user
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+    # query the database for user car's id
+    user_car = verify_user_car(car_id)
+    if not user_car:
+        return {'not_found':  "User car not found"}, 404
+    # read the log entries from the CSV or the JSON body
+    upload = request.files.get('file')
+    if upload or request.mimetype == 'text/csv':
+        text = upload.read().decode('utf-8-sig') if upload else request.get_data(as_text=True)
+        # leave out the empty CSV values so the optional fields aren't validated
+        rows = [
+            {field: value for field, value in row.items() if value}
+            for row in csv.DictReader(StringIO(text))
+        ]
+    else:
+        rows = request.json
+    if not isinstance(rows, list):
+        return {'bad_request': 'Request body must be a list of log entries'}, 400
+    # load the rows to the log entry schema, keeping the valid ones
+    errors = {}
+    try:
+        log_entries = LogEntryImportSchema(many=True).load(rows)
+    except ValidationError as err:
+        errors = err.messages
+        log_entries = [
+            log_entry for index, log_entry in enumerate(err.valid_data) if index not in errors
+        ]
+    if not log_entries:
+        return {'valiadtion_error': errors or 'No log entries in request body'}, 400
+    # lock the user car's consumption stats before adding the entries
+    ConsumptionStats.for_user_car(car_id, lock=True)
+    # insert the log entries in batches with executemany
+    date_added = int(datetime.now().timestamp())
+    values = [
+        {
+            'current_odo': log_entry['current_odo'],
+            'fuel_quantity': log_entry['fuel_quantity'],
+            'fuel_price': log_entry['fuel_price'],
+            'date_added': log_entry.get('date_added', date_added),
+            'user_car_id': car_id
+        }
+        for log_entry in log_entries
+    ]
+    for start in range(0, len(values), IMPORT_BATCH_SIZE):
+        db.session.execute(db.insert(LogEntry), values[start:start + IMPORT_BATCH_SIZE])
+    # rebuild the stats and refresh the months of the new entries, then commit
+    ConsumptionStats.rebuild(car_id)
+    for month in sorted({LogRollup.month_of(value['date_added']) for value in values}):
+        LogRollup.refresh(car_id, month)
+    # the cached reports of the user car are stale
+    ReportJob.invalidate(car_id)
+    db.session.commit()
+    return {'imported': len(values), 'errors': errors}, 201
+
 # update a log entry
 @log_bp.route('/me/<int:car_id>/<int:log_id>', methods=['PUT', 'PATCH'])
 @jwt_required()
@@ -153,20 +312,27 @@ def update_log_entry(car_id, log_id):
     # query the database for user car's id
     user_car = verify_user_car(car_id)
     if user_car:
-        # search for the log entry
-        stmt = db.select(LogEntry).filter_by(id=log_id)
+        # search for the log entry in the user car's logs
+        stmt = db.select(LogEntry).filter_by(user_car_id=car_id).filter_by(id=log_id)
         log_entry = db.session.scalar(stmt)
         if log_entry:
             # load the reponse to the Log Entry Schema
             log_info = LogEntrySchema().load(request.json)
+            # lock the user car's consumption stats before updating the entry
+            stats = ConsumptionStats.for_user_car(car_id, lock=True)
+            old_fuel_quantity = log_entry.fuel_quantity
             # update the log entry fields
             log_entry.current_odo = log_info.get('current_odo', log_entry.current_odo)
             log_entry.fuel_quantity = log_info.get('fuel_quantity', log_entry.fuel_quantity)
             log_entry.fuel_price = log_info.get('fuel_price', log_entry.fuel_price)
-            log_entry.user_car_id = car_id
-            # commit the update
+            # update the stats and the rollup of the month and commit the update
+            db.session.flush()
+            stats.update_entry(old_fuel_quantity, log_entry)
+            LogRollup.refresh(car_id, LogRollup.month_of(log_entry.date_added))
+            # the cached reports of the user car are stale
+            ReportJob.invalidate(car_id)
             db.session.commit()
-            return LogEntrySchema().dump(log_entry)
+            return serializer(LogEntrySchema).dump(log_entry)
         return {'not_found': 'Log entry not found'}, 404
     return {'not_found': 'User car not found'}, 404
 
@@ -192,12 +358,19 @@ def delete_log_entry(car_id, log_id):
     # query the database for user car's id
     user_car = verify_user_car(car_id)
     if user_car:
-        # search for the log entry
-        stmt = db.select(LogEntry).filter_by(id=log_id)
+        # search for the log entry in the user car's logs
+        stmt = db.select(LogEntry).filter_by(user_car_id=car_id).filter_by(id=log_id)
         log_entry = db.session.scalar(stmt)
         if log_entry:
-            # delete the log and commit
+            # lock the user car's consumption stats before deleting the entry
+            stats = ConsumptionStats.for_user_car(car_id, lock=True)
+            # delete the log, update the stats and the rollup of the month and commit
             db.session.delete(log_entry)
+            db.session.flush()
+            stats.delete_entry(log_entry)
+            LogRollup.refresh(car_id, LogRollup.month_of(log_entry.date_added))
+            # the cached reports of the user car are stale
+            ReportJob.invalidate(car_id)
             db.session.commit()
             return {'deleted': 'Log entry deleted from user car'}
         return {'not_found': 'Log entry not found'}, 404
@@ -211,20 +384,25 @@ def calculate_avg_consuption(car_id):
     """
     Trip calculator and Average Consumption
 
-    Calculates the average fuel consumption. Queries the database for the last 2 log entries
-    and calculates the distance between fill ups.
-
-    Calculates how much fuel was used from previous fills.
+    Calculates the average fuel consumption. Reads the running consumption stats of
+    the user car, which hold the distance between fill ups and how much fuel was used
+    from previous fills.
 
     Average will only be calculated once there is more than 2 log entries for the user car.
 
     The trip calculator relies on the average. Once the average can be calculated, the trip
     cost will be calculated based on the average.
 
+    The trip is saved to the user car's trips, unless the user car already has the same
+    trip or the quote query string is true.
+
     Variables:
 
             <car_id> (int)
 
+    Query string:
+
+            quote (bool) only calculate the trip cost, the trip isn't saved
     """
     # verify the user
     user = verify_user()
@@ -233,63 +411,164 @@ def calculate_avg_consuption(car_id):
     # query the database for user car's id
     user_car = verify_user_car(car_id)
     if user_car:
-        # filter the log entries using the user car id, order by date added
-        stmt = db.select(LogEntry).filter_by(
-                                    user_car_id=car_id
-                                ).order_by(LogEntry.date_added.desc())
-        log_entries = db.session.scalars(stmt).all()
-        if len(log_entries) > 2:
-            # load the request body to the trip schema
-            trip_info = TripSchema().load(request.json)
-            # see if the trip exists already, if it does, skip the adding part (avoid dulplicates)
-            stmt = db.select(Trip).where(
-                db.and_(
-                    Trip.fuel_price == trip_info['fuel_price'],
-                    Trip.distance == trip_info['distance'],
-                    Trip.user_car_id == car_id
-                )
-            )
-            check_trip = db.session.scalar(stmt)
-            if not check_trip:
-            # add a new trip
-                new_trip = Trip(
-                    fuel_price= trip_info['fuel_price'],
-                    distance= trip_info['distance'],
-                    user_car_id= car_id
-                )
-                # add and commit the trip
-                db.session.add(new_trip)
-                db.session.commit()
-            # if trip exists, assign to new_trip
-            new_trip = check_trip
-            # last 2 entries are in list position's 0 and 1
-            # calculate the distance travelled from one fill up
-            # gather as many data points for distance travelled
-            distance_travelled = log_entries[0].current_odo - log_entries[-2].current_odo
-            # average fuel consumed from last fill up
+        # load the request body to the trip schema and the query string, before
+        # anything is written
+        trip_info = TripSchema().load(request.json)
+        quote = TripQuoteSchema().load(request.args)['quote']
+        # the running consumption stats of the user car's log entries
+        stats = db.session.get(ConsumptionStats, car_id)
+        if stats is None:
+            # build the stats from the log entries and keep them, they're already
+            # flushed by the rebuild queries so they aren't in session.new
+            stats = ConsumptionStats.rebuild(car_id)
+            db.session.commit()
+        if stats.avg_consumption is not None:
+            # average consumption from the stats
             # is isn't the real average consumption as the fuel left in the tank isn't recorded
-            # fuel total
-            total_fuel = 0
-            for index in range(1, len(log_entries) - 1):
-                total_fuel += log_entries[index].fuel_quantity
-            # average consumption
-            avg_consumption = (total_fuel) / (distance_travelled / 100)
+            avg_consumption = stats.avg_consumption
             # esitmated fuel needed for trip
             trip_fuel = avg_consumption * (trip_info['distance'] / 100)
             # estimated trip cost
             trip_cost = trip_fuel * trip_info['fuel_price']
-            return {
+            trip_estimate = {
                 'avg_consumption': f"{format(avg_consumption, '.2f')} L/100km",
                 'estimated_trip_fuel': f"{format(trip_fuel, '.2f')} L",
                 'esitmated_trip_cost': f"${format(trip_cost, '.2f')}",
-                'car': CarSchema(exclude=['id', 'user_car']).dump(user_car.car)
+                'car': serializer(CarSchema, exclude=['id', 'user_car']).dump(user_car.car)
             }
+            # save the trip unless it's only a quote, a trip the user car already
+            # has isn't saved again
+            if not quote and Trip.add_once(car_id, trip_info['fuel_price'], trip_info['distance']):
+                # the cached exports of the user car are stale
+                ReportJob.invalidate(car_id)
+                db.session.commit()
+            return trip_estimate
         return {
             'calc_error': 'Unable to calc average consumption due to num of log entries present',
             'log_entries_required': 'Require more than 2 log entries for user car'
         }, 400
     return {'not_found': 'User car not found'}
 
+# calculate the cost of many trips
+@log_bp.route('/me/<int:car_id>/trip/calculator/batch/', methods=['POST'])
+@log_bp.route('/me/trip/calculator/batch/', methods=['POST'])
+@jwt_required()
+def calculate_trip_batch(car_id=None):
+    """
+    Batch Trip Calculator
+
+    Calculates the cost of many trips in one request. The consumption stats of each
+    user car are loaded once in one query and every trip is priced from them. The
+    trips aren't saved, but the missing stats are built and saved so the reads go
+    to the primary database.
+
+    Each trip has a user car id, or uses the user car in the URL. Trips for a user car
+    with 2 or less log entries get a calc_error instead of the estimate.
+
+    Variables:
+
+            <car_id> (int) optional
+
+    Request body:
+
+            {
+                "trips": [
+                    {
+                        "user_car_id": "Optional: the user car of the trip",
+
+                        "distance": "trip distance",
+
+                        "fuel_price": "price per litre"
+                    }
+                ]
+            }
+    """
+    # verify the user
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+    trips = TripBatchSchema().load(request.json)['trips']
+    for trip in trips:
+        trip.setdefault('user_car_id', car_id)
+    user_car_ids = {trip['user_car_id'] for trip in trips}
+    if None in user_car_ids:
+        return {'valiadtion_error': {'user_car_id': ['Missing data for required field.']}}, 400
+    # verify the user owns all the user cars
+    if not all(verify_user_car(user_car_id) for user_car_id in user_car_ids):
+        return {'not_found': 'User car not found'}, 404
+    # load the stats of all the user cars, building the missing ones
+    stmt = db.select(ConsumptionStats).where(ConsumptionStats.user_car_id.in_(user_car_ids))
+    stats = {stat.user_car_id: stat for stat in db.session.scalars(stmt)}
+    missing = user_car_ids - stats.keys()
+    for user_car_id in missing:
+        stats[user_car_id] = ConsumptionStats.rebuild(user_car_id)
+    avg_consumptions = {
+        user_car_id: stat.avg_consumption for user_car_id, stat in stats.items()
+    }
+    if missing:
+        # keep the stats that were built from the log entries, they're already
+        # flushed by the rebuild queries
+        db.session.commit()
+    # price every trip from the average consumption of its user car with array
+    # operations, the user cars without an average are NaN
+    avg_consumption = np.array(
+        [avg_consumptions[trip['user_car_id']] for trip in trips], dtype=np.float64
+    )
+    distance = np.array([trip['distance'] for trip in trips], dtype=np.float64)
+    fuel_price = np.array([trip['fuel_price'] for trip in trips], dtype=np.float64)
+    trip_fuel = avg_consumption * distance / 100
+    trip_cost = trip_fuel * fuel_price
+    estimates = []
+    for index, trip in enumerate(trips):
+        estimate = {
+            'user_car_id': trip['user_car_id'],
+            'distance': trip['distance'],
+            'fuel_price': trip['fuel_price']
+        }
+        if np.isnan(avg_consumption[index]):
+            estimate['calc_error'] = 'Require more than 2 log entries for user car'
+        else:
+            estimate['avg_consumption'] = round(float(avg_consumption[index]), 2)
+            estimate['estimated_trip_fuel'] = round(float(trip_fuel[index]), 2)
+            estimate['estimated_trip_cost'] = round(float(trip_cost[index]), 2)
+        estimates.append(estimate)
+    return {'trips': estimates}
+
+# consumption analytics
+@log_bp.route('/me/<int:car_id>/analytics/')
+@jwt_required()
+def get_consumption_analytics(car_id):
+    """
+    Consumption Analytics
+
+    Get the consumption, cost per km and fuel price of each fill up of the user car,
+    with their rolling averages and a summary. See analytics.py
+
+    Variables:
+
+            <car_id> (int)
+
+    Query string:
+
+            window (int) fill ups in the rolling averages
+    """
+    # verify the user
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+    # query the database for user car's id
+    user_car = verify_user_car(car_id)
+    if not user_car:
+        return {'not_found': 'User car not found'}, 404
+    window = AnalyticsSchema().load(request.args)['window']
+    analytics = consumption_analytics(car_id, window)
+    if analytics is None:
+        return {
+            'calc_error': 'Unable to calc average consumption due to num of log entries present',
+            'log_entries_required': 'Require more than 2 log entries for user car'
+        }, 400
+    return analytics
+
 # get trips for user car
 @log_bp.route('/me/<int:car_id>/trips/')
 @jwt_required()
@@ -302,23 +581,79 @@ def get_all_trips(car_id):
     Variables:
 
             <car_id> (int)
+
+    Query string:
+
+            limit (int), after (str), format ('json' or 'ndjson'), see pagination.py
     """
     # verify the user
     user = verify_user()
     if not user:
         return {"forbidden": "You must be logged in to access resource"}, 403
     user = verify_user_car(car_id)
-    # query the database and filter by car_id
-    stmt = db.select(Trip).filter_by(user_car_id=car_id)
-    all_trips = db.session.scalars(stmt).all()
     if user:
-        if all_trips:
-            # get the user's trips and place in a list
-            user_trips = [trip for trip in all_trips if trip.usercar.user_id == get_jwt_identity()]
-            return TripSchema(many=True, exclude=['usercar']).dump(user_trips)
+        page = PageSchema().load(request.args)
+        # query the database for the user's trips for car_id
+        stmt = select_user_trips(car_id)
+        keys = (Trip.id,)
+        if page['format'] == 'ndjson':
+            return page_ndjson(stmt, keys, page, serializer(TripSchema, exclude=['usercar']))
+        user_trips, headers = paginate(stmt, keys, page)
+        if user_trips:
+            return serializer(TripSchema, many=True, exclude=['usercar']).dump(user_trips), headers
         return {'not_found': 'User car has no trips'}, 404
     return {'not_found': 'User car not found'}, 404
 
+# export the history of a user car
+@log_bp.route('/me/<int:car_id>/export/')
+@jwt_required()
+def export_user_car(car_id):
+    """
+    Export User Car
+
+    Stream all the log entries and trips of the specified user car as NDJSON or CSV
+
+    Variables:
+
+            <car_id> (int)
+
+    Query string:
+
+            format ('ndjson' or 'csv')
+    """
+    # verify the user
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+    # query the database for user car's id
+    user_car = verify_user_car(car_id)
+    if user_car:
+        export_format = ExportSchema().load(request.args)['format']
+        return export_history([car_id], export_format, f'fuel_log_car_{car_id}')
+    return {'not_found': 'User car not found'}, 404
+
+# export the history of all the user's cars
+@log_bp.route('/me/export/')
+@jwt_required()
+def export_user():
+    """
+    Export User
+
+    Stream all the log entries and trips of all the user's cars as NDJSON or CSV
+
+    Query string:
+
+            format ('ndjson' or 'csv')
+    """
+    # verify the user
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+    export_format = ExportSchema().load(request.args)['format']
+    # select the user's cars in the export queries
+    user_car_ids = db.select(UserCar.id).filter_by(user_id=user.id)
+    return export_history(user_car_ids, export_format, 'fuel_log')
+
 # get a trip for user car
 @log_bp.route('/me/<int:car_id>/trips/<int:trip_id>/')
 @jwt_required()
@@ -338,14 +673,12 @@ def get_a_trip(car_id, trip_id):
     if not user:
         return {"forbidden": "You must be logged in to access resource"}, 403
     user = verify_user_car(car_id)
-    # query the database and filter by car_id, trip_id
-    stmt = db.select(Trip).filter_by(user_car_id=car_id).filter_by(id=trip_id)
-    trip = db.session.scalar(stmt)
     if user:
+        # query the database for the user's trip for car_id
+        stmt = select_user_trips(car_id).where(Trip.id == trip_id)
+        trip = db.session.scalar(stmt)
         if trip:
-            # get the user's id
-            if trip.usercar.user_id == get_jwt_identity():
-                return TripSchema(exclude=['usercar']).dump(trip)
+            return serializer(TripSchema, exclude=['usercar']).dump(trip)
         return {'not_found': 'User car trip not found'}, 404
     return {'not_found': 'User car not found'}, 404
 
@@ -369,13 +702,14 @@ def delete_trips(car_id, trip_id):
     if not user:
         return {"forbidden": "You must be logged in to access resource"}, 403
     user = verify_user_car(car_id)
-    # query the database
-    stmt = db.select(Trip).filter_by(id=trip_id)
-    trip = db.session.scalar(stmt)
     if user:
-        if trip and trip.usercar.user_id == get_jwt_identity() and trip.user_car_id == car_id:
-            # delete the trip and commit
+        # query the database for the user's trip for car_id
+        stmt = select_user_trips(car_id).where(Trip.id == trip_id)
+        trip = db.session.scalar(stmt)
+        if trip:
+            # delete the trip and commit, the cached exports of the user car are stale
             db.session.delete(trip)
+            ReportJob.invalidate(car_id)
             db.session.commit()
             return {'deleted': 'Trip successfully deleted'}
         return {'not_found': 'User car trip does not exsist'}, 404
@@ -401,20 +735,21 @@ def update_trips(car_id, trip_id):
     if not user:
         return {"forbidden": "You must be logged in to access resource"}, 403
     user = verify_user_car(car_id)
-    # query the database
-    stmt = db.select(Trip).filter_by(id=trip_id)
-    trip = db.session.scalar(stmt)
     if user:
-        if trip and trip.usercar.user_id == get_jwt_identity() and trip.user_car_id == car_id:
+        # query the database for the user's trip for car_id
+        stmt = select_user_trips(car_id).where(Trip.id == trip_id)
+        trip = db.session.scalar(stmt)
+        if trip:
             # load the request body to the trip schema
             trip_info = TripSchema().load(request.json)
             # update the trip
             trip.fuel_price = trip_info.get('fuel_price', trip.fuel_price)
             trip.distance = trip_info.get('distance', trip.distance)
             trip.user_car_id = car_id
-            # commit the update
+            # commit the update, the cached exports of the user car are stale
+            ReportJob.invalidate(car_id)
             db.session.commit()
-            return TripSchema(exclude=['usercar']).dump(trip)
+            return serializer(TripSchema, exclude=['usercar']).dump(trip)
         return {'not_found': 'User car trip does not exist'}, 404
     return {'not_found': 'User car not found'}, 404
 
@@ -423,6 +758,7 @@ def update_trips(car_id, trip_id):
     '/me/<int:car_id>/expenditure/', methods=['POST']
 )
 @jwt_required()
+@read_replica
 def expenditure_summary(car_id):
     """
     Expenditure Summary
@@ -465,33 +801,17 @@ def expenditure_summary(car_id):
     to_date = to_date.timestamp()
     if to_date < from_date:
         return {"logic_error": "to_date must be after from_date"}, 400
-    # filter the logs using the to and from dates
-    stmt = db.select(LogEntry).where(
-        db.and_(
-            LogEntry.date_added <= to_date,
-            LogEntry.date_added >= from_date
-        )
-    )
-    logs_for_period = db.session.scalars(stmt).all()
     # verify the user is allowed to access the logs
     user = verify_user_car(car_id)
     if user:
-        if logs_for_period:
-            # filter out the logs that belong to the user and car
-            user_logs_for_period = [log for log in logs_for_period if log.user_car_id == car_id]
-            # calculate the total cost for the period and total distance
-            total_cost = 0
-            total_distance = user_logs_for_period[-1].current_odo \
-                                    - user_logs_for_period[0].current_odo
-            for log in user_logs_for_period:
-                total_cost += log.fuel_price * log.fuel_quantity
-
-
+        # aggregate the user car's logs for the period in the database
+        period, = compare_expenditure(car_id, [(from_date, to_date)])
+        if period.log_count:
             return {
-                    'total_cost_for_period': f"${format(total_cost, '.2f')}",
-                    'total_distance_for_period': f"{total_distance} km",
-                    "expenditure_summary_for" : ExpenditureSchema().dump(dates),
-                    'user_car': UserCarSchema(only=['car']).dump(user)
+                    'total_cost_for_period': f"${format(period.total_cost, '.2f')}",
+                    'total_distance_for_period': f"{period.total_distance} km",
+                    "expenditure_summary_for" : serializer(ExpenditureSchema).dump(dates),
+                    'user_car': serializer(UserCarSchema, only=['car']).dump(user)
             }
         return {'not_found': 'No expenditure for period specified'}, 404
     return{'not_found': 'User car not found'}, 404
@@ -501,6 +821,7 @@ def expenditure_summary(car_id):
     '/me/<int:car_id>/expenditure/compare/', methods=['POST']
 )
 @jwt_required()
+@read_replica
 def expenditure_compare(car_id):
     """
     Expenditure Compare
@@ -562,64 +883,394 @@ def expenditure_compare(car_id):
     compare_to_date = compare_to_date.timestamp()
     if to_date < from_date or compare_to_date < compare_from_date:
         return {"logic_error": "to_date and compared_to_date must be after from_dates"}, 400
-    # filter the logs using the to and from dates
-    stmt = db.select(LogEntry).where(
-        db.and_(
-            LogEntry.date_added <= to_date,
-            LogEntry.date_added >= from_date
-        )
-    )
-    logs_for_period_one = db.session.scalars(stmt).all()
-    # filter the logs using the "compare" to and from dates
-    stmt2 = db.select(LogEntry).where(
-        db.and_(
-            LogEntry.date_added <= compare_to_date,
-            LogEntry.date_added >= compare_from_date
-        )
-    )
-    logs_for_period_two = db.session.scalars(stmt2).all()
     # verify the user is allowed to access the logs
     user = verify_user_car(car_id)
     if user:
-        if logs_for_period_one and logs_for_period_two:
-            # filter out the logs that belong to the user and car
-            user_logs_for_period_one = [
-                log for log in logs_for_period_one if log.user_car_id == car_id
-            ]
-            user_logs_for_period_two = [
-                log for log in logs_for_period_two if log.user_car_id == car_id
-            ]
-            # calculate the total costs and distances for the periods
-            total_cost_one = 0
-            total_cost_two = 0
-            total_distance_one = user_logs_for_period_one[-1].current_odo \
-                                    - user_logs_for_period_one[0].current_odo
-            total_distance_two = user_logs_for_period_two[-1].current_odo \
-                                    - user_logs_for_period_two[0].current_odo
-
-            for log in user_logs_for_period_one:
-                total_cost_one += log.fuel_price * log.fuel_quantity
-            for log in user_logs_for_period_two:
-                total_cost_two += log.fuel_price * log.fuel_quantity
-
-
+        # aggregate the user car's logs for both periods in one query
+        period_one, period_two = compare_expenditure(
+                                    car_id,
+                                    [(from_date, to_date), (compare_from_date, compare_to_date)]
+                                )
+        if period_one.log_count and period_two.log_count:
             return {
                 "period_one" : {
-                    "expenditure_summary_for" : ExpenditureCompareSchema(
-                                                        only=['to_date', 'from_date']
-                                                ).dump(dates),
-                    'total_cost_for_period': f"${format(total_cost_one, '.2f')}",
-                    'total_distance_for_period': f"{total_distance_one} km",
-                    'user_car': UserCarSchema(only=['car']).dump(user)
+                    "expenditure_summary_for" : serializer(
+                        ExpenditureCompareSchema, only=['to_date', 'from_date']
+                    ).dump(dates),
+                    'total_cost_for_period': f"${format(period_one.total_cost, '.2f')}",
+                    'total_distance_for_period': f"{period_one.total_distance} km",
+                    'user_car': serializer(UserCarSchema, only=['car']).dump(user)
                 },
                 "period_two" : {
-                    "expenditure_summary_for" : ExpenditureCompareSchema(
-                                                        exclude=['to_date', 'from_date']
-                                                ).dump(dates),
-                    'total_cost_for_period': f"${format(total_cost_two, '.2f')}",
-                    'total_distance_for_period': f"{total_distance_two} km",
-                    'user_car': UserCarSchema(only=['car']).dump(user)
+                    "expenditure_summary_for" : serializer(
+                        ExpenditureCompareSchema, exclude=['to_date', 'from_date']
+                    ).dump(dates),
+                    'total_cost_for_period': f"${format(period_two.total_cost, '.2f')}",
+                    'total_distance_for_period': f"{period_two.total_distance} km",
+                    'user_car': serializer(UserCarSchema, only=['car']).dump(user)
                 }
             }
         return {'not_found': 'No expenditure for one or both of periods specified'}, 404
     return{'not_found': 'User car not found'}, 404
+
+# expenditure report
+@log_bp.route(
+    '/me/<int:car_id>/expenditure/report/', methods=['POST']
+)
+@jwt_required()
+@read_replica
+def expenditure_report(car_id):
+    """
+    Expenditure Report
+
+    Allows the user to generate an expenditure report for each week, month or year
+    of the specified time period. All the periods are calculated in one query
+
+    Variables:
+
+            <car_id> (int)
+    """
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+
+    dates = ExpenditureReportSchema().load(request.json)
+    from_date, to_date = period_timestamps(dates)
+    if to_date < from_date:
+        return {"logic_error": "to_date must be after from_date"}, 400
+    # verify the user is allowed to access the logs
+    user = verify_user_car(car_id)
+    if user:
+        return expenditure_report_body(user, dates)
+    return{'not_found': 'User car not found'}, 404
+
+# expenditure compare for many periods
+@log_bp.route(
+    '/me/<int:car_id>/expenditure/compare/periods/', methods=['POST']
+)
+@jwt_required()
+@read_replica
+def expenditure_compare_periods(car_id):
+    """
+    Expenditure Compare Periods
+
+    Allows the user to compare expenditure reports for any number of time periods.
+    All the periods are calculated in one query
+
+    Variables:
+
+            <car_id> (int)
+    """
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+
+    periods = ExpenditurePeriodsSchema().load(request.json)['periods']
+    timestamps = [period_timestamps(dates) for dates in periods]
+    if any(to_date < from_date for from_date, to_date in timestamps):
+        return {"logic_error": "to_date must be after from_date for every period"}, 400
+    # verify the user is allowed to access the logs
+    user = verify_user_car(car_id)
+    if user:
+        # aggregate the user car's logs for all the periods in the database
+        rows = compare_expenditure(car_id, timestamps)
+        if any(row.log_count for row in rows):
+            return {
+                "periods": [
+                    dict(
+                        expenditure_summary_for=serializer(ExpenditureSchema).dump(dates),
+                        **format_expenditure(row)
+                    )
+                    for dates, row in zip(periods, rows)
+                ],
+                'user_car': serializer(UserCarSchema, only=['car']).dump(user)
+            }
+        return {'not_found': 'No expenditure for the periods specified'}, 404
+    return{'not_found': 'User car not found'}, 404
+
+# run the expenditure report in the background
+@log_bp.route('/me/<int:car_id>/expenditure/report/jobs/', methods=['POST'])
+@jwt_required()
+def expenditure_report_job(car_id):
+    """
+    Expenditure Report Job
+
+    Starts the expenditure report of the specified time period as a background job,
+    for reports of many years. The request body is the same as the expenditure
+    report's. The report is downloaded from the job's result route when it's done.
+
+    A report with the same dates and period is reused until the user car's log
+    entries change
+
+    Variables:
+
+            <car_id> (int)
+    """
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+
+    dates = ExpenditureReportSchema().load(request.json)
+    from_date, to_date = period_timestamps(dates)
+    if to_date < from_date:
+        return {"logic_error": "to_date must be after from_date"}, 400
+    # verify the user is allowed to access the logs
+    user_car = verify_user_car(car_id)
+    if user_car:
+        params = serializer(ExpenditureReportSchema).dump(dates)
+        return start_report_job('expenditure_report', params, user.id, car_id)
+    return {'not_found': 'User car not found'}, 404
+
+# export the history of a user car in the background
+@log_bp.route('/me/<int:car_id>/export/jobs/', methods=['POST'])
+@jwt_required()
+def export_user_car_job(car_id):
+    """
+    Export User Car Job
+
+    Starts the export of all the log entries and trips of the specified user car
+    as a background job. The export is downloaded from the job's result route
+    when it's done
+
+    Variables:
+
+            <car_id> (int)
+
+    Query string:
+
+            format ('ndjson' or 'csv')
+    """
+    # verify the user
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+    # query the database for user car's id
+    user_car = verify_user_car(car_id)
+    if user_car:
+        params = ExportSchema().load(request.args)
+        return start_report_job('export', params, user.id, car_id)
+    return {'not_found': 'User car not found'}, 404
+
+# export the history of all the user's cars in the background
+@log_bp.route('/me/export/jobs/', methods=['POST'])
+@jwt_required()
+def export_user_job():
+    """
+    Export User Job
+
+    Starts the export of all the log entries and trips of all the user's cars as a
+    background job. The export is downloaded from the job's result route when it's done
+
+    Query string:
+
+            format ('ndjson' or 'csv')
+    """
+    # verify the user
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+    params = ExportSchema().load(request.args)
+    return start_report_job('export', params, user.id)
+
+# get the status of a report job
+@log_bp.route('/me/jobs/<int:job_id>/')
+@jwt_required()
+def get_report_job(job_id):
+    """
+    Get Report Job
+
+    Get the status of one of the user's report jobs. The job has the URL of its
+    result once it's done
+
+    Variables:
+
+            <job_id> (int)
+    """
+    # verify the user
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+    stmt = db.select(ReportJob).filter_by(id=job_id, user_id=user.id)
+    job = db.session.scalar(stmt)
+    if job:
+        # run the job again if the process running it stopped
+        report_job_runner.resume(job)
+        return report_job_response(job)
+    return {'not_found': 'Report job not found'}, 404
+
+# download the result of a report job
+@log_bp.route('/me/jobs/<int:job_id>/result/')
+@jwt_required()
+def get_report_job_result(job_id):
+    """
+    Get Report Job Result
+
+    Download the result of one of the user's report jobs. The result has the status
+    code and body the report would have had, exports are sent as attachments.
+    Unfinished jobs return their status with 202
+
+    Variables:
+
+            <job_id> (int)
+    """
+    # verify the user
+    user = verify_user()
+    if not user:
+        return {"forbidden": "You must be logged in to access resource"}, 403
+    stmt = db.select(ReportJob).filter_by(id=job_id, user_id=user.id)
+    job = db.session.scalar(stmt)
+    if job:
+        if job.status == DONE:
+            headers = {}
+            if job.filename:
+                headers['Content-Disposition'] = f'attachment; filename={job.filename}'
+            # the result is streamed from its saved chunks
+            return Response(
+                stream_with_context(result_chunks(job.id)),
+                status=job.result_status, mimetype=job.mimetype, headers=headers
+            )
+        if job.status == FAILED:
+            return {'job_failed': job.error}, 500
+        report_job_runner.resume(job)
+        return report_job_response(job, 202)
+    return {'not_found': 'Report job not found'}, 404
+
+
+@report_job('expenditure_report')
+def run_expenditure_report(params: dict, job: ReportJob) -> tuple:
+    """
+    Run the expenditure report of a report job, the parameters are the request
+    body of the expenditure report
+    """
+    dates = ExpenditureReportSchema().load(params)
+    body, status = expenditure_report_body(job.usercar, dates)
+    return [current_app.json.dumps(body)], status, 'application/json', None
+
+
+@report_job('export')
+def run_export(params: dict, job: ReportJob) -> tuple:
+    """
+    Run the export of a report job, of the job's user car or all the user's cars
+    if the job has no user car. The export is read in chunks like the streamed
+    export and each chunk is saved as it's serialized
+    """
+    export_format = params['format']
+    if job.user_car_id:
+        user_car_ids = [job.user_car_id]
+        filename = f'fuel_log_car_{job.user_car_id}'
+    else:
+        user_car_ids = db.select(UserCar.id).filter_by(user_id=job.user_id)
+        filename = 'fuel_log'
+    chunks = export_chunks(user_car_ids, export_format)
+    return chunks, 200, MIMETYPES[export_format], f'{filename}.{export_format}'
+
+
+def period_timestamps(dates: dict) -> tuple:
+    """
+    Convert the from and to dates of a period to the unix timestamps stored in
+    the database. If the "to" date is the current date, the current time is used
+
+    Returns a tuple of (from timestamp, to timestamp)
+    """
+    from_date = datetime.combine(dates['from_date'], datetime.min.time()).timestamp()
+    if dates['to_date'] == datetime.now().date():
+        to_date = datetime.now().timestamp()
+    else:
+        to_date = datetime.combine(dates['to_date'], datetime.min.time()).timestamp()
+    return from_date, to_date
+
+
+def format_expenditure(row) -> dict:
+    """
+    Format the aggregates of an expenditure report row
+    """
+    total_cost = row.total_cost or 0
+    total_litres = row.total_litres or 0
+    avg_fuel_price = total_cost / total_litres if total_litres else 0
+    return {
+        'log_count': row.log_count,
+        'total_cost_for_period': f"${format(total_cost, '.2f')}",
+        'total_litres_for_period': f"{total_litres} L",
+        'total_distance_for_period': f"{row.total_distance or 0} km",
+        'avg_fuel_price_for_period': f"${format(avg_fuel_price, '.2f')}/L"
+    }
+
+
+def expenditure_report_body(user_car: UserCar, dates: dict) -> tuple:
+    """
+    The expenditure report of the user car for each week, month or year of the
+    loaded report dates
+
+    Returns a tuple of the response body and status code
+    """
+    from_date, to_date = period_timestamps(dates)
+    # aggregate the user car's logs for each period in the database
+    rows = bucketed_expenditure(user_car.id, from_date, to_date, dates['period'])
+    if rows:
+        return {
+            "expenditure_report_for" : serializer(ExpenditureReportSchema).dump(dates),
+            "periods": [
+                dict(period_start=row.period, **format_expenditure(row)) for row in rows
+            ],
+            'user_car': serializer(UserCarSchema, only=['car']).dump(user_car)
+        }, 200
+    return {'not_found': 'No expenditure for period specified'}, 404
+
+
+def start_report_job(kind: str, params: dict, user_id: int, user_car_id: int = None) -> tuple:
+    """
+    Return the user's cached job of the kind and parameters, or add a new job and
+    submit it to the report job workers
+
+    Returns a tuple of the job status, status code and headers, 202 and the
+    location of the job for a new job
+    """
+    job = ReportJob.cached(kind, params, user_id, user_car_id)
+    if job:
+        report_job_runner.resume(job)
+        return report_job_response(job)
+    job = ReportJob.create(kind, params, user_id, user_car_id)
+    db.session.commit()
+    report_job_runner.submit(job.id)
+    body, status, headers = report_job_response(job, 202)
+    headers['Location'] = url_for('log.get_report_job', job_id=job.id)
+    return body, status, headers
+
+
+def report_job_response(job: ReportJob, status: int = 200) -> tuple:
+    """
+    The status of the report job, with the URL of the result when it's done and
+    a Retry-After header while it's unfinished
+
+    Returns a tuple of the body, status code and headers
+    """
+    body = serializer(ReportJobSchema).dump(job)
+    headers = {}
+    if job.status == DONE:
+        body['result'] = url_for('log.get_report_job_result', job_id=job.id)
+    elif not job.finished:
+        headers['Retry-After'] = '2'
+    return body, status, headers
+
+
+def select_user_trips(car_id: int):
+    """
+    Select the trips of the user car that belong to the user making the request
+
+    The ownership is checked in the same query by joining the user cars, so the
+    user car of each trip doesn't need to be loaded
+
+    Variables:
+
+            <car_id> (int)
+
+    Returns the select statement
+    """
+    return db.select(Trip).join(
+        UserCar, Trip.user_car_id == UserCar.id
+    ).where(
+        db.and_(
+            Trip.user_car_id == car_id,
+            UserCar.user_id == get_jwt_identity()
+        )
+    )
@@ -0,0 +1,113 @@
+"""
+Catalog Cache
+
+This module caches the serialized responses of the car catalog routes. The
+catalog hardly ever changes, so the JSON bytes of each query are kept in the
+process and sent again until the catalog is changed.
+
+Each entry is stored with the catalog version it was built from. The version
+is bumped when a car is added, updated or deleted, which makes all the entries
+stale. Entries also expire after ``CATALOG_CACHE_TTL`` seconds so other worker
+processes pick up the changes, a TTL of 0 disables the cache.
+
+The responses carry a strong ETag of the body, a request with a matching
+``If-None-Match`` header gets a ``304 Not Modified`` response.
+"""
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+from time import monotonic
+from flask import current_app, request
+from init import db
+from models.car import CarSchema
+from serialization import serializer
+
+
+class CatalogCache:
+    """
+    Process level LRU cache of the catalog responses
+
+    Each entry is keyed by the query and holds a tuple of the JSON body and
+    ETag, the body is None when no cars matched the query
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.version = 0
+
+    def get(self, key: tuple) -> tuple:
+        """
+        Get the cached entry for the query, None if it's missing or stale
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            version, expires, value = entry
+            if version != self.version or expires < monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: tuple, version: int, value: tuple):
+        """
+        Add the entry for the query, built from the catalog version. Entries
+        built from an older version are skipped
+        """
+        ttl = current_app.config.get('CATALOG_CACHE_TTL', 0)
+        if not ttl:
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = (version, monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > current_app.config.get('CATALOG_CACHE_SIZE', 256):
+                self._entries.popitem(last=False)
+
+    def bump(self):
+        """
+        Bump the catalog version and drop all the entries
+        """
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+
+catalog_cache = CatalogCache()
+
+
+def catalog_response(key: tuple, stmt):
+    """
+    Get the JSON response of the cars selected by the statement
+
+    The serialized body is reused from the cache when the query was already
+    run for the current catalog version
+
+    Variables:
+
+            <key> (tuple) the key of the query
+
+            <stmt> the select statement for the columns of the cars, see projections.py
+
+    Returns the response, or None if no cars match the query
+    """
+    cached = catalog_cache.get(key)
+    if cached is None:
+        version = catalog_cache.version
+        cars = db.session.execute(stmt).all()
+        if cars:
+            body = current_app.json.response(
+                serializer(CarSchema, many=True, exclude=['user_car']).dump(cars)
+            ).get_data()
+            cached = (body, sha1(body).hexdigest())
+        else:
+            cached = (None, None)
+        catalog_cache.set(key, version, cached)
+    body, etag = cached
+    if body is None:
+        return None
+    response = current_app.response_class(body, mimetype=current_app.json.mimetype)
+    response.set_etag(etag)
+    return response.make_conditional(request)
@@ -1,10 +1,48 @@
 """
 App config file containing the config object
 """
-from os import environ
+from os import environ, cpu_count
 from dotenv import load_dotenv
 load_dotenv()
 
+
+def replica_binds(uris: str) -> dict:
+    """
+    The SQLAlchemy binds of the comma separated read replica URIs, named
+    replica_1, replica_2...
+    """
+    uris = [uri.strip() for uri in (uris or '').split(',') if uri.strip()]
+    return {f'replica_{number}': uri for number, uri in enumerate(uris, 1)}
+
+
+# the engine options set from the environment, the option, variable and type
+ENGINE_OPTION_VARIABLES = (
+    ('pool_size', 'DB_POOL_SIZE', int),
+    ('max_overflow', 'DB_MAX_OVERFLOW', int),
+    ('pool_timeout', 'DB_POOL_TIMEOUT', float),
+    ('pool_recycle', 'DB_POOL_RECYCLE', int),
+    ('pool_pre_ping', 'DB_POOL_PRE_PING', lambda value: value == '1')
+)
+
+
+def engine_options(uri: str, defaults: dict) -> dict:
+    """
+    The SQLAlchemy engine options of the connection pools, from the environment
+    or the defaults of the config class. The options apply to the replica binds too.
+
+    DB_STATEMENT_TIMEOUT_MS sets the statement_timeout of each PostgreSQL
+    connection, it's ignored for other databases
+    """
+    options = dict(defaults)
+    for option, variable, convert in ENGINE_OPTION_VARIABLES:
+        if environ.get(variable):
+            options[option] = convert(environ[variable])
+    statement_timeout = environ.get("DB_STATEMENT_TIMEOUT_MS")
+    if statement_timeout and (uri or '').startswith('postgres'):
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout)}'}
+    return options
+
+
 class Config(object):
     """
     Config file object class
@@ -13,19 +51,56 @@ class Config(object):
     ENVIRONMENT = environ.get("ENVIRONMENT")
     FLASK_APP = environ.get("FLASK_APP")
     FLASK_ENV = environ.get("FLASK_ENV")
+    # process level identity cache, time to live in seconds (0 disables it)
+    IDENTITY_CACHE_TTL = int(environ.get("IDENTITY_CACHE_TTL") or 0)
+    IDENTITY_CACHE_SIZE = int(environ.get("IDENTITY_CACHE_SIZE") or 1024)
+    # car catalog response cache, time to live in seconds (0 disables it)
+    CATALOG_CACHE_TTL = int(environ.get("CATALOG_CACHE_TTL") or 60)
+    CATALOG_CACHE_SIZE = int(environ.get("CATALOG_CACHE_SIZE") or 256)
+    # statements slower than this are logged when the SQL instrumentation is on
+    SLOW_QUERY_MS = float(environ.get("SLOW_QUERY_MS") or 100)
+    # bcrypt work factor, and the threads and queue of the password hashing pool
+    BCRYPT_LOG_ROUNDS = int(environ.get("BCRYPT_LOG_ROUNDS") or 12)
+    BCRYPT_WORKERS = int(environ.get("BCRYPT_WORKERS") or cpu_count() or 2)
+    BCRYPT_QUEUE_SIZE = int(environ.get("BCRYPT_QUEUE_SIZE") or 16)
+    # seconds a user's reads stay on the primary database after writing
+    REPLICA_STICKY_SECONDS = float(environ.get("REPLICA_STICKY_SECONDS") or 5)
+    # threads of the report job pool, and the seconds before an unfinished job
+    # is submitted again when it's polled
+    REPORT_JOB_WORKERS = int(environ.get("REPORT_JOB_WORKERS") or 2)
+    REPORT_JOB_TIMEOUT = int(environ.get("REPORT_JOB_TIMEOUT") or 900)
 
 class DevConfig(Config):
     """
     Config file object class for Dev
     """
     SQLALCHEMY_DATABASE_URI = environ.get('DB_URI_DEV')
+    # read replicas, see replicas.py
+    SQLALCHEMY_BINDS = replica_binds(environ.get('DB_REPLICA_URIS_DEV'))
+    REPLICA_BINDS = list(SQLALCHEMY_BINDS)
+    # connection pools, SQLAlchemy's defaults unless set in the environment
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, {})
     SQLALCHEMY_TRACK_MODIFICATIONS = True
     FLASK_DEBUG = '1'
+    SQL_INSTRUMENTATION = (environ.get("SQL_INSTRUMENTATION") or '1') == '1'
 
 class ProdConfig(Config):
     """
     Config file object class for Prod
     """
     SQLALCHEMY_DATABASE_URI = environ.get('DB_URI')
+    # read replicas, see replicas.py
+    SQLALCHEMY_BINDS = replica_binds(environ.get('DB_REPLICA_URIS'))
+    REPLICA_BINDS = list(SQLALCHEMY_BINDS)
+    # connection pools of each worker process, a worker can open up to
+    # pool_size + max_overflow connections to each database
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, {
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True
+    })
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    FLASK_DEBUG = '0'
\ No newline at end of file
+    FLASK_DEBUG = '0'
+    SQL_INSTRUMENTATION = (environ.get("SQL_INSTRUMENTATION") or '0') == '1'
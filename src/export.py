@@ -0,0 +1,175 @@
+"""
+Export
+
+This module streams the full history of log entries and trips for one or more
+user cars as NDJSON or CSV.
+
+The rows are read with a server side cursor in chunks and each chunk is
+serialized and sent before the next one is read, so the memory used stays
+the same however long the history is. The response has no content length
+and is sent with chunked transfer encoding.
+
+Query string parameters:
+
+    format - 'ndjson' (default) or 'csv'
+"""
+import csv
+from io import StringIO
+from flask import Response, current_app, stream_with_context
+from marshmallow import EXCLUDE, fields
+from marshmallow.validate import OneOf
+from init import db, ma
+from models.log import LogEntry, LogEntrySchema
+from models.trip import Trip
+
+# number of rows read from the database cursor at a time
+EXPORT_CHUNK_SIZE = 1000
+
+# the CSV columns, log entries and trips share the columns they have in common
+CSV_COLUMNS = (
+    'type', 'id', 'user_car_id', 'date_added',
+    'current_odo', 'fuel_quantity', 'fuel_price', 'distance'
+)
+
+MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+class ExportSchema(ma.Schema):
+    """
+    Export schema for the export routes
+
+    Used to validate the query string parameters of the request
+    """
+    format = fields.String(validate=OneOf(list(MIMETYPES)), load_default='ndjson')
+    class Meta:
+        """
+        Defining the fields in a tuple and ordering the fields
+        """
+        fields = ('format',)
+        unknown = EXCLUDE
+
+
+def export_history(user_car_ids, export_format: str, filename: str) -> Response:
+    """
+    Stream the log entries and then the trips of the user cars
+
+    Variables:
+
+            <user_car_ids> a list or select statement of the user car ids
+
+            <export_format> (str) 'ndjson' or 'csv'
+
+            <filename> (str) the name of the download, without the extension
+
+    Returns the streamed response
+    """
+    return Response(
+        stream_with_context(export_chunks(user_car_ids, export_format)),
+        mimetype=MIMETYPES[export_format],
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}.{export_format}'
+        }
+    )
+
+
+def export_chunks(user_car_ids, export_format: str):
+    """
+    Yield the CSV header and then the serialized chunks of the log entries and
+    the trips of the user cars. The background export jobs save the chunks
+
+    Variables:
+
+            <user_car_ids> a list or select statement of the user car ids
+
+            <export_format> (str) 'ndjson' or 'csv'
+    """
+    if export_format == 'csv':
+        yield to_csv([CSV_COLUMNS])
+    for chunk in log_entry_chunks(user_car_ids):
+        yield serialize(chunk, export_format)
+    for chunk in trip_chunks(user_car_ids):
+        yield serialize(chunk, export_format)
+
+
+def log_entry_chunks(user_car_ids):
+    """
+    Read the log entries of the user cars in chunks, ordered by user car and date
+
+    Yields each chunk as a list of dicts, the dates of a chunk are converted together
+    """
+    stmt = db.select(
+        LogEntry.id, LogEntry.user_car_id, LogEntry.date_added,
+        LogEntry.current_odo, LogEntry.fuel_quantity, LogEntry.fuel_price
+    ).where(
+        LogEntry.user_car_id.in_(user_car_ids)
+    ).order_by(LogEntry.user_car_id, LogEntry.date_added, LogEntry.id)
+    for rows in stream_rows(stmt):
+        dates = LogEntrySchema.timestamps_to_dates([row.date_added for row in rows])
+        yield [
+            {
+                'type': 'log',
+                'id': row.id,
+                'user_car_id': row.user_car_id,
+                'date_added': date,
+                'current_odo': row.current_odo,
+                'fuel_quantity': row.fuel_quantity,
+                'fuel_price': row.fuel_price
+            }
+            for row, date in zip(rows, dates)
+        ]
+
+
+def trip_chunks(user_car_ids):
+    """
+    Read the trips of the user cars in chunks, ordered by user car and id
+
+    Yields each chunk as a list of dicts
+    """
+    stmt = db.select(
+        Trip.id, Trip.user_car_id, Trip.fuel_price, Trip.distance
+    ).where(
+        Trip.user_car_id.in_(user_car_ids)
+    ).order_by(Trip.user_car_id, Trip.id)
+    for rows in stream_rows(stmt):
+        yield [
+            {
+                'type': 'trip',
+                'id': row.id,
+                'user_car_id': row.user_car_id,
+                'fuel_price': row.fuel_price,
+                'distance': row.distance
+            }
+            for row in rows
+        ]
+
+
+def stream_rows(stmt):
+    """
+    Execute the statement with a server side cursor and yield the rows in chunks
+    """
+    result = db.session.execute(
+        stmt.execution_options(stream_results=True, max_row_buffer=EXPORT_CHUNK_SIZE)
+    )
+    yield from result.partitions(EXPORT_CHUNK_SIZE)
+
+
+def serialize(records: list, export_format: str) -> str:
+    """
+    Serialize a chunk of records as NDJSON lines or CSV rows
+    """
+    if export_format == 'csv':
+        return to_csv([record.get(column, '') for column in CSV_COLUMNS] for record in records)
+    dumps = current_app.json.dumps
+    return ''.join(dumps(record) + '\n' for record in records)
+
+
+def to_csv(rows) -> str:
+    """
+    Write the rows as CSV text
+    """
+    text = StringIO()
+    csv.writer(text).writerows(rows)
+    return text.getvalue()
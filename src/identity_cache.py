@@ -0,0 +1,199 @@
+"""
+Identity Cache
+
+This module caches the user resolved from the JWT identity and the user
+cars the user owns, so the ``verify_user`` and ``verify_user_car`` helpers
+don't need a round trip to the database on every call.
+
+The cache has two levels:
+
+    per request - the resolved User and UserCar objects are kept on ``flask.g``
+    for the rest of the request
+
+    process - an optional LRU of the column values shared between requests.
+    Entries expire after ``IDENTITY_CACHE_TTL`` seconds, a TTL of 0 disables it.
+    The TTL should be kept short as other worker processes can't invalidate it
+
+Entries are invalidated when the ownership of user cars changes, that is when
+a car is added or removed from a user's list or a user is deleted.
+"""
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from flask import current_app, g
+from sqlalchemy.orm import make_transient_to_detached
+from init import db
+from models.user import User
+from models.user_car import UserCar
+
+
+class IdentityCache:
+    """
+    Process level LRU cache of user identities
+
+    Each entry is keyed by the user id and holds a tuple of the user's
+    column values and a dict mapping the owned user car ids to car ids
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def ttl() -> int:
+        """
+        The time to live for an entry, 0 when the cache is disabled
+        """
+        return current_app.config.get('IDENTITY_CACHE_TTL', 0)
+
+    def get(self, user_id: int) -> tuple:
+        """
+        Get the cached entry for the user, None if it's missing or expired
+        """
+        if not self.ttl():
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return value
+
+    def set(self, user_id: int, value: tuple):
+        """
+        Add or replace the entry for the user, evicting the least recently used
+        """
+        ttl = self.ttl()
+        if not ttl:
+            return
+        with self._lock:
+            self._entries[user_id] = (monotonic() + ttl, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > current_app.config.get('IDENTITY_CACHE_SIZE', 1024):
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """
+        Remove the entry for the user
+        """
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+identity_cache = IdentityCache()
+
+
+def get_user(user_id: int) -> User:
+    """
+    Get the user for the user id, checking the request and process caches
+    before querying the database
+
+    Returns the user object
+    """
+    if g.get('identity_user_id') == user_id and g.identity_user is not None:
+        return g.identity_user
+    cached = identity_cache.get(user_id)
+    if cached:
+        # attach the user to the session from the cached column values
+        user = _attach(User, cached[0])
+    else:
+        stmt = db.select(User).filter_by(id=user_id)
+        user = db.session.scalar(stmt)
+        if user:
+            # the user's cars are added on the first call to get_user_car
+            identity_cache.set(user_id, (_columns(user), None))
+    g.identity_user = user
+    g.identity_user_id = user_id
+    return user
+
+
+def get_user_car(user_id: int, user_car_id: int) -> UserCar:
+    """
+    Get the user car if it belongs to the user, the user's cars are loaded
+    once and kept in the caches
+
+    Returns the user car object
+    """
+    user_cars = g.get('identity_user_cars')
+    if user_cars is None or g.get('identity_user_cars_for') != user_id:
+        cached = identity_cache.get(user_id)
+        if cached and cached[1] is not None:
+            user_cars = {
+                owned_id: (car_id, None)
+                for owned_id, car_id in cached[1].items()
+            }
+        else:
+            # load all of the user's cars in one query
+            stmt = db.select(UserCar).filter_by(user_id=user_id)
+            user_cars = {
+                user_car.id: (user_car.car_id, user_car)
+                for user_car in db.session.scalars(stmt)
+            }
+            user = get_user(user_id)
+            if user is not None:
+                identity_cache.set(user_id, (
+                    _columns(user),
+                    {owned_id: value[0] for owned_id, value in user_cars.items()}
+                ))
+        g.identity_user_cars = user_cars
+        g.identity_user_cars_for = user_id
+    if user_car_id not in user_cars:
+        return None
+    car_id, user_car = user_cars[user_car_id]
+    if user_car is None:
+        # attach the user car to the session from the cached ids
+        user_car = _attach(UserCar, {'id': user_car_id, 'user_id': user_id, 'car_id': car_id})
+        user_cars[user_car_id] = (car_id, user_car)
+    return user_car
+
+
+def invalidate_user(user_id: int):
+    """
+    Invalidate the cached identity and owned cars for the user
+    """
+    identity_cache.invalidate(user_id)
+    if g.get('identity_user_cars_for') == user_id:
+        g.pop('identity_user_cars', None)
+        g.pop('identity_user_cars_for', None)
+    if g.get('identity_user_id') == user_id:
+        g.pop('identity_user', None)
+        g.pop('identity_user_id', None)
+
+
+def invalidate_all():
+    """
+    Invalidate every cached identity, used when the ownership of many
+    users' cars changes
+    """
+    identity_cache.clear()
+    g.pop('identity_user', None)
+    g.pop('identity_user_id', None)
+    g.pop('identity_user_cars', None)
+    g.pop('identity_user_cars_for', None)
+
+
+def _columns(obj) -> dict:
+    """
+    The column values of a model instance
+    """
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+
+def _attach(model, columns: dict):
+    """
+    Attach an instance of the model built from cached column values to the
+    session without querying the database
+    """
+    obj = model(**columns)
+    make_transient_to_detached(obj)
+    return db.session.merge(obj, load=False)
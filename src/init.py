@@ -3,14 +3,31 @@ Intialising the Flask app.
 
 This Module creates instances of SQLAlchemy, Marshmallow, JWTManager, Bcrypt.
 
-The instances are assigned to db, ma, jwt, and bcrypt respectively
+The instances are assigned to db, ma, jwt, and bcrypt respectively. The
+session of db is the RoutingSession from replicas.py
+
+The ``dialect_insert`` helper returns the INSERT construct of the database dialect in use,
+which supports ``ON CONFLICT`` on PostgreSQL and SQLite.
 """
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager
 from flask_marshmallow import Marshmallow
+from sqlalchemy.dialects import postgresql, sqlite
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+# the session sends the reads of read only requests to the replicas, see replicas.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 ma = Marshmallow()
 jwt = JWTManager()
 bcrypt = Bcrypt()
+
+
+def dialect_insert(table):
+    """
+    The INSERT statement of the table for the dialect of the database, for
+    ``on_conflict_do_update`` and ``on_conflict_do_nothing``
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
@@ -0,0 +1,87 @@
+"""
+Instrumentation
+
+This module counts the SQL statements of each request and the time spent in the
+database. The counts are sent in the response headers:
+
+    ``X-DB-Queries: 4``
+
+    ``Server-Timing: db;dur=1.52;desc="4 queries"``
+
+Statements slower than SLOW_QUERY_MS are logged with the route and parameters.
+
+The instrumentation is turned on with SQL_INSTRUMENTATION, on by default in
+DevConfig and off by default in ProdConfig. When it's off no engine listeners or
+request hooks are registered, so it costs nothing.
+
+The headers of a streamed response are sent before its body, so they only count
+the statements executed before the response is returned.
+"""
+from time import perf_counter
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from init import db
+
+# max length of the parameters in the slow query log
+LOG_PARAMETERS_LENGTH = 500
+
+
+def init_instrumentation(app):
+    """
+    Register the engine listeners and the request hooks if SQL_INSTRUMENTATION
+    is on in the app config
+    """
+    if not app.config.get('SQL_INSTRUMENTATION'):
+        return
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    app.before_request(start_request)
+    app.after_request(add_headers)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Engine event listener, records the start time of the statement on the connection
+    """
+    conn.info.setdefault('query_start', []).append(perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Engine event listener, adds the statement to the count and time of the
+    request and logs it if it's slow
+    """
+    elapsed = perf_counter() - conn.info['query_start'].pop()
+    if not has_app_context():
+        return
+    g.db_queries = g.get('db_queries', 0) + 1
+    g.db_time = g.get('db_time', 0) + elapsed
+    if elapsed * 1000 >= current_app.config['SLOW_QUERY_MS']:
+        route = f'{request.method} {request.path}' if has_request_context() else 'no request'
+        current_app.logger.warning(
+            'Slow query %.1fms in %s: %s parameters: %s',
+            elapsed * 1000, route, statement, repr(parameters)[:LOG_PARAMETERS_LENGTH]
+        )
+
+
+def start_request():
+    """
+    Reset the statement count and time at the start of the request
+    """
+    g.db_queries = 0
+    g.db_time = 0
+
+
+def add_headers(response):
+    """
+    Add the statement count and time of the request to the response headers
+    """
+    queries = g.get('db_queries', 0)
+    response.headers['X-DB-Queries'] = str(queries)
+    response.headers.add(
+        'Server-Timing', f'db;dur={g.get("db_time", 0) * 1000:.2f};desc="{queries} queries"'
+    )
+    return response
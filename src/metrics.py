@@ -0,0 +1,241 @@
+"""
+Metrics
+
+This module records the latency and status codes of each request and the errors
+handled by the app's error handlers, and serves them at ``/metrics`` in the
+Prometheus text format with the connection pool gauges:
+
+    ``http_request_duration_seconds`` - histogram by blueprint and endpoint
+
+    ``http_responses_total`` - counter by blueprint, endpoint and status code
+
+    ``app_errors_total`` - counter by error handler
+
+    ``db_pool_checked_out``, ``db_pool_overflow``, ``db_pool_size`` - gauges by bind
+
+Each thread records to its own accumulator without locking. The accumulators are
+only added together when the metrics are scraped, and the accumulators of
+finished threads are folded into one so the number kept follows the live threads.
+"""
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from flask import Response, g, request
+from init import db
+
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# the methods of the connection pools read for the pool stats
+POOL_STATS = ('size', 'checkedin', 'checkedout', 'overflow')
+
+
+class Metrics:
+    """
+    Request metrics kept in per thread accumulators
+
+    An accumulator is a dict of:
+
+        durations - {(blueprint, endpoint): [count of each bucket..., +Inf count, sum]}
+
+        responses - {(blueprint, endpoint, status): count}
+
+        errors - {error: count}
+    """
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.local = threading.local()
+        # the accumulators of the live threads, and the totals of finished threads
+        self.threads = []
+        self.retired = self.new_accumulator()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def new_accumulator() -> dict:
+        """
+        An empty accumulator
+        """
+        return {'durations': {}, 'responses': {}, 'errors': {}}
+
+    def accumulator(self) -> dict:
+        """
+        The accumulator of the current thread, the lock is only taken the first
+        time a thread records
+        """
+        try:
+            return self.local.accumulator
+        except AttributeError:
+            accumulator = self.local.accumulator = self.new_accumulator()
+            with self.lock:
+                self.retire_finished()
+                self.threads.append((threading.current_thread(), accumulator))
+            return accumulator
+
+    def observe(self, blueprint: str, endpoint: str, status: int, seconds: float):
+        """
+        Record the latency and status code of a request
+        """
+        accumulator = self.accumulator()
+        durations = accumulator['durations'].get((blueprint, endpoint))
+        if durations is None:
+            durations = accumulator['durations'][(blueprint, endpoint)] = \
+                                                    [0] * (len(self.buckets) + 2)
+        durations[bisect_left(self.buckets, seconds)] += 1
+        durations[-1] += seconds
+        responses = accumulator['responses']
+        key = (blueprint, endpoint, status)
+        responses[key] = responses.get(key, 0) + 1
+
+    def record_error(self, error: str):
+        """
+        Record an error handled by one of the app's error handlers
+        """
+        errors = self.accumulator()['errors']
+        errors[error] = errors.get(error, 0) + 1
+
+    def retire_finished(self):
+        """
+        Fold the accumulators of finished threads into the retired totals,
+        the lock must be held
+        """
+        live = []
+        for thread, accumulator in self.threads:
+            if thread.is_alive():
+                live.append((thread, accumulator))
+            else:
+                merge(self.retired, accumulator)
+        self.threads = live
+
+    def snapshot(self) -> dict:
+        """
+        The totals of all the accumulators. The accumulators of other threads
+        are copied before reading, a dict copy is atomic
+        """
+        with self.lock:
+            self.retire_finished()
+            totals = self.new_accumulator()
+            merge(totals, self.retired)
+            for _, accumulator in self.threads:
+                merge(totals, {name: values.copy() for name, values in accumulator.items()})
+        return totals
+
+    def render(self) -> str:
+        """
+        The metrics in the Prometheus text format
+        """
+        totals = self.snapshot()
+        lines = [
+            '# HELP http_request_duration_seconds Request latency by endpoint',
+            '# TYPE http_request_duration_seconds histogram'
+        ]
+        for (blueprint, endpoint), durations in sorted(totals['durations'].items()):
+            labels = f'blueprint="{blueprint}",endpoint="{endpoint}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), durations):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {durations[-1]}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {cumulative}')
+        lines += [
+            '# HELP http_responses_total Responses by endpoint and status code',
+            '# TYPE http_responses_total counter'
+        ]
+        for (blueprint, endpoint, status), count in sorted(totals['responses'].items()):
+            lines.append(f'http_responses_total{{blueprint="{blueprint}",endpoint="{endpoint}",'
+                         f'status="{status}"}} {count}')
+        lines += [
+            '# HELP app_errors_total Errors handled by the app error handlers',
+            '# TYPE app_errors_total counter'
+        ]
+        for error, count in sorted(totals['errors'].items()):
+            lines.append(f'app_errors_total{{error="{error}"}} {count}')
+        lines += pool_gauges()
+        return '\n'.join(lines) + '\n'
+
+
+def merge(totals: dict, accumulator: dict):
+    """
+    Add the counts of an accumulator to the totals
+    """
+    for key, durations in accumulator['durations'].items():
+        total = totals['durations'].setdefault(key, [0] * len(durations))
+        for index, value in enumerate(durations):
+            total[index] += value
+    for name in ('responses', 'errors'):
+        for key, count in accumulator[name].items():
+            totals[name][key] = totals[name].get(key, 0) + count
+
+
+def pool_stats() -> dict:
+    """
+    The live stats of the connection pool of each database bind, the stats a
+    pool doesn't have such as the size of the SQLite memory pool are left out
+    """
+    stats = {}
+    for bind, engine in db.engines.items():
+        pool_stat = {}
+        for method in POOL_STATS:
+            value = getattr(engine.pool, method, None)
+            if callable(value):
+                # the pool counts the overflow from -size, below 0 there's no overflow
+                pool_stat[method] = max(value(), 0)
+        stats[bind or 'default'] = pool_stat
+    return stats
+
+
+def pool_gauges() -> list:
+    """
+    The connection pool gauges of each database bind
+    """
+    gauges = {'db_pool_checked_out': 'checkedout', 'db_pool_overflow': 'overflow',
+              'db_pool_size': 'size'}
+    stats = pool_stats()
+    lines = []
+    for name, method in gauges.items():
+        lines += [f'# HELP {name} Connection pool {method}', f'# TYPE {name} gauge']
+        for bind, pool_stat in stats.items():
+            if method in pool_stat:
+                lines.append(f'{name}{{bind="{bind}"}} {pool_stat[method]}')
+    return lines
+
+
+metrics = Metrics()
+
+
+def init_metrics(app):
+    """
+    Register the request hooks and the /metrics route
+    """
+    app.before_request(start_timer)
+    app.after_request(record_response)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+def start_timer():
+    """
+    Record the start time of the request
+    """
+    g.metrics_start = perf_counter()
+
+
+def record_response(response):
+    """
+    Record the latency and status code of the request
+    """
+    start = g.get('metrics_start')
+    if start is not None:
+        metrics.observe(
+            request.blueprint or 'app', request.endpoint or 'not_found',
+            response.status_code, perf_counter() - start
+        )
+    return response
+
+
+def metrics_view():
+    """
+    Metrics
+
+    The request metrics and connection pool gauges in the Prometheus text format
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -10,7 +10,7 @@ The Car Model contains the following attributes:
 from datetime import datetime
 from marshmallow import fields
 from marshmallow.validate import Regexp, Range, Length
-from init import db, ma
+from init import db, ma, dialect_insert
 
 class Car(db.Model):
     """
@@ -37,6 +37,38 @@ class Car(db.Model):
     user_car = db.relationship('UserCar', backref='car')
 
 
+    @classmethod
+    def upsert(cls, car_info: dict) -> tuple:
+        """
+        Insert the car into the catalog if it isn't already there, using the unique
+        constraint on all the columns.
+
+        The conflict does a no-op update so the id of the existing car is returned
+        in the same statement. PostgreSQL reports if the row was inserted from the
+        xmax system column, other databases always report it as inserted
+
+        Returns a tuple of (car id, inserted)
+        """
+        table = cls.__table__
+        stmt = dialect_insert(table).values(
+            make= car_info['make'],
+            model= car_info['model'],
+            model_trim= car_info['model_trim'],
+            year= car_info['year'],
+            tank_size= car_info['tank_size']
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.make, table.c.model, table.c.model_trim,
+                            table.c.year, table.c.tank_size],
+            set_={'make': stmt.excluded.make}
+        )
+        if db.session.get_bind().dialect.name == 'postgresql':
+            inserted = db.literal_column('xmax = 0')
+        else:
+            inserted = db.true()
+        return tuple(db.session.execute(stmt.returning(table.c.id, inserted)).one())
+
+
 class CarSchema(ma.Schema):
     """
     Car model Schema
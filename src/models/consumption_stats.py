@@ -0,0 +1,173 @@
+"""
+Consumption Stats Model
+
+This module contains the ConsumptionStats model. The model holds the running
+statistics of a user car's log entries so the trip calculator doesn't need to
+load the whole log history.
+
+The ConsumptionStats model contains the following attributes:
+
+    user_car_id (Primary Key, Foreign Key), log_count, total_fuel, first_odo,
+
+    first_fuel, second_odo, last_odo, last_fuel, last_date, last_log_id
+"""
+from init import db
+from models.log import LogEntry
+
+
+class ConsumptionStats(db.Model):
+    """
+    The ConsumptionStats model representing the consumption stats entity in the database.
+
+    Creates a model instance of the database instance.
+
+    The stats are updated in the same transaction as the log entry writes. The
+    totals are adjusted by the change, the first (oldest) and last (newest) entry
+    values are reloaded from the (user_car_id, date_added) index when the
+    written entry can be one of them.
+
+    Attributes:
+
+        log_count (int), total_fuel (int), first_odo (int), first_fuel (int),
+
+        second_odo (int), last_odo (int), last_fuel (int), last_date (int),
+
+        last_log_id (int)
+    """
+    __tablename__ = 'consumption_stats'
+    # model attributes
+    user_car_id = db.Column(
+                            db.Integer,
+                            db.ForeignKey('user_cars.id', ondelete='cascade'),
+                            primary_key=True
+                        )
+    log_count = db.Column(db.Integer, nullable=False, default=0)
+    total_fuel = db.Column(db.Integer, nullable=False, default=0)
+    # oldest entries
+    first_odo = db.Column(db.Integer)
+    first_fuel = db.Column(db.Integer)
+    second_odo = db.Column(db.Integer)
+    # newest entry, the last fill up
+    last_odo = db.Column(db.Integer)
+    last_fuel = db.Column(db.Integer)
+    last_date = db.Column(db.BigInteger)
+    last_log_id = db.Column(db.Integer)
+
+
+    @property
+    def avg_consumption(self) -> float:
+        """
+        The average consumption in L/100km, None if there aren't more than 2
+        log entries or no distance was travelled between them.
+
+        The fuel from a fill up is used until the next fill up. The fuel from the
+        oldest and newest entries is left out and the distance is from the second
+        oldest to the newest entry
+        """
+        if self.log_count <= 2:
+            return None
+        total_fuel = self.total_fuel - self.first_fuel - self.last_fuel
+        distance_travelled = self.last_odo - self.second_odo
+        if distance_travelled <= 0:
+            return None
+        return (total_fuel) / (distance_travelled / 100)
+
+
+    @classmethod
+    def for_user_car(cls, user_car_id: int, lock: bool = False) -> 'ConsumptionStats':
+        """
+        Get the stats for the user car, the stats are built from the log entries
+        if they don't exist yet.
+
+        The log entry write routes lock the row until the transaction is committed
+        so concurrent writes to the same user car are applied one at a time
+        """
+        stats = db.session.get(cls, user_car_id, with_for_update=lock)
+        if stats is None:
+            stats = cls.rebuild(user_car_id)
+        return stats
+
+
+    @classmethod
+    def rebuild(cls, user_car_id: int) -> 'ConsumptionStats':
+        """
+        Rebuild the stats for the user car from scratch using its log entries
+        """
+        stats = db.session.get(cls, user_car_id)
+        if stats is None:
+            stats = cls(user_car_id=user_car_id)
+            db.session.add(stats)
+        stmt = db.select(
+            db.func.count(LogEntry.id),
+            db.func.coalesce(db.func.sum(LogEntry.fuel_quantity), 0)
+        ).filter_by(user_car_id=user_car_id)
+        stats.log_count, stats.total_fuel = db.session.execute(stmt).one()
+        stats.refresh_first()
+        stats.refresh_last()
+        return stats
+
+
+    def refresh_first(self):
+        """
+        Reload the values of the two oldest log entries
+        """
+        stmt = db.select(LogEntry.current_odo, LogEntry.fuel_quantity).filter_by(
+                                    user_car_id=self.user_car_id
+                                ).order_by(LogEntry.date_added, LogEntry.id).limit(2)
+        oldest = db.session.execute(stmt).all()
+        self.first_odo, self.first_fuel = oldest[0] if oldest else (None, None)
+        self.second_odo = oldest[1].current_odo if len(oldest) > 1 else None
+
+
+    def refresh_last(self):
+        """
+        Reload the values of the newest log entry
+        """
+        stmt = db.select(
+                    LogEntry.id, LogEntry.current_odo, LogEntry.fuel_quantity, LogEntry.date_added
+                ).filter_by(
+                    user_car_id=self.user_car_id
+                ).order_by(LogEntry.date_added.desc(), LogEntry.id.desc()).limit(1)
+        newest = db.session.execute(stmt).first()
+        self.last_log_id, self.last_odo, self.last_fuel, self.last_date = \
+                                                newest or (None, None, None, None)
+
+
+    def add_entry(self, log_entry: LogEntry):
+        """
+        Add a new log entry to the stats, the log entry must be flushed
+        """
+        self.log_count += 1
+        self.total_fuel += log_entry.fuel_quantity
+        if self.last_date is None or \
+                (log_entry.date_added, log_entry.id) > (self.last_date, self.last_log_id):
+            # the new entry is the last fill up
+            self.last_log_id = log_entry.id
+            self.last_odo = log_entry.current_odo
+            self.last_fuel = log_entry.fuel_quantity
+            self.last_date = log_entry.date_added
+            if self.log_count <= 2:
+                self.refresh_first()
+        else:
+            # an older entry can be one of the two oldest entries
+            self.refresh_first()
+
+
+    def update_entry(self, old_fuel_quantity: int, log_entry: LogEntry):
+        """
+        Update the stats for a changed log entry, the change must be flushed
+        """
+        self.total_fuel += log_entry.fuel_quantity - old_fuel_quantity
+        self.refresh_first()
+        self.refresh_last()
+
+
+    def delete_entry(self, log_entry: LogEntry):
+        """
+        Remove a deleted log entry from the stats, the delete must be flushed
+        """
+        self.log_count -= 1
+        self.total_fuel -= log_entry.fuel_quantity
+        self.refresh_first()
+        if log_entry.id == self.last_log_id:
+            self.refresh_last()
@@ -11,8 +11,8 @@ The Log Entry Model contains the following attributes:
 """
 from datetime import datetime, timezone, timedelta
 from time import timezone as tz
-from marshmallow import fields
-from marshmallow.validate import Range
+from marshmallow import fields, ValidationError
+from marshmallow.validate import Range, OneOf, Length
 from init import db, ma
 
 
@@ -32,6 +32,8 @@ class LogEntry(db.Model):
     # and sets at a time delta in datetime.timezone
     current_timezone = timezone(timedelta(hours= tz/3600.0 * -1 ))
     __tablename__ = 'log_entries'
+    # index the user car's log history by date for the expenditure reports
+    __table_args__ = (db.Index('ix_log_entries_user_car_id_date_added', 'user_car_id', 'date_added'),)
     # model attributes
     id = db.Column(db.Integer, primary_key=True)
     current_odo = db.Column(db.Integer, nullable=False)
@@ -97,6 +99,48 @@ class LogEntrySchema(ma.Schema):
         return str(datetime.fromtimestamp(obj.date_added).date())
 
 
+    @classmethod
+    def timestamps_to_dates(cls, timestamps: list) -> list:
+        """
+        Class method to convert a list of timestamps to datetime dates in bulk,
+        returned as strings. Only the first timestamp of each day is converted,
+        the following timestamps in the same day reuse the date
+        """
+        dates = []
+        day_start = day_end = None
+        for timestamp in timestamps:
+            if day_start is None or not day_start <= timestamp < day_end:
+                day = datetime.fromtimestamp(timestamp).date()
+                midnight = datetime.combine(day, datetime.min.time())
+                day_start = midnight.timestamp()
+                day_end = (midnight + timedelta(days=1)).timestamp()
+                date = str(day)
+            dates.append(date)
+        return dates
+
+
+    @classmethod
+    def date_to_timestamp(cls, value: str) -> int:
+        """
+        Class method to convert an ISO date or datetime string to a timestamp.
+        This is for the schema load
+        """
+        try:
+            return int(datetime.fromisoformat(value).timestamp())
+        except (TypeError, ValueError) as err:
+            raise ValidationError('Not a valid date, must be YYYY-MM-DD') from err
+
+
+class LogEntryImportSchema(LogEntrySchema):
+    """
+    Log Entry import schema for the import route
+
+    The same as the LogEntrySchema, except the date of the fill up can be loaded.
+    The single log entry routes don't take the date and reject it as unknown
+    """
+    date_added = fields.Method("timestamp_to_date", deserialize="date_to_timestamp")
+
+
 
 class ExpenditureSchema(ma.Schema):
     """
@@ -147,3 +191,38 @@ class ExpenditureCompareSchema(ma.Schema):
         fields = ('from_date', 'to_date', 'compare_to_date', 'compare_from_date')
         ordered = True
         dateformat = '%Y-%m-%d'
+
+
+class ExpenditureReportSchema(ExpenditureSchema):
+    """
+    Expenditure report schema for the expenditure report route.
+
+    Used to validate the dates and the period of the buckets
+    """
+    period = fields.String(
+        required=True,
+        validate=OneOf(['week', 'month', 'year'])
+    )
+    class Meta:
+        """
+        Defining the fields in a tuple and ordering the fields
+        """
+        fields = ('from_date', 'to_date', 'period')
+        ordered = True
+        dateformat = '%Y-%m-%d'
+
+class ExpenditurePeriodsSchema(ma.Schema):
+    """
+    Compare Expenditures for any number of time periods
+    """
+    periods = fields.List(
+        fields.Nested(ExpenditureSchema),
+        required=True,
+        validate=Length(min=2, max=24)
+    )
+    class Meta:
+        """
+        Defining the fields in a tuple and ordering the fields
+        """
+        fields = ('periods',)
+        ordered = True
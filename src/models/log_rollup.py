@@ -0,0 +1,153 @@
+"""
+Log Rollup Model
+
+This module contains the LogRollup model. The model holds the monthly totals of
+a user car's log entries so the expenditure reports can read whole months
+without scanning the log entries.
+
+The LogRollup model contains the following attributes:
+
+    user_car_id (Primary Key, Foreign Key), month (Primary Key), log_count,
+
+    total_cost, total_litres, min_odo, max_odo
+"""
+from datetime import datetime
+from init import db
+from models.log import LogEntry
+
+
+class LogRollup(db.Model):
+    """
+    The LogRollup model representing the log rollups entity in the database.
+
+    Creates a model instance of the database instance.
+
+    The month is the local start date of the month (YYYY-MM-01), the same as the
+    month buckets of the expenditure reports. A new log entry is added to the
+    totals of its month, an updated or deleted log entry's month is recalculated
+    from the log entries in the month.
+
+    Attributes:
+
+        month (str), log_count (int), total_cost (float), total_litres (int),
+
+        min_odo (int), max_odo (int)
+    """
+    __tablename__ = 'log_rollups'
+    # model attributes
+    user_car_id = db.Column(
+                            db.Integer,
+                            db.ForeignKey('user_cars.id', ondelete='cascade'),
+                            primary_key=True
+                        )
+    month = db.Column(db.String(10), primary_key=True)
+    log_count = db.Column(db.Integer, nullable=False, default=0)
+    total_cost = db.Column(db.Float, nullable=False, default=0)
+    total_litres = db.Column(db.Integer, nullable=False, default=0)
+    min_odo = db.Column(db.Integer)
+    max_odo = db.Column(db.Integer)
+
+
+    @staticmethod
+    def month_of(timestamp: float) -> str:
+        """
+        The local start date of the month of a timestamp
+        """
+        return datetime.fromtimestamp(timestamp).strftime('%Y-%m-01')
+
+
+    @staticmethod
+    def month_range(month: str) -> tuple:
+        """
+        The timestamps of the start of the month and the start of the next month
+        """
+        start = datetime.strptime(month, '%Y-%m-%d')
+        end = start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+        return start.timestamp(), end.timestamp()
+
+
+    @classmethod
+    def add_entry(cls, log_entry: LogEntry):
+        """
+        Add a new log entry to the totals of its month. The month is locked until
+        the transaction is committed
+        """
+        month = cls.month_of(log_entry.date_added)
+        rollup = db.session.get(cls, (log_entry.user_car_id, month), with_for_update=True)
+        if rollup is None:
+            rollup = cls(user_car_id=log_entry.user_car_id, month=month, log_count=0,
+                         total_cost=0, total_litres=0)
+            db.session.add(rollup)
+        rollup.log_count += 1
+        rollup.total_cost += log_entry.fuel_price * log_entry.fuel_quantity
+        rollup.total_litres += log_entry.fuel_quantity
+        if rollup.min_odo is None or log_entry.current_odo < rollup.min_odo:
+            rollup.min_odo = log_entry.current_odo
+        if rollup.max_odo is None or log_entry.current_odo > rollup.max_odo:
+            rollup.max_odo = log_entry.current_odo
+
+
+    @classmethod
+    def refresh(cls, user_car_id: int, month: str):
+        """
+        Recalculate the totals of the month from the user car's log entries,
+        the changes to the log entries must be flushed
+        """
+        start, end = cls.month_range(month)
+        stmt = db.select(
+            db.func.count(LogEntry.id),
+            db.func.sum(LogEntry.fuel_price * LogEntry.fuel_quantity),
+            db.func.sum(LogEntry.fuel_quantity),
+            db.func.min(LogEntry.current_odo),
+            db.func.max(LogEntry.current_odo)
+        ).where(
+            db.and_(
+                LogEntry.user_car_id == user_car_id,
+                LogEntry.date_added >= start,
+                LogEntry.date_added < end
+            )
+        )
+        log_count, total_cost, total_litres, min_odo, max_odo = db.session.execute(stmt).one()
+        rollup = db.session.get(cls, (user_car_id, month), with_for_update=True)
+        if not log_count:
+            if rollup is not None:
+                db.session.delete(rollup)
+            return
+        if rollup is None:
+            rollup = cls(user_car_id=user_car_id, month=month)
+            db.session.add(rollup)
+        rollup.log_count = log_count
+        rollup.total_cost = total_cost
+        rollup.total_litres = total_litres
+        rollup.min_odo = min_odo
+        rollup.max_odo = max_odo
+
+
+    @classmethod
+    def rebuild(cls, user_car_id: int):
+        """
+        Rebuild all the months of the user car from scratch using its log entries
+        """
+        db.session.execute(db.delete(cls).filter_by(user_car_id=user_car_id))
+        stmt = db.select(
+            LogEntry.date_added, LogEntry.current_odo, LogEntry.fuel_quantity, LogEntry.fuel_price
+        ).filter_by(user_car_id=user_car_id)
+        months = {}
+        for date_added, current_odo, fuel_quantity, fuel_price in db.session.execute(
+            stmt.execution_options(stream_results=True, yield_per=1000)
+        ):
+            month = cls.month_of(date_added)
+            if month not in months:
+                months[month] = {
+                    'user_car_id': user_car_id, 'month': month, 'log_count': 0,
+                    'total_cost': 0, 'total_litres': 0,
+                    'min_odo': current_odo, 'max_odo': current_odo
+                }
+            rollup = months[month]
+            rollup['log_count'] += 1
+            rollup['total_cost'] += fuel_price * fuel_quantity
+            rollup['total_litres'] += fuel_quantity
+            rollup['min_odo'] = min(rollup['min_odo'], current_odo)
+            rollup['max_odo'] = max(rollup['max_odo'], current_odo)
+        if months:
+            db.session.execute(db.insert(cls), list(months.values()))
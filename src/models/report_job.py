@@ -0,0 +1,257 @@
+"""
+Report Job Model and Schema
+
+This module contains the ReportJob, ReportJobChunk model and ReportJobSchema
+classes. The models hold the report and export jobs run in the background by
+report_jobs.py, and their results.
+
+The ReportJob model contains the following attributes:
+
+    id, user_id (Foreign Key), user_car_id (Foreign Key), kind, params, params_key,
+
+    status, stale, result_status, mimetype, filename, error,
+
+    created_at, started_at, finished_at
+
+The ReportJobChunk model contains the following attributes:
+
+    job_id (Foreign Key, Primary Key), position (Primary Key), data
+"""
+import json
+from datetime import datetime
+from hashlib import sha256
+from marshmallow import fields
+from init import db, ma
+from models.user_car import UserCar
+
+# the statuses of a job, a pending job is waiting for a worker
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class ReportJob(db.Model):
+    """
+    The ReportJob model representing the report jobs entity in the database.
+
+    Creates a model instance of the database instance.
+
+    A finished job's result is reused for the same user car, kind and parameters
+    until the job is stale. The log entry and trip writes mark the jobs of the
+    user car, and the user's jobs of all their cars, stale in the same
+    transaction, as do the admin's updates and deletes of the car in the
+    catalog. A job that is running when it's marked stale still finishes and
+    its result is downloaded, but it isn't reused.
+
+    Attributes:
+
+        kind (str), params (str), params_key (str), status (str), stale (bool),
+
+        result_status (int), mimetype (str), filename (str),
+
+        error (str), created_at (int), started_at (int), finished_at (int)
+    """
+    __tablename__ = 'report_jobs'
+    # the cached jobs are looked up by user, kind and parameters
+    __table_args__ = (
+        db.Index('ix_report_jobs_user_id_kind_params_key', 'user_id', 'kind', 'params_key'),
+        db.Index('ix_report_jobs_user_car_id', 'user_car_id')
+    )
+    # model attributes
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    # the parameters of the job as JSON, and their hash
+    params = db.Column(db.Text, nullable=False)
+    params_key = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default=PENDING)
+    stale = db.Column(db.Boolean, nullable=False, default=False)
+    # the status code and type of the result, the filename of downloads. The body
+    # is saved in chunks
+    result_status = db.Column(db.Integer)
+    mimetype = db.Column(db.String(50))
+    filename = db.Column(db.String(100))
+    error = db.Column(db.String())
+    created_at = db.Column(db.BigInteger, nullable=False)
+    started_at = db.Column(db.BigInteger)
+    finished_at = db.Column(db.BigInteger)
+    # Foreign Keys, the jobs of all the user's cars have no user car
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='cascade'), nullable=False)
+    user_car_id = db.Column(db.Integer, db.ForeignKey('user_cars.id', ondelete='cascade'))
+    # relationships to foreign key in other table (not model defined attributes)
+    chunks = db.relationship('ReportJobChunk', cascade='all, delete-orphan')
+
+
+    @staticmethod
+    def params_hash(params: dict) -> str:
+        """
+        The hash of the job parameters, the same for the same parameters in any order
+        """
+        return sha256(json.dumps(params, sort_keys=True).encode('utf8')).hexdigest()
+
+
+    @classmethod
+    def create(cls, kind: str, params: dict, user_id: int, user_car_id: int = None) -> 'ReportJob':
+        """
+        Add a new pending job, it's submitted to the workers after it's committed
+        """
+        job = cls(
+            kind=kind,
+            params=json.dumps(params),
+            params_key=cls.params_hash(params),
+            status=PENDING,
+            stale=False,
+            created_at=int(datetime.now().timestamp()),
+            user_id=user_id,
+            user_car_id=user_car_id
+        )
+        db.session.add(job)
+        return job
+
+
+    @classmethod
+    def cached(cls, kind: str, params: dict, user_id: int, user_car_id: int = None) -> 'ReportJob':
+        """
+        The newest job with the same kind and parameters that isn't stale or
+        failed, None if there isn't one. It can still be pending or running
+        """
+        stmt = db.select(cls).where(
+            db.and_(
+                cls.user_id == user_id,
+                cls.kind == kind,
+                cls.params_key == cls.params_hash(params),
+                (cls.user_car_id == user_car_id) if user_car_id else cls.user_car_id.is_(None),
+                cls.stale.is_(False),
+                cls.status != FAILED
+            )
+        ).order_by(cls.id.desc()).limit(1)
+        return db.session.scalar(stmt)
+
+
+    @classmethod
+    def invalidate(cls, user_car_id: int):
+        """
+        Mark the jobs of the user car, and the jobs of all the cars of its user,
+        stale after a write to the user car's log entries or trips
+        """
+        user_id = db.select(UserCar.user_id).filter_by(id=user_car_id).scalar_subquery()
+        db.session.execute(
+            db.update(cls).where(
+                db.and_(
+                    cls.stale.is_(False),
+                    db.or_(
+                        cls.user_car_id == user_car_id,
+                        db.and_(cls.user_car_id.is_(None), cls.user_id == user_id)
+                    )
+                )
+            ).values(stale=True)
+        )
+
+
+    @classmethod
+    def invalidate_car(cls, car_id: int):
+        """
+        Mark the jobs of all the user cars of a car in the catalog, and the jobs of
+        all the cars of their users, stale after the admin updates or deletes the car.
+        Run before the user cars are deleted
+        """
+        user_cars = db.select(UserCar.id).filter_by(car_id=car_id)
+        users = db.select(UserCar.user_id).filter_by(car_id=car_id)
+        db.session.execute(
+            db.update(cls).where(
+                db.and_(
+                    cls.stale.is_(False),
+                    db.or_(
+                        cls.user_car_id.in_(user_cars),
+                        db.and_(cls.user_car_id.is_(None), cls.user_id.in_(users))
+                    )
+                )
+            ).values(stale=True)
+        )
+
+
+    @property
+    def finished(self) -> bool:
+        """
+        If the job is done or failed
+        """
+        return self.status in (DONE, FAILED)
+
+
+class ReportJobChunk(db.Model):
+    """
+    The ReportJobChunk model representing the report job chunks entity in the database.
+
+    Creates a model instance of the database instance.
+
+    The body of a job's result is saved in chunks in order, so an export is written
+    and downloaded a chunk at a time like the streamed export instead of being held
+    in memory. The data is only loaded when it's downloaded
+
+    Attributes:
+
+        position (int), data (str)
+    """
+    __tablename__ = 'report_job_chunks'
+    # model attributes
+    job_id = db.Column(
+        db.Integer, db.ForeignKey('report_jobs.id', ondelete='cascade'), primary_key=True
+    )
+    position = db.Column(db.Integer, primary_key=True)
+    data = db.deferred(db.Column(db.Text, nullable=False))
+
+
+class ReportJobSchema(ma.Schema):
+    """
+    Report Job model Schema
+
+    The fields are defined in a tuple in the Meta subclass
+
+    class Meta:
+        fields = ('id', 'kind', 'status', 'user_car_id', 'parameters',
+
+                  'created_at', 'finished_at', 'error')
+
+    The job's timestamps are dumped as local ISO datetimes
+    """
+    parameters = fields.Method('load_params')
+    created_at = fields.Method('created_at_datetime')
+    finished_at = fields.Method('finished_at_datetime')
+    class Meta:
+        """
+        Defining the fields in a tuple and ordering the fields
+        """
+        fields = ('id', 'kind', 'status', 'user_car_id', 'parameters',
+                  'created_at', 'finished_at', 'error')
+        ordered = True
+
+
+    @staticmethod
+    def to_datetime(timestamp: int) -> str:
+        """
+        Convert a timestamp to a local ISO datetime, None if it isn't set
+        """
+        if timestamp is None:
+            return None
+        return datetime.fromtimestamp(timestamp).isoformat()
+
+
+    def load_params(self, obj: ReportJob) -> dict:
+        """
+        The parameters of the job
+        """
+        return json.loads(obj.params)
+
+
+    def created_at_datetime(self, obj: ReportJob) -> str:
+        """
+        The date and time the job was requested
+        """
+        return self.to_datetime(obj.created_at)
+
+
+    def finished_at_datetime(self, obj: ReportJob) -> str:
+        """
+        The date and time the job finished
+        """
+        return self.to_datetime(obj.finished_at)
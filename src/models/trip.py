@@ -7,9 +7,9 @@ The Trip model contains the following attributes:
 
     id, fuel_price, car_id (Foreign Key)
 """
-from marshmallow import fields
-from marshmallow.validate import Range
-from init import db, ma
+from marshmallow import EXCLUDE, fields
+from marshmallow.validate import Range, Length
+from init import db, ma, dialect_insert
 
 class Trip(db.Model):
     """
@@ -22,6 +22,12 @@ class Trip(db.Model):
         fuel_price (float), distance (int)
     """
     __tablename__ = 'user_trips'
+    # a trip is only saved once for each user car, and the trips of a user car
+    # are listed in id order
+    __table_args__ = (
+        db.UniqueConstraint('user_car_id', 'fuel_price', 'distance'),
+        db.Index('ix_user_trips_user_car_id_id', 'user_car_id', 'id')
+    )
     # model attributes
     id = db.Column(db.Integer, primary_key=True)
     fuel_price = db.Column(db.Float, nullable=False)
@@ -33,6 +39,25 @@ class Trip(db.Model):
                     )
 
 
+    @classmethod
+    def add_once(cls, user_car_id: int, fuel_price: float, distance: int) -> int:
+        """
+        Insert the trip unless the user car already has the same trip, using
+        INSERT ... ON CONFLICT DO NOTHING on the unique constraint
+
+        Returns the id of the new trip, or None if it already existed
+        """
+        table = cls.__table__
+        stmt = dialect_insert(table).values(
+            user_car_id= user_car_id,
+            fuel_price= fuel_price,
+            distance= distance
+        ).on_conflict_do_nothing(
+            index_elements=[table.c.user_car_id, table.c.fuel_price, table.c.distance]
+        ).returning(table.c.id)
+        return db.session.execute(stmt).scalar()
+
+
 class TripSchema(ma.Schema):
     """
     Trip model Schema
@@ -61,3 +86,59 @@ class TripSchema(ma.Schema):
         """
         fields = ('id', 'fuel_price', 'distance', 'usercar', 'user_car_id')
         ordered = True
+
+
+class TripQuoteSchema(ma.Schema):
+    """
+    Trip quote schema for the trip calculator route
+
+    Used to validate the query string, with ``quote=true`` the trip cost is
+    calculated without saving the trip
+    """
+    quote = fields.Boolean(load_default=False)
+    class Meta:
+        """
+        Defining the fields in a tuple and ordering the fields
+        """
+        fields = ('quote',)
+        unknown = EXCLUDE
+
+
+class TripEstimateSchema(ma.Schema):
+    """
+    Trip estimate schema for the batch trip calculator route
+
+    Validates each trip of the batch, the user car is optional when it's in the URL
+    """
+    user_car_id = fields.Integer()
+    fuel_price = fields.Float(
+        required=True,
+        validate=Range(0.01)
+    )
+    distance = fields.Integer(
+        required=True,
+        validate=Range(1)
+    )
+    class Meta:
+        """
+        Defining the fields in a tuple and ordering the fields
+        """
+        fields = ('user_car_id', 'distance', 'fuel_price')
+        ordered = True
+
+
+class TripBatchSchema(ma.Schema):
+    """
+    Trip batch schema for the batch trip calculator route
+    """
+    trips = fields.List(
+        fields.Nested(TripEstimateSchema),
+        required=True,
+        validate=Length(min=1, max=1000)
+    )
+    class Meta:
+        """
+        Defining the fields in a tuple and ordering the fields
+        """
+        fields = ('trips',)
+        ordered = True
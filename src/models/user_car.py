@@ -22,6 +22,11 @@ class UserCar(db.Model):
         user_id (int), car_id (int)
     """
     __tablename__ = 'user_cars'
+    # index the foreign keys, the user cars are looked up by user and deleted by car
+    __table_args__ = (
+        db.Index('ix_user_cars_user_id', 'user_id'),
+        db.Index('ix_user_cars_car_id', 'car_id')
+    )
     # model atributes
     id = db.Column(db.Integer, primary_key=True)
     # Foreign Keys
@@ -34,6 +39,11 @@ class UserCar(db.Model):
     # relationships to foreign key in other table (not model defined attributes)
     logs = db.relationship('LogEntry', backref='usercar')
     user_trips = db.relationship('Trip', backref='usercar')
+    stats = db.relationship(
+        'ConsumptionStats', backref='usercar', uselist=False, cascade='all, delete-orphan'
+    )
+    rollups = db.relationship('LogRollup', backref='usercar', cascade='all, delete-orphan')
+    report_jobs = db.relationship('ReportJob', backref='usercar', cascade='all, delete-orphan')
 
 
 class UserCarSchema(ma.Schema):
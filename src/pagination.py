@@ -0,0 +1,181 @@
+"""
+Pagination
+
+This module contains the keyset (cursor) pagination and NDJSON streaming used
+by the list routes.
+
+Query string parameters:
+
+    limit - the max number of items in the page, all items are returned if not given
+
+    after - the cursor of the last item in the previous page
+
+    format - 'json' (default) or 'ndjson' to stream the items one per line
+
+When there are more items after the page, the response has a ``Link`` header
+with the url of the next page, in the same format.
+"""
+import json
+from math import isfinite
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from flask import Response, current_app, request, stream_with_context, url_for
+from marshmallow import EXCLUDE, ValidationError, fields
+from marshmallow.validate import OneOf, Range
+from init import db, ma
+
+# number of rows fetched from the database at a time when streaming
+STREAM_BATCH_SIZE = 500
+
+
+class PageSchema(ma.Schema):
+    """
+    Page schema for the list routes
+
+    Used to validate the query string parameters of the request
+    """
+    limit = fields.Integer(validate=Range(1, 1000))
+    after = fields.String()
+    format = fields.String(validate=OneOf(['json', 'ndjson']), load_default='json')
+    class Meta:
+        """
+        Defining the fields in a tuple and ordering the fields
+        """
+        fields = ('limit', 'after', 'format')
+        ordered = True
+        unknown = EXCLUDE
+
+
+def keyset(stmt, keys: tuple, page: dict):
+    """
+    Order the select statement by the key columns and start it after the
+    cursor in the page parameters. The last key column must be unique
+    """
+    stmt = stmt.order_by(*keys)
+    if 'after' in page:
+        stmt = stmt.where(db.tuple_(*keys) > decode_cursor(page['after'], keys))
+    if 'limit' in page:
+        stmt = stmt.limit(page['limit'])
+    return stmt
+
+
+def paginate(stmt, keys: tuple, page: dict, load=None) -> tuple:
+    """
+    Get a page of the results of the select statement
+
+    Variables:
+
+            <stmt> the select statement
+
+            <keys> (tuple) the columns to order and page the results by
+
+            <page> (dict) the page parameters loaded with the PageSchema
+
+            <load> the function making each row into an item, for statements
+            selecting columns instead of a model, see projections.py
+
+    Returns a tuple of the items in the page and the response headers, the
+    headers link to the next page when there are more items
+    """
+    if 'limit' not in page:
+        return fetch(keyset(stmt, keys, page), load), {}
+    # get one extra item to find out if there is a next page
+    stmt = keyset(stmt, keys, page).limit(page['limit'] + 1)
+    items = fetch(stmt, load)
+    headers = {}
+    if len(items) > page['limit']:
+        items = items[:page['limit']]
+        cursor = encode_cursor([getattr(items[-1], key.key) for key in keys])
+        # the next page is in the same format, json is left out as it's the default
+        next_url = url_for(
+            request.endpoint, **request.view_args, limit=page['limit'], after=cursor,
+            format=page['format'] if page.get('format', 'json') != 'json' else None
+        )
+        headers['Link'] = f'<{next_url}>; rel="next"'
+    return items, headers
+
+
+def fetch(stmt, load=None) -> list:
+    """
+    The results of the select statement, the model instances, or the rows made
+    into items with the load function
+    """
+    if load is None:
+        return db.session.scalars(stmt).all()
+    return [load(row) for row in db.session.execute(stmt)]
+
+
+def page_ndjson(stmt, keys: tuple, page: dict, schema, load=None) -> Response:
+    """
+    Respond with the page of the results of the select statement as NDJSON. A
+    page with a limit is fetched with paginate and has the Link header of the
+    next page, without a limit all the results are streamed with stream_ndjson
+    """
+    if 'limit' not in page:
+        return stream_ndjson(keyset(stmt, keys, page), schema, load)
+    items, headers = paginate(stmt, keys, page, load)
+    dumps = current_app.json.dumps
+    return Response(
+        ''.join(dumps(schema.dump(item)) + '\n' for item in items),
+        mimetype='application/x-ndjson',
+        headers=headers
+    )
+
+
+def stream_ndjson(stmt, schema, load=None) -> Response:
+    """
+    Stream the results of the select statement as NDJSON
+
+    Rows are fetched from the database in batches and each item is dumped and
+    sent as it's read, so the whole list is never held in memory. The rows are
+    made into items with the load function if it's given, see fetch
+    """
+    def generate():
+        stmt_batched = stmt.execution_options(yield_per=STREAM_BATCH_SIZE)
+        if load is None:
+            results = db.session.scalars(stmt_batched)
+        else:
+            results = map(load, db.session.execute(stmt_batched))
+        for item in results:
+            yield current_app.json.dumps(schema.dump(item)) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def encode_cursor(keys: list) -> str:
+    """
+    Encode the key values of an item as an opaque cursor
+    """
+    return urlsafe_b64encode(json.dumps(keys).encode()).decode()
+
+
+def decode_cursor(cursor: str, keys: tuple) -> tuple:
+    """
+    Decode a cursor back to the values of the key columns, raises a
+    ValidationError if the cursor is invalid or a value doesn't have the type
+    of its column
+    """
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (DecodeError, ValueError) as err:
+        raise ValidationError({'after': ['Invalid cursor']}) from err
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValidationError({'after': ['Invalid cursor']})
+    for key, value in zip(keys, values):
+        if not is_column_value(key, value):
+            raise ValidationError({'after': ['Invalid cursor']})
+    return tuple(values)
+
+
+def is_column_value(column, value) -> bool:
+    """
+    If the value decoded from JSON has the Python type of the column. Any finite
+    number is allowed for the integer and float columns, as SQLite keeps the float
+    timestamps of the ``date_added`` default in the integer column, and booleans
+    only for boolean columns
+    """
+    python_type = column.type.python_type
+    if isinstance(value, bool):
+        return python_type is bool
+    if python_type in (int, float):
+        return isinstance(value, (int, float)) and isfinite(value)
+    return isinstance(value, python_type)
@@ -0,0 +1,94 @@
+"""
+Password Hashing
+
+This module runs the bcrypt password hashing on a bounded pool of worker
+threads, so a burst of logins can only use ``BCRYPT_WORKERS`` threads of CPU
+and doesn't starve the other routes. bcrypt releases the GIL while hashing.
+
+When the workers are busy and ``BCRYPT_QUEUE_SIZE`` hashes are already waiting,
+``PasswordHashingBusy`` is raised and the app responds with 429 Too Many Requests.
+
+The work factor is set with ``BCRYPT_LOG_ROUNDS``. Hashes with a different work
+factor are rehashed when the user logs in, so the cost can be changed without
+resetting passwords.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from flask import current_app
+from init import bcrypt
+
+
+class PasswordHashingBusy(Exception):
+    """
+    Raised when the password hashing pool and its queue are full
+    """
+
+
+class PasswordHasher:
+    """
+    Bounded pool of bcrypt workers
+
+    A slot is taken for each hash, running or waiting, and given back when the
+    hash is done. There are as many slots as workers plus the queue size
+    """
+    def __init__(self):
+        self._pool = None
+        self._slots = None
+
+    def configure(self, workers: int, queue_size: int):
+        """
+        Create the pool with the number of workers and the max number of waiting hashes
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='bcrypt')
+        self._slots = BoundedSemaphore(workers + queue_size)
+
+    def run(self, function, *args):
+        """
+        Run the function on the pool and wait for the result, raises
+        PasswordHashingBusy without waiting if there's no free slot
+        """
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHashingBusy()
+        try:
+            future = self._pool.submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def generate(self, password: str) -> str:
+        """
+        Hash the password with the configured work factor
+        """
+        rounds = current_app.config['BCRYPT_LOG_ROUNDS']
+        return self.run(bcrypt.generate_password_hash, password, rounds).decode('utf8')
+
+    def check(self, password_hash: str, password: str) -> bool:
+        """
+        Check the password against the hash
+        """
+        return self.run(bcrypt.check_password_hash, password_hash, password)
+
+    @staticmethod
+    def needs_rehash(password_hash: str) -> bool:
+        """
+        If the hash has a different work factor than the configured one, the
+        hash format is $2b$<rounds>$<salt and hash>
+        """
+        try:
+            return int(password_hash.split('$')[2]) != current_app.config['BCRYPT_LOG_ROUNDS']
+        except (IndexError, ValueError):
+            return True
+
+
+password_hasher = PasswordHasher()
+
+
+def init_password_hashing(app):
+    """
+    Create the password hashing pool from the app config
+    """
+    password_hasher.configure(app.config['BCRYPT_WORKERS'], app.config['BCRYPT_QUEUE_SIZE'])
@@ -0,0 +1,104 @@
+"""
+Projections
+
+This module contains the read only queries of the list routes. They select only
+the columns the response needs instead of the model entities, so the rows aren't
+added to the session's identity map and have no change tracking or
+relationships to load.
+
+The rows are dumped by the serializers like the model instances, the columns
+are read as attributes. When the response nests another object, the row is made
+into a record with ``__slots__`` holding the columns and the nested object.
+"""
+from init import db
+from models.car import Car
+from models.log import LogEntry
+from models.user import User
+from models.user_car import UserCar
+
+
+class Record:
+    """
+    Lightweight read only record
+
+    The fields are the slots of the subclass, set from the values in order and
+    then from the named values
+    """
+    __slots__ = ()
+
+    def __init__(self, *values, **named):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+        for name, value in named.items():
+            setattr(self, name, value)
+
+
+class LogEntryRecord(Record):
+    """
+    Log entry with the user car it belongs to
+    """
+    __slots__ = ('id', 'current_odo', 'fuel_quantity', 'fuel_price', 'date_added', 'usercar')
+
+
+class UserCarRecord(Record):
+    """
+    User car with its car, the car is the row of the car columns
+    """
+    __slots__ = ('id', 'car')
+
+
+def select_log_entries(user_car_id: int):
+    """
+    Select the columns of the log entries of the user car
+
+    Variables:
+
+            <user_car_id> (int)
+    """
+    return db.select(
+        LogEntry.id, LogEntry.current_odo, LogEntry.fuel_quantity,
+        LogEntry.fuel_price, LogEntry.date_added
+    ).filter_by(user_car_id=user_car_id)
+
+
+def log_entry_records(user_car: UserCar):
+    """
+    The function making the log entry rows of the user car into records
+    """
+    return lambda row: LogEntryRecord(*row, usercar=user_car)
+
+
+def select_cars():
+    """
+    Select the columns of the cars in the catalog
+    """
+    return db.select(Car.id, Car.make, Car.model, Car.model_trim, Car.year, Car.tank_size)
+
+
+def select_users():
+    """
+    Select the columns of the users
+    """
+    return db.select(User.id, User.email, User.first_name, User.last_name)
+
+
+def select_user_cars(user_id: int):
+    """
+    Select the ids of the user's cars with the columns of their cars
+
+    Variables:
+
+            <user_id> (int)
+    """
+    return db.select(
+        UserCar.id, Car.make, Car.model, Car.model_trim, Car.year
+    ).join(
+        Car, UserCar.car_id == Car.id
+    ).filter(UserCar.user_id == user_id).order_by(UserCar.id)
+
+
+def user_car_records(rows) -> list:
+    """
+    Make the user car rows into records, the row is the car of the record
+    """
+    return [UserCarRecord(row.id, car=row) for row in rows]
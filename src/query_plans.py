@@ -0,0 +1,115 @@
+"""
+Query Plans
+
+This module checks the query plans of the hot queries of the routes. Each query
+is run with EXPLAIN (EXPLAIN QUERY PLAN on SQLite) and fails the check if the
+plan reads a whole table with a sequential scan, where the table has at least
+``min_rows`` rows. Small tables are left out because a sequential scan is the
+cheapest plan for them.
+
+The check is run with ``flask cli explain`` against a seeded database, for
+example after ``flask cli seed-scale``.
+"""
+from init import db
+from models.car import Car
+from models.log import LogEntry
+from models.user_car import UserCar
+from models.trip import Trip
+from models.consumption_stats import ConsumptionStats
+from models.log_rollup import LogRollup
+
+# tables with less rows than this aren't checked
+MIN_ROWS = 1000
+
+
+def hot_queries(user_car: UserCar, car: Car) -> dict:
+    """
+    The statements of the hot queries of the routes, for a sample user car and car
+    """
+    return {
+        'logs of a user car': db.select(LogEntry).filter_by(
+            user_car_id=user_car.id
+        ).order_by(LogEntry.date_added, LogEntry.id),
+        'log entry of a user car': db.select(LogEntry).filter_by(
+            user_car_id=user_car.id
+        ).filter_by(id=1),
+        'expenditure of a user car': db.select(db.func.sum(LogEntry.fuel_price)).where(
+            db.and_(
+                LogEntry.user_car_id == user_car.id,
+                LogEntry.date_added.between(0, 2 ** 31)
+            )
+        ),
+        'trips of a user car': db.select(Trip).join(
+            UserCar, Trip.user_car_id == UserCar.id
+        ).where(
+            db.and_(Trip.user_car_id == user_car.id, UserCar.user_id == user_car.user_id)
+        ).order_by(Trip.id),
+        'user cars of a user': db.select(UserCar).filter_by(user_id=user_car.user_id),
+        'user cars of a car': db.select(UserCar).filter_by(car_id=car.id),
+        'cars by make': db.select(Car).where(Car.make == car.make),
+        'cars by make and model': db.select(Car).where(
+            db.and_(Car.make == car.make, Car.model == car.model)
+        ),
+        'consumption stats of a user car': db.select(ConsumptionStats).filter_by(
+            user_car_id=user_car.id
+        ),
+        'log rollups of a user car': db.select(LogRollup).filter_by(user_car_id=user_car.id)
+    }
+
+
+def explain(stmt) -> list:
+    """
+    The lines of the query plan of the statement
+    """
+    dialect = db.engine.dialect
+    sql = str(stmt.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    connection = db.session.connection()
+    if dialect.name == 'sqlite':
+        # the detail of each step is the last column
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}').all()
+        return [row[-1] for row in rows]
+    return connection.exec_driver_sql(f'EXPLAIN {sql}').scalars().all()
+
+
+def sequential_scans(plan: list, tables: list) -> list:
+    """
+    The tables read with a sequential scan in the query plan. SQLite shows a
+    sequential scan as ``SCAN <table>`` and an index as ``SEARCH <table> USING INDEX``
+    or ``SCAN <table> USING INDEX``, PostgreSQL shows ``Seq Scan on <table>``
+    """
+    scanned = []
+    for line in plan:
+        for table in tables:
+            if f'Seq Scan on {table} ' in f'{line} ' or line.strip() == f'SCAN {table}':
+                scanned.append(table)
+    return scanned
+
+
+def large_tables(min_rows: int) -> list:
+    """
+    The names of the tables with at least min_rows rows
+    """
+    tables = []
+    for table in db.metadata.sorted_tables:
+        if db.session.scalar(db.select(db.func.count()).select_from(table)) >= min_rows:
+            tables.append(table.name)
+    return tables
+
+
+def check_query_plans(min_rows: int = MIN_ROWS) -> list:
+    """
+    Explain the hot queries and find the sequential scans of the large tables
+
+    Returns a list of (query name, plan, tables scanned) for each query, or None
+    if there's no user car to explain the queries with
+    """
+    user_car = db.session.scalar(db.select(UserCar).order_by(UserCar.id).limit(1))
+    if not user_car:
+        return None
+    car = db.session.get(Car, user_car.car_id)
+    tables = large_tables(min_rows)
+    results = []
+    for name, stmt in hot_queries(user_car, car).items():
+        plan = explain(stmt)
+        results.append((name, plan, sequential_scans(plan, tables)))
+    return results
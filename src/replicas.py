@@ -0,0 +1,134 @@
+"""
+Replicas
+
+This module routes the reads of the session to the read replica databases.
+The replicas are set with a comma separated list of URIs in DB_REPLICA_URIS
+(DB_REPLICA_URIS_DEV in dev), each is a bind named ``replica_1``, ``replica_2``...
+Without replicas everything is sent to the primary database.
+
+The SELECT statements are sent to a replica, picked once for each request, in:
+
+    GET requests
+
+    view functions decorated with ``read_replica``, such as the expenditure reports
+
+Everything else is sent to the primary: flushes, INSERT, UPDATE and DELETE
+statements, SELECT ... FOR UPDATE, text statements and the CLI commands.
+
+Once the session writes, the rest of its reads are sent to the primary so the
+request reads its own writes. The user that wrote is also kept on the primary
+for ``REPLICA_STICKY_SECONDS`` to cover the replication lag. This is kept in
+the process, so other worker processes can still read from the replicas.
+"""
+import random
+from threading import Lock
+from time import monotonic
+from flask import current_app, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+
+# number of sticky users kept before the expired ones are removed
+STICKY_USERS_SIZE = 10000
+
+
+class StickyUsers:
+    """
+    Users kept on the primary database after they write, by JWT identity
+    """
+    def __init__(self):
+        self._expires = {}
+        self._lock = Lock()
+
+    def stick(self, identity, seconds: float):
+        """
+        Keep the user on the primary database for the number of seconds
+        """
+        now = monotonic()
+        with self._lock:
+            if len(self._expires) >= STICKY_USERS_SIZE:
+                self._expires = {
+                    key: expires for key, expires in self._expires.items() if expires > now
+                }
+            self._expires[identity] = now + seconds
+
+    def is_sticky(self, identity) -> bool:
+        """
+        If the user wrote in the last seconds
+        """
+        return self._expires.get(identity, 0) > monotonic()
+
+
+sticky_users = StickyUsers()
+
+
+def read_replica(view):
+    """
+    Decorator for view functions that only read, their SELECT statements are
+    sent to a replica whatever the request method
+    """
+    view.read_replica = True
+    return view
+
+
+def request_identity():
+    """
+    The JWT identity of the request, None when the route doesn't require a JWT
+    """
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        return None
+
+
+class RoutingSession(Session):
+    """
+    Session sending the SELECT statements of read only requests to a replica
+    """
+    def __init__(self, db, **kwargs):
+        super().__init__(db, **kwargs)
+        # the replica engine of the session, False when the reads go to the primary
+        self.replica = None
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """
+        The replica engine for SELECT statements of read only requests, the
+        primary engine for everything else. Only the models of the default bind
+        are routed
+        """
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or engine is not self._db.engines.get(None):
+            return engine
+        if self._flushing or getattr(clause, 'is_dml', False):
+            if not self.wrote:
+                self.written()
+        elif (getattr(clause, 'is_select', False)
+                and getattr(clause, '_for_update_arg', None) is None and not self.wrote):
+            return self.read_replica() or engine
+        return engine
+
+    def read_replica(self):
+        """
+        The replica engine for the reads of the request, chosen on the first read
+        """
+        if self.replica is None:
+            self.replica = False
+            if has_request_context():
+                binds = current_app.config.get('REPLICA_BINDS')
+                view = current_app.view_functions.get(request.endpoint)
+                if binds and (request.method in ('GET', 'HEAD')
+                              or getattr(view, 'read_replica', False)):
+                    identity = request_identity()
+                    if identity is None or not sticky_users.is_sticky(identity):
+                        self.replica = self._db.engines[random.choice(binds)]
+        return self.replica
+
+    def written(self):
+        """
+        Send the rest of the session to the primary and keep the user on the primary
+        """
+        self.wrote = True
+        if has_request_context() and current_app.config.get('REPLICA_BINDS'):
+            identity = request_identity()
+            if identity is not None:
+                sticky_users.stick(identity, current_app.config['REPLICA_STICKY_SECONDS'])
@@ -0,0 +1,178 @@
+"""
+Report Jobs
+
+This module runs the long reports and exports in the background, so the request
+returns at once instead of running past the load balancer timeout. The jobs are
+saved in the report_jobs table and run on a pool of ``REPORT_JOB_WORKERS``
+threads in the process that received the request. The client polls the job's
+status and downloads its result when it's done.
+
+The job functions are registered for a kind of job with the ``report_job``
+decorator. A job function is given the job's parameters and the job, and
+returns a tuple of the chunks of the response body, status code, mimetype and
+the filename of the download (None to show the result inline):
+
+    @report_job('expenditure_report')
+    def run_expenditure_report(params: dict, job: ReportJob) -> tuple:
+
+The chunks can be a generator, each chunk is saved in the report_job_chunks
+table as it's made and the result is streamed from the table a chunk at a time
+when it's downloaded, so a long export isn't held in memory.
+
+The results are kept in the tables and reused for the same user car, kind and
+parameters until a write to the user car's log entries or trips marks them
+stale, see ``ReportJob.invalidate``.
+
+A job only lives in the pool of its process. If the process stops, its pending
+and running jobs are submitted again when they're polled after
+``REPORT_JOB_TIMEOUT`` seconds, by the one request that claims the job.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from init import db
+from models.report_job import ReportJob, ReportJobChunk, PENDING, RUNNING, DONE, FAILED
+
+# number of result chunks read from the database cursor at a time
+RESULT_CHUNK_BUFFER = 10
+
+# the job functions of each kind of job
+JOB_KINDS = {}
+
+
+def report_job(kind: str):
+    """
+    Decorator registering the function that runs the kind of job
+    """
+    def register(function):
+        JOB_KINDS[kind] = function
+        return function
+    return register
+
+
+class ReportJobRunner:
+    """
+    Pool of report job workers
+
+    The workers are given the job id, each job is loaded and run in its own app
+    context and session. The reads of the jobs go to the primary database
+    """
+    def __init__(self):
+        self._pool = None
+
+    def configure(self, workers: int):
+        """
+        Create the pool with the number of workers
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='report-job')
+
+    def submit(self, job_id: int):
+        """
+        Queue the committed job to be run by a worker
+        """
+        self._pool.submit(self.run, current_app._get_current_object(), job_id)
+
+    def resume(self, job: ReportJob) -> bool:
+        """
+        Submit the job again if it has been pending or running for longer than
+        REPORT_JOB_TIMEOUT, the process running it has stopped
+
+        The job is claimed with an UPDATE conditional on the status and times that
+        were read, so when many requests poll the job at once only the one that
+        updated the row submits it. The job is reloaded after the commit
+
+        Returns True if the job was submitted
+        """
+        if job.finished:
+            return False
+        timeout = current_app.config['REPORT_JOB_TIMEOUT']
+        if (job.started_at or job.created_at) > datetime.now().timestamp() - timeout:
+            return False
+        stmt = db.update(ReportJob).where(
+            db.and_(
+                ReportJob.id == job.id,
+                ReportJob.status == job.status,
+                ReportJob.created_at == job.created_at,
+                ReportJob.started_at.is_(None) if job.started_at is None
+                else ReportJob.started_at == job.started_at
+            )
+        ).values(
+            status=PENDING, started_at=None, created_at=int(datetime.now().timestamp())
+        ).execution_options(synchronize_session=False)
+        claimed = db.session.execute(stmt).rowcount
+        db.session.commit()
+        if claimed != 1:
+            return False
+        self.submit(job.id)
+        return True
+
+    @staticmethod
+    def run(app, job_id: int):
+        """
+        Run the job and save its result, or save it as failed if the job function
+        raises. A job that has already finished isn't run again
+        """
+        with app.app_context():
+            job = db.session.get(ReportJob, job_id)
+            if job is None or job.finished:
+                return
+            job.status = RUNNING
+            job.started_at = int(datetime.now().timestamp())
+            db.session.commit()
+            try:
+                chunks, status, mimetype, filename = JOB_KINDS[job.kind](json.loads(job.params), job)
+                save_chunks(job.id, chunks)
+                job.result_status = status
+                job.mimetype = mimetype
+                job.filename = filename
+                job.status = DONE
+                job.finished_at = int(datetime.now().timestamp())
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Report job %s failed', job_id)
+                # the job is gone if its user car was deleted while it ran, and
+                # finished if it was resumed and run again by another worker
+                job = db.session.get(ReportJob, job_id)
+                if job is not None and not job.finished:
+                    job.status = FAILED
+                    job.error = 'Report job failed'
+                    job.finished_at = int(datetime.now().timestamp())
+                    db.session.commit()
+
+
+def save_chunks(job_id: int, chunks):
+    """
+    Insert the chunks of the job's result in order as they're made, they're
+    committed with the job
+    """
+    for position, data in enumerate(chunks):
+        db.session.execute(
+            db.insert(ReportJobChunk).values(job_id=job_id, position=position, data=data)
+        )
+
+
+def result_chunks(job_id: int):
+    """
+    Yield the chunks of the job's result in order, read with a server side cursor
+    """
+    stmt = db.select(ReportJobChunk.data).filter_by(job_id=job_id).order_by(
+        ReportJobChunk.position
+    )
+    result = db.session.execute(
+        stmt.execution_options(stream_results=True, max_row_buffer=RESULT_CHUNK_BUFFER)
+    )
+    yield from result.scalars()
+
+
+report_job_runner = ReportJobRunner()
+
+
+def init_report_jobs(app):
+    """
+    Create the report job pool from the app config
+    """
+    report_job_runner.configure(app.config['REPORT_JOB_WORKERS'])
@@ -0,0 +1,238 @@
+"""
+Reports
+
+This module contains the queries of the expenditure reports. The log entries
+are filtered and aggregated by the database so each report is one round trip
+however many periods it covers.
+
+The whole months of a report are read from the monthly log rollups, the log
+entries are only read for the partial months at the edges of the report.
+
+The ``date_bucket`` SQL construct truncates the epoch ``date_added`` column to
+the start of its week, month or year in local time. It's compiled for
+PostgreSQL and SQLite.
+"""
+from datetime import datetime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import String
+from init import db
+from models.log import LogEntry
+from models.log_rollup import LogRollup
+
+# SQLite modifiers that move a local date to the start of the period
+SQLITE_BUCKET_MODIFIERS = {
+    'week': "'weekday 0', '-6 days'",
+    'month': "'start of month'",
+    'year': "'start of year'"
+}
+
+
+class date_bucket(FunctionElement):
+    """
+    SQL expression of the start date (YYYY-MM-DD) of the week, month or year
+    of an epoch timestamp column. Weeks start on Monday
+
+        date_bucket(LogEntry.date_added, 'month')
+    """
+    type = String()
+    # the period is compiled into the SQL, so the statement can't be cached
+    inherit_cache = False
+
+    def __init__(self, column, period: str):
+        self.period = period
+        super().__init__(column)
+
+
+@compiles(date_bucket, 'postgresql')
+def compile_date_bucket_postgresql(element, compiler, **kw):
+    """
+    Compile the date bucket for PostgreSQL
+    """
+    column = compiler.process(list(element.clauses)[0], **kw)
+    return f"to_char(date_trunc('{element.period}', to_timestamp({column})), 'YYYY-MM-DD')"
+
+
+@compiles(date_bucket, 'sqlite')
+def compile_date_bucket_sqlite(element, compiler, **kw):
+    """
+    Compile the date bucket for SQLite
+    """
+    column = compiler.process(list(element.clauses)[0], **kw)
+    modifiers = SQLITE_BUCKET_MODIFIERS[element.period]
+    return f"date({column}, 'unixepoch', 'localtime', {modifiers})"
+
+
+def next_month(month: datetime) -> datetime:
+    """
+    The start of the month after the given month start
+    """
+    return month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1)
+
+
+def whole_months(from_date: float, to_date: float) -> tuple:
+    """
+    Find the whole months within a time period, these are read from the rollups
+
+    Returns a tuple of the first and last month (YYYY-MM-01) and the timestamps of
+    the start of the first month and end of the last month, or None if the period
+    doesn't cover a whole month
+    """
+    first = datetime.fromtimestamp(from_date).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    if first.timestamp() < from_date:
+        first = next_month(first)
+    last = None
+    month = first
+    while next_month(month).timestamp() <= to_date:
+        last = month
+        month = next_month(month)
+    if last is None:
+        return None
+    return (
+        first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d'),
+        first.timestamp(), next_month(last).timestamp()
+    )
+
+
+def expenditure_parts(car_id: int, from_date: float, to_date: float,
+                      raw_period, rollup_period=None) -> list:
+    """
+    The select statements of the expenditure of a user car in a time period
+
+    The whole months are read from the rollups and the log entries are only
+    read for the partial months at the edges of the period. Each statement
+    has the period, log count, total cost, total litres and min and max
+    odometer columns, grouped by the period when it's an expression.
+
+    Variables:
+
+            <raw_period> the period column of the log entries
+
+            <rollup_period> the period column of the rollups, the rollups are not
+            used if it's None
+
+    Returns a list of select statements to be combined with UNION ALL
+    """
+    months = whole_months(from_date, to_date) if rollup_period is not None else None
+    log_filter = in_period(car_id, from_date, to_date)
+    if months:
+        # only the log entries outside of the whole months
+        log_filter = db.and_(
+            log_filter,
+            db.or_(LogEntry.date_added < months[2], LogEntry.date_added >= months[3])
+        )
+    grouped = not isinstance(raw_period, int)
+    raw_period = raw_period if grouped else db.literal(raw_period)
+    parts = [
+        db.select(
+            raw_period.label('period'),
+            db.func.count(LogEntry.id).label('log_count'),
+            db.func.sum(LogEntry.fuel_price * LogEntry.fuel_quantity).label('total_cost'),
+            db.func.sum(LogEntry.fuel_quantity).label('total_litres'),
+            db.func.min(LogEntry.current_odo).label('min_odo'),
+            db.func.max(LogEntry.current_odo).label('max_odo')
+        ).where(log_filter)
+    ]
+    if months:
+        rollup_period = rollup_period if grouped else db.literal(rollup_period)
+        parts.append(
+            db.select(
+                rollup_period.label('period'),
+                db.func.sum(LogRollup.log_count).label('log_count'),
+                db.func.sum(LogRollup.total_cost).label('total_cost'),
+                db.func.sum(LogRollup.total_litres).label('total_litres'),
+                db.func.min(LogRollup.min_odo).label('min_odo'),
+                db.func.max(LogRollup.max_odo).label('max_odo')
+            ).where(
+                db.and_(
+                    LogRollup.user_car_id == car_id,
+                    LogRollup.month >= months[0],
+                    LogRollup.month <= months[1]
+                )
+            )
+        )
+    if grouped:
+        parts[0] = parts[0].group_by(raw_period)
+        if months:
+            parts[1] = parts[1].group_by(rollup_period)
+    return parts
+
+
+def combine_expenditure(parts: list):
+    """
+    Combine the expenditure statements with UNION ALL and total them by period:
+    the number of log entries, total cost, total litres and total distance
+    """
+    parts = db.union_all(*parts).subquery()
+    return db.select(
+        parts.c.period,
+        db.func.coalesce(db.func.sum(parts.c.log_count), 0).label('log_count'),
+        db.func.sum(parts.c.total_cost).label('total_cost'),
+        db.func.sum(parts.c.total_litres).label('total_litres'),
+        (db.func.max(parts.c.max_odo) - db.func.min(parts.c.min_odo)).label('total_distance')
+    ).group_by(parts.c.period).order_by(parts.c.period)
+
+
+def in_period(car_id: int, from_date: float, to_date: float):
+    """
+    The filter for the log entries of a user car in a time period
+    """
+    return db.and_(
+        LogEntry.user_car_id == car_id,
+        LogEntry.date_added <= to_date,
+        LogEntry.date_added >= from_date
+    )
+
+
+def bucketed_expenditure(car_id: int, from_date: float, to_date: float, period: str) -> list:
+    """
+    Get the expenditure of a user car for each week, month or year in a time
+    period, in one query. The month and year buckets read the rollups for the
+    whole months
+
+    Variables:
+
+            <car_id> (int)
+
+            <from_date> (float) unix timestamp
+
+            <to_date> (float) unix timestamp
+
+            <period> (str) 'week', 'month' or 'year'
+
+    Returns a list of rows with the period start date and the aggregates,
+    periods without log entries are left out
+    """
+    rollup_period = {
+        'week': None,
+        'month': LogRollup.month,
+        'year': db.func.substr(LogRollup.month, 1, 4, type_=String) + '-01-01'
+    }[period]
+    parts = expenditure_parts(
+        car_id, from_date, to_date, date_bucket(LogEntry.date_added, period), rollup_period
+    )
+    return db.session.execute(combine_expenditure(parts)).all()
+
+
+def compare_expenditure(car_id: int, periods: list) -> list:
+    """
+    Get the expenditure of a user car for each time period, all the periods
+    are aggregated in one query. The whole months are read from the rollups
+
+    Variables:
+
+            <car_id> (int)
+
+            <periods> (list) tuples of (from_date, to_date) unix timestamps
+
+    Returns a list of rows with the aggregates, in the order of the periods
+    """
+    parts = [
+        part
+        for index, (from_date, to_date) in enumerate(periods)
+        for part in expenditure_parts(car_id, from_date, to_date, index, index)
+    ]
+    rows = {row.period: row for row in db.session.execute(combine_expenditure(parts))}
+    return [rows[index] for index in range(len(periods))]
@@ -0,0 +1,211 @@
+"""
+Serialization
+
+This module compiles the marshmallow schemas into serializers that dump objects
+and rows to plain dicts, and provides a JSON provider that encodes the
+responses with orjson when it's installed.
+
+A serializer is compiled once for each schema, many, only and exclude
+combination and cached:
+
+    ``serializer(LogEntrySchema, many=True).dump(log_entries)``
+
+The serializer reads the attributes and converts the values of the Integer,
+Float, String and inferred fields directly, the other fields are dumped by the
+schema's own fields. Schemas with pre_dump or post_dump hooks are dumped by the
+schema. The output is the same as ``LogEntrySchema(many=True).dump(log_entries)``.
+
+The JSON provider gives the same bytes as Flask's default provider. Responses
+that orjson would encode differently, non ASCII strings and the smallest and
+largest floats, or that it can't encode, are encoded by Flask's default provider.
+NaN and Infinity aren't valid JSON, orjson writes them as null.
+``dumps`` is left to the default provider for its separators.
+"""
+import re
+from functools import lru_cache
+from flask.json.provider import DefaultJSONProvider
+from marshmallow import fields, missing
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the fields converted directly, and their conversion
+CONVERTERS = {
+    fields.Integer: int,
+    fields.Float: float,
+    fields.String: str,
+    fields.Email: str
+}
+
+# the value types an inferred field dumps unchanged
+INFERRED_TYPES = (int, float, str, bool, type(None))
+
+# orjson writes floats below 1e-4 as 0.00001 and from 1e16 as 1e16, Python
+# writes 1e-05 and 1e+16. Only responses without an exponent or 0.0000 are sent
+# as orjson encoded them, a string with the pattern is encoded again by the
+# default provider. Searching for the e first is much faster than the digit
+EXPONENT = re.compile(rb'e[-+0-9]')
+
+
+def serializer(schema_class, many: bool = False, only: list = None, exclude: list = None):
+    """
+    The compiled serializer of the schema, with the schema's many, only and
+    exclude arguments
+    """
+    return compile_schema(
+        schema_class, many, tuple(only) if only is not None else None, tuple(exclude or ())
+    )
+
+
+@lru_cache(maxsize=None)
+def compile_schema(schema_class, many: bool, only: tuple, exclude: tuple):
+    """
+    Compile and cache the serializer of the schema
+    """
+    return Serializer(schema_class(only=only, exclude=exclude), many)
+
+
+def get_value(obj, attribute: str):
+    """
+    The attribute of an object or the key of a dict, missing if it doesn't exist
+    """
+    if isinstance(obj, dict):
+        return obj.get(attribute, missing)
+    return getattr(obj, attribute, missing)
+
+
+class Serializer:
+    """
+    Compiled serializer of a schema instance
+
+    Each dump field is compiled into a function of the object that returns the
+    dumped value, or missing to leave the key out like the schema does. The
+    nested objects are dumped once for each dump, such as the user car of each
+    log entry in a list, and looked up in the memo after
+    """
+    def __init__(self, schema, many: bool = False):
+        self.schema = schema
+        self.many = many
+        # the schema dumps itself when it has hooks
+        self.compiled = None
+        if not (schema._has_processors(PRE_DUMP) or schema._has_processors(POST_DUMP)):
+            self.compiled = [
+                (field.data_key if field.data_key is not None else name,
+                 self.compile_field(name, field))
+                for name, field in schema.dump_fields.items()
+            ]
+
+    def compile_field(self, name: str, field: fields.Field):
+        """
+        The function dumping the field of an object
+        """
+        attribute = field.attribute or name
+        if '.' in attribute:
+            return lambda obj, memo: field.serialize(name, obj, accessor=self.schema.get_attribute)
+        convert = CONVERTERS.get(type(field))
+        if convert and not getattr(field, 'as_string', False):
+            def dump_converted(obj, memo):
+                value = get_value(obj, attribute)
+                if value is None or value is missing:
+                    return value
+                return convert(value)
+            return dump_converted
+        if type(field) is fields.Inferred:
+            def dump_inferred(obj, memo):
+                value = get_value(obj, attribute)
+                if type(value) in INFERRED_TYPES or value is missing:
+                    return value
+                return field.serialize(name, obj, accessor=self.schema.get_attribute)
+            return dump_inferred
+        if type(field) is fields.Method and field.serialize_method_name:
+            method = getattr(self.schema, field.serialize_method_name)
+            return lambda obj, memo: method(obj)
+        nested = None
+        if type(field) is fields.Nested:
+            nested = Serializer(field.schema, field.many or field.schema.many)
+        elif type(field) is fields.List and type(field.inner) is fields.Nested:
+            nested = Serializer(field.inner.schema, True)
+        if nested:
+            def dump_nested(obj, memo):
+                value = get_value(obj, attribute)
+                if value is None or value is missing:
+                    return value
+                # the objects are alive until the dump ends, so their ids are unique
+                key = (id(nested), id(value))
+                if key not in memo:
+                    memo[key] = nested.dump(value, memo)
+                return memo[key]
+            return dump_nested
+        return lambda obj, memo: field.serialize(name, obj, accessor=self.schema.get_attribute)
+
+    def dump_one(self, obj, memo: dict) -> dict:
+        """
+        Dump an object to a dict
+        """
+        data = {}
+        for key, dump_field in self.compiled:
+            value = dump_field(obj, memo)
+            if value is not missing:
+                data[key] = value
+        return data
+
+    def dump(self, obj, memo: dict = None):
+        """
+        Dump an object, or a list of objects if many is set
+        """
+        if self.compiled is None:
+            return self.schema.dump(obj, many=self.many)
+        if memo is None:
+            memo = {}
+        if self.many:
+            return [self.dump_one(item, memo) for item in obj]
+        return self.dump_one(obj, memo)
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider encoding the responses with orjson, with the same output as
+    Flask's default JSON provider
+    """
+    def response(self, *args, **kwargs):
+        """
+        Serialize the data as JSON and return a response with the
+        application/json mimetype, indented in debug mode unless compact is set
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = self.encode(obj, indent)
+        if body is None:
+            return super().response(obj)
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+    def encode(self, obj, indent: bool) -> bytes:
+        """
+        Encode the data with orjson, or None if the default provider has to
+        encode it to give the same output
+        """
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            body = orjson.dumps(obj, default=self.default, option=option)
+        except TypeError:
+            # orjson.JSONEncodeError is a TypeError
+            return None
+        if (not body.isascii() or b'\x7f' in body or b'0.0000' in body
+                or EXPONENT.search(body)):
+            return None
+        return body
+
+
+def init_serialization(app):
+    """
+    Use the orjson JSON provider if orjson is installed
+    """
+    if orjson is not None:
+        app.json = ORJSONProvider(app)
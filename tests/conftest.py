@@ -0,0 +1,103 @@
+"""
+Test fixtures
+
+The tests run the app against a SQLite database in a temporary directory. The
+tables are dropped, created and seeded with the CLI commands before each test,
+so every test starts from the seeded data:
+
+    will.thomas@gmail.com owns user car 2, the Ford Ranger with 6 log entries
+    and 2 trips
+
+    john.smith@test.com owns user car 1, the Toyota Landcruiser with 1 log entry
+    and 1 trip
+
+The environment is set before the app is imported, as the config reads it on import.
+"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+import pytest
+
+DB_DIR = tempfile.mkdtemp(prefix='fuel_log_tests_')
+os.environ.update({
+    'ENVIRONMENT': 'dev',
+    'JWT_KEY': 'test-secret',
+    'DB_URI_DEV': f'sqlite:///{DB_DIR}/test.db',
+    'DB_REPLICA_URIS_DEV': '',
+    'BCRYPT_LOG_ROUNDS': '4',
+    'IDENTITY_CACHE_TTL': '0',
+    'CATALOG_CACHE_TTL': '0',
+    'SQL_INSTRUMENTATION': '0'
+})
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src'))
+
+from sqlalchemy import event
+from app import create_app
+from init import db
+
+
+@pytest.fixture(scope='session')
+def app():
+    """
+    The app, created once for the tests
+    """
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    """
+    Test client of the app with a freshly seeded database
+    """
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+    runner = app.test_cli_runner()
+    for command in ('create', 'seed'):
+        result = runner.invoke(args=['cli', command])
+        assert result.exception is None, result.output
+    return app.test_client()
+
+
+def login(client, email: str, password: str) -> dict:
+    """
+    Log in and return the authorization header of the user
+    """
+    response = client.post('/login', json={'email': email, 'password': password})
+    assert response.status_code == 200, response.json
+    return {'Authorization': f"Bearer {response.json['token']}"}
+
+
+@pytest.fixture
+def headers(client):
+    """
+    Authorization header of will.thomas@gmail.com, the owner of user car 2
+    """
+    return login(client, 'will.thomas@gmail.com', 'thisIsapassword')
+
+
+@pytest.fixture
+def admin_headers(client):
+    """
+    Authorization header of the seeded admin
+    """
+    return login(client, 'fuellogadmin@fuellogapi.com', 'admin1234')
+
+
+@contextmanager
+def count_statements(app):
+    """
+    Count the SQL statements sent to the database in the block, the count is
+    the length of the yielded list
+    """
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
@@ -0,0 +1,92 @@
+"""
+Tests of the consumption analytics
+
+The array helpers are tested on their edge cases, the route with the seeded
+log entries
+"""
+import numpy as np
+from numpy.testing import assert_allclose
+from analytics import rolling_ratio, safe_divide, to_list
+
+
+def test_safe_divide():
+    result = safe_divide(np.array([10.0, 10.0, 10.0, 0.0]), np.array([4.0, 0.0, -2.0, 5.0]))
+    assert_allclose(result, [2.5, np.nan, np.nan, 0.0])
+
+
+def test_safe_divide_empty():
+    assert safe_divide(np.array([]), np.array([])).shape == (0,)
+
+
+def test_safe_divide_nan_denominator():
+    assert np.isnan(safe_divide(np.array([1.0]), np.array([np.nan]))).all()
+
+
+def test_rolling_ratio():
+    numerator = np.array([10.0, 20.0, 30.0, 40.0])
+    denominator = np.array([1.0, 2.0, 3.0, 4.0])
+    # the first values use the values available
+    assert_allclose(rolling_ratio(numerator, np.ones(4), 2), [10, 15, 25, 35])
+    assert_allclose(rolling_ratio(numerator, denominator, 3), [10, 10, 10, 10])
+
+
+def test_rolling_ratio_window_of_one():
+    numerator = np.array([3.0, 8.0, 1.0])
+    denominator = np.array([1.0, 4.0, 2.0])
+    assert_allclose(rolling_ratio(numerator, denominator, 1), numerator / denominator)
+
+
+def test_rolling_ratio_window_longer_than_series():
+    numerator = np.array([3.0, 8.0, 1.0])
+    # the cumulative ratio
+    assert_allclose(rolling_ratio(numerator, np.ones(3), 10), [3, 5.5, 4])
+
+
+def test_rolling_ratio_zero_denominators():
+    numerator = np.array([5.0, 5.0, 5.0, 5.0])
+    denominator = np.array([0.0, 0.0, 10.0, 0.0])
+    # NaN until the window has a positive denominator, and after it leaves the window
+    assert_allclose(rolling_ratio(numerator, denominator, 2), [np.nan, np.nan, 1.0, 1.0])
+    assert_allclose(rolling_ratio(numerator, denominator, 1), [np.nan, np.nan, 0.5, np.nan])
+
+
+def test_rolling_ratio_empty():
+    assert rolling_ratio(np.array([]), np.array([]), 5).shape == (0,)
+
+
+def test_to_list():
+    assert to_list(np.array([1.23456, 2.0])) == [1.235, 2.0]
+    assert to_list(np.array([1.23456, np.nan, np.inf])) == [1.235, None, None]
+
+
+def test_analytics_route(client, headers):
+    response = client.get('/logs/me/2/analytics/?window=2', headers=headers)
+    assert response.status_code == 200, response.json
+    summary = response.json['summary']
+    series = response.json['series']
+    assert summary['log_count'] == 6
+    assert summary['window'] == 2
+    # the fill ups between the first and the last
+    assert len(series['consumption']) == 4
+    assert all(len(values) == 4 for values in series.values())
+
+
+def test_analytics_route_validation(client, headers):
+    for window in (0, 101, 'a'):
+        response = client.get(f'/logs/me/2/analytics/?window={window}', headers=headers)
+        assert response.status_code == 400
+        assert 'window' in response.json['valiadtion_error']
+
+
+def test_analytics_without_enough_log_entries(client, headers):
+    response = client.post('/cars/me/', json={
+        'make': 'Mazda', 'model': 'Tribute', 'model_trim': 'Sports', 'year': 2006, 'tank_size': 66
+    }, headers=headers)
+    user_car_id = response.json['id']
+    for odometer in (1000, 1500):
+        client.post(f'/logs/me/{user_car_id}/', json={
+            'current_odo': odometer, 'fuel_quantity': 40, 'fuel_price': 2.0
+        }, headers=headers)
+    response = client.get(f'/logs/me/{user_car_id}/analytics/', headers=headers)
+    assert response.status_code == 400
+    assert 'calc_error' in response.json
@@ -0,0 +1,76 @@
+"""
+Tests of the benchmark regression check
+
+The command line is run in a subprocess against its own SQLite database with a
+few requests, the baseline is written so the run does or doesn't regress
+"""
+import json
+import os
+import subprocess
+import sys
+from benchmarks.suite import compare
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'src')
+
+RESULT = {
+    'requests': 10, 'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0,
+    'rps': 100.0, 'sql_per_request': 2.0, 'errors': 0
+}
+
+
+def results(**metrics) -> dict:
+    """
+    The results of the get_all_cars scenario with the metrics changed
+    """
+    return {'results': {'test_client': {'get_all_cars': dict(RESULT, **metrics)}}}
+
+
+def run_benchmarks(tmp_path, baseline: dict) -> subprocess.CompletedProcess:
+    """
+    Run the get_all_cars scenario compared with the baseline
+    """
+    baseline_file = tmp_path / 'baseline.json'
+    baseline_file.write_text(json.dumps(baseline))
+    return subprocess.run(
+        [
+            sys.executable, '-m', 'benchmarks',
+            '--database', f'sqlite:///{tmp_path / "benchmark.db"}',
+            '--users', '1', '--logs-per-car', '5', '--requests', '3', '--warmup', '0',
+            '--mode', 'test_client', '--scenarios', 'get_all_cars',
+            '--baseline', str(baseline_file)
+        ],
+        cwd=SRC, capture_output=True, text=True, timeout=120, check=False
+    )
+
+
+def test_compare_thresholds():
+    baseline = results()
+    assert compare(results(p50_ms=11.9, p95_ms=23.9, rps=80.1), baseline, 0.2) == []
+    assert compare(results(p95_ms=24.1), baseline, 0.2) == [
+        'test_client get_all_cars p95_ms: 20.0 -> 24.1 (+20.5%)'
+    ]
+    assert compare(results(rps=79.0), baseline, 0.2) == [
+        'test_client get_all_cars rps: 100.0 -> 79.0 (-21.0%)'
+    ]
+    # any increase of the statements is a regression
+    assert compare(results(sql_per_request=2.01), baseline, 0.2) == [
+        'test_client get_all_cars sql_per_request: 2.0 -> 2.01'
+    ]
+    # the scenarios missing from the baseline aren't compared
+    assert compare(results(p50_ms=100.0), {'results': {}}, 0.2) == []
+
+
+def test_exit_code_without_regression(tmp_path):
+    baseline = results(p50_ms=10 ** 6, p95_ms=10 ** 6, rps=0.001, sql_per_request=100.0)
+    process = run_benchmarks(tmp_path, baseline)
+    assert process.returncode == 0, process.stderr
+    assert 'REGRESSION' not in process.stderr
+    output = json.loads(process.stdout[process.stdout.index('{'):])
+    assert output['results']['test_client']['get_all_cars']['errors'] == 0
+
+
+def test_exit_code_with_regression(tmp_path):
+    baseline = results(p50_ms=10 ** 6, p95_ms=10 ** 6, rps=0.001, sql_per_request=0.0)
+    process = run_benchmarks(tmp_path, baseline)
+    assert process.returncode == 1, process.stderr
+    assert 'REGRESSION test_client get_all_cars sql_per_request: 0.0 ->' in process.stderr
@@ -0,0 +1,35 @@
+"""
+Tests of the SQL statements of the car routes
+
+The identity cache is off in the tests, so each route loads the user once
+"""
+from conftest import count_statements
+
+NEW_CAR = {
+    'make': 'Mazda', 'model': 'Tribute', 'model_trim': 'Sports', 'year': 2006, 'tank_size': 66
+}
+
+
+def test_add_new_car_statements(app, client, headers):
+    with count_statements(app) as statements:
+        response = client.post('/cars/me/', json=NEW_CAR, headers=headers)
+    assert response.status_code == 200, response.json
+    assert response.json == {
+        'id': 3,
+        'car': {'make': 'Mazda', 'model': 'Tribute', 'model_trim': 'Sports', 'year': 2006},
+        'logs': []
+    }
+    # the user, the upsert of the car and the insert of the user car
+    assert len(statements) == 3
+
+
+def test_add_existing_car(app, client, headers):
+    client.post('/cars/me/', json=NEW_CAR, headers=headers)
+    with count_statements(app) as statements:
+        response = client.post('/cars/me/', json=NEW_CAR, headers=headers)
+    assert response.status_code == 200
+    # the existing car isn't inserted again
+    assert response.json['id'] == 4
+    assert len(statements) == 3
+    cars = client.get('/cars/me/', headers=headers).json
+    assert [user_car['car']['model'] for user_car in cars].count('Tribute') == 2
@@ -0,0 +1,78 @@
+"""
+Tests of the catalog cache
+
+The cache is off in the other tests, here it's turned on with a TTL. The
+catalog responses have an ETag, and the cache is dropped when a car is added,
+updated or deleted
+"""
+import pytest
+from conftest import count_statements
+from catalog_cache import catalog_cache
+
+NEW_CAR = {
+    'make': 'Mazda', 'model': 'Tribute', 'model_trim': 'Sports', 'year': 2006, 'tank_size': 66
+}
+
+
+@pytest.fixture
+def cache_on(app, monkeypatch):
+    """
+    Turn the catalog cache on, it's emptied before and after the test
+    """
+    monkeypatch.setitem(app.config, 'CATALOG_CACHE_TTL', 60)
+    catalog_cache.bump()
+    yield
+    catalog_cache.bump()
+
+
+def test_cached_catalog_response(app, client, headers, cache_on):
+    first = client.get('/cars/', headers=headers)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    with count_statements(app) as statements:
+        second = client.get('/cars/', headers=headers)
+    assert second.data == first.data
+    assert second.headers['ETag'] == etag
+    # only the user is loaded, the cars are sent from the cache
+    assert len(statements) == 1
+
+
+def test_if_none_match(client, headers, cache_on):
+    etag = client.get('/cars/', headers=headers).headers['ETag']
+    response = client.get('/cars/', headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+    assert response.data == b''
+    response = client.get('/cars/', headers=dict(headers, **{'If-None-Match': '"other"'}))
+    assert response.status_code == 200
+
+
+def test_adding_a_car_bumps_the_version(client, headers, cache_on):
+    first = client.get('/cars/', headers=headers)
+    version = catalog_cache.version
+    assert client.post('/cars/me/', json=NEW_CAR, headers=headers).status_code == 200
+    assert catalog_cache.version == version + 1
+    response = client.get('/cars/', headers=dict(headers, **{'If-None-Match': first.headers['ETag']}))
+    assert response.status_code == 200
+    assert len(response.json) == len(first.json) + 1
+    assert response.headers['ETag'] != first.headers['ETag']
+
+
+def test_updating_a_car_bumps_the_version(client, headers, admin_headers, cache_on):
+    car = client.get('/cars/', headers=headers).json[0]
+    version = catalog_cache.version
+    response = client.put(f"/cars/{car['id']}", json={
+        'make': car['make'], 'model': car['model'], 'model_trim': 'Touring',
+        'year': car['year'], 'tank_size': car['tank_size']
+    }, headers=admin_headers)
+    assert response.status_code == 200
+    assert catalog_cache.version == version + 1
+    assert client.get('/cars/', headers=headers).json[0]['model_trim'] == 'Touring'
+
+
+def test_deleting_a_car_bumps_the_version(client, headers, admin_headers, cache_on):
+    cars = client.get('/cars/', headers=headers).json
+    version = catalog_cache.version
+    assert client.delete(f"/cars/{cars[-1]['id']}", headers=admin_headers).status_code == 200
+    assert catalog_cache.version == version + 1
+    assert [car['id'] for car in client.get('/cars/', headers=headers).json] == \
+        [car['id'] for car in cars[:-1]]
@@ -0,0 +1,72 @@
+"""
+Tests of the identity cache
+
+The cache is off in the other tests, here it's turned on with a TTL. The user
+and the user's cars are loaded once and kept until the user's list of cars
+changes
+"""
+import pytest
+from conftest import count_statements
+from identity_cache import identity_cache
+from init import db
+from models.user_car import UserCar
+
+NEW_CAR = {
+    'make': 'Mazda', 'model': 'Tribute', 'model_trim': 'Sports', 'year': 2006, 'tank_size': 66
+}
+
+
+@pytest.fixture
+def cache_on(app, monkeypatch):
+    """
+    Turn the identity cache on, it's emptied before and after the test
+    """
+    monkeypatch.setitem(app.config, 'IDENTITY_CACHE_TTL', 60)
+    identity_cache.clear()
+    yield
+    identity_cache.clear()
+
+
+def user_car_logs(client, headers, user_car_id: int) -> dict:
+    """
+    The response body of the user car's log entries
+    """
+    return client.get(f'/logs/me/{user_car_id}/', headers=headers).json
+
+
+def test_cached_identity(app, client, headers, cache_on):
+    client.get('/logs/me/2/trips/', headers=headers)
+    with count_statements(app) as statements:
+        response = client.get('/logs/me/2/trips/', headers=headers)
+    assert response.status_code == 200
+    # the user and the user's cars come from the cache, only the trips are selected
+    assert len(statements) == 1
+
+
+def test_adding_a_car_invalidates_the_user(client, headers, cache_on):
+    assert user_car_logs(client, headers, 2)[0]['id']
+    user_car_id = client.post('/cars/me/', json=NEW_CAR, headers=headers).json['id']
+    # the new user car is owned at once, it has no log entries
+    assert user_car_logs(client, headers, user_car_id) == {
+        'not_found': 'No log entries for user car'
+    }
+
+
+def test_deleting_a_car_invalidates_the_user(client, headers, cache_on):
+    user_car_id = client.post('/cars/me/', json=NEW_CAR, headers=headers).json['id']
+    assert user_car_logs(client, headers, user_car_id) == {
+        'not_found': 'No log entries for user car'
+    }
+    assert client.delete(f'/cars/me/{user_car_id}', headers=headers).status_code == 200
+    assert user_car_logs(client, headers, user_car_id) == {'not_found': 'User car not found'}
+    cars = client.get('/cars/me/', headers=headers).json
+    assert user_car_id not in [user_car['id'] for user_car in cars]
+
+
+def test_deleting_a_catalog_car_invalidates_all_users(app, client, headers, admin_headers,
+                                                      cache_on):
+    assert user_car_logs(client, headers, 2)[0]['id']
+    with app.app_context():
+        car_id = db.session.get(UserCar, 2).car_id
+    assert client.delete(f'/cars/{car_id}', headers=admin_headers).status_code == 200
+    assert user_car_logs(client, headers, 2) == {'not_found': 'User car not found'}
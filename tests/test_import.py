@@ -0,0 +1,127 @@
+"""
+Tests of the log entry import
+
+The valid entries are inserted and the invalid ones are returned with their
+errors by position. The consumption stats after the import are the same as
+the stats rebuilt from the log entries. The single log entry routes don't take
+the date of the fill up
+"""
+from io import BytesIO
+from init import db
+from models.consumption_stats import ConsumptionStats
+from models.log import LogEntry
+
+IMPORT_URL = '/logs/me/2/import/'
+
+CSV = (
+    'current_odo,fuel_quantity,fuel_price,date_added\n'
+    '125000,45,1.95,2023-07-01\n'
+    '125600,50,1.99,\n'
+)
+
+STATS_COLUMNS = (
+    'log_count', 'total_fuel', 'first_odo', 'first_fuel', 'second_odo',
+    'last_odo', 'last_fuel', 'last_date', 'last_log_id'
+)
+
+
+def log_count(app) -> int:
+    """
+    The number of log entries of user car 2
+    """
+    with app.app_context():
+        return db.session.scalar(
+            db.select(db.func.count(LogEntry.id)).filter_by(user_car_id=2)
+        )
+
+
+def stats_values(stats: ConsumptionStats) -> dict:
+    """
+    The values of the columns of the stats
+    """
+    return {column: getattr(stats, column) for column in STATS_COLUMNS}
+
+
+def test_import_returns_errors_by_position(app, client, headers):
+    response = client.post(IMPORT_URL, json=[
+        {'current_odo': 125000, 'fuel_quantity': 45, 'fuel_price': 1.95, 'date_added': '2023-07-01'},
+        {'current_odo': -1, 'fuel_quantity': 45, 'fuel_price': 1.95},
+        {'current_odo': 125600, 'fuel_quantity': 50, 'fuel_price': 1.99},
+        {'current_odo': 126200, 'fuel_quantity': 50, 'date_added': '01/08/2023'}
+    ], headers=headers)
+    assert response.status_code == 201, response.json
+    assert response.json['imported'] == 2
+    assert response.json['errors'] == {
+        '1': {'current_odo': ['Must be greater than or equal to 0.']},
+        '3': {
+            'fuel_price': ['Missing data for required field.'],
+            'date_added': ['Not a valid date, must be YYYY-MM-DD']
+        }
+    }
+    assert log_count(app) == 8
+    dates = [log['date_added'] for log in client.get('/logs/me/2/', headers=headers).json]
+    assert '2023-07-01' in dates
+
+
+def test_import_with_only_invalid_entries(app, client, headers):
+    response = client.post(IMPORT_URL, json=[{'current_odo': 125000}], headers=headers)
+    assert response.status_code == 400
+    assert response.json['valiadtion_error'] == {'0': {
+        'fuel_quantity': ['Missing data for required field.'],
+        'fuel_price': ['Missing data for required field.']
+    }}
+    assert log_count(app) == 6
+
+
+def test_import_csv_body(app, client, headers):
+    response = client.post(IMPORT_URL, data=CSV, content_type='text/csv', headers=headers)
+    assert response.status_code == 201, response.json
+    assert response.json == {'imported': 2, 'errors': {}}
+    assert log_count(app) == 8
+
+
+def test_import_csv_upload(app, client, headers):
+    # the byte order mark of spreadsheet exports is left out
+    upload = (BytesIO(b'\xef\xbb\xbf' + CSV.encode()), 'logs.csv')
+    response = client.post(
+        IMPORT_URL, data={'file': upload}, content_type='multipart/form-data', headers=headers
+    )
+    assert response.status_code == 201, response.json
+    assert response.json == {'imported': 2, 'errors': {}}
+    assert log_count(app) == 8
+
+
+def test_import_body_must_be_a_list(client, headers):
+    response = client.post(
+        IMPORT_URL, json={'current_odo': 125000, 'fuel_quantity': 45, 'fuel_price': 1.95},
+        headers=headers
+    )
+    assert response.status_code == 400
+    assert response.json == {'bad_request': 'Request body must be a list of log entries'}
+
+
+def test_import_keeps_stats_equal_to_rebuild(app, client, headers):
+    response = client.post(IMPORT_URL, json=[
+        # before the oldest, between and after the newest seeded entries
+        {'current_odo': 500, 'fuel_quantity': 30, 'fuel_price': 1.8, 'date_added': '2023-01-10'},
+        {'current_odo': 101000, 'fuel_quantity': 40, 'fuel_price': 1.9, 'date_added': '2023-05-20'},
+        {'current_odo': 130000, 'fuel_quantity': 55, 'fuel_price': 2.0}
+    ], headers=headers)
+    assert response.status_code == 201, response.json
+    with app.app_context():
+        imported = stats_values(db.session.get(ConsumptionStats, 2))
+        assert imported == stats_values(ConsumptionStats.rebuild(2))
+        db.session.rollback()
+    assert imported['log_count'] == 9
+
+
+def test_single_entry_routes_reject_the_date(client, headers):
+    log_entry = {'current_odo': 125000, 'fuel_quantity': 45, 'fuel_price': 1.95,
+                 'date_added': '2023-07-01'}
+    log_id = client.get('/logs/me/2/', headers=headers).json[-1]['id']
+    for response in (
+        client.post('/logs/me/2/', json=log_entry, headers=headers),
+        client.put(f'/logs/me/2/{log_id}', json=log_entry, headers=headers)
+    ):
+        assert response.status_code == 400
+        assert response.json == {'valiadtion_error': {'date_added': ['Unknown field.']}}
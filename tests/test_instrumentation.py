@@ -0,0 +1,55 @@
+"""
+Tests of the SQL instrumentation
+
+The instrumentation is off in the other tests, here an app is created with it
+turned on. The SQL statements of each request are counted in the response headers
+"""
+import logging
+import pytest
+import config
+from app import create_app
+from conftest import login
+
+
+@pytest.fixture
+def instrumented_client(client, monkeypatch):
+    """
+    Test client of an app with SQL_INSTRUMENTATION on, it uses the seeded
+    database of the client fixture
+    """
+    monkeypatch.setattr(config.DevConfig, 'SQL_INSTRUMENTATION', True)
+    return create_app().test_client()
+
+
+def test_query_headers(instrumented_client):
+    headers = login(instrumented_client, 'will.thomas@gmail.com', 'thisIsapassword')
+    response = instrumented_client.get('/logs/me/2/trips/', headers=headers)
+    assert response.status_code == 200
+    queries = int(response.headers['X-DB-Queries'])
+    # the user, the user's cars and the trips
+    assert queries == 3
+    server_timing = response.headers['Server-Timing']
+    assert server_timing.startswith('db;dur=')
+    assert server_timing.endswith(f'desc="{queries} queries"')
+
+
+def test_no_queries(instrumented_client):
+    response = instrumented_client.get('/metrics')
+    assert response.headers['X-DB-Queries'] == '0'
+    assert response.headers['Server-Timing'] == 'db;dur=0.00;desc="0 queries"'
+
+
+def test_headers_are_off_by_default(client, headers):
+    response = client.get('/logs/me/2/trips/', headers=headers)
+    assert 'X-DB-Queries' not in response.headers
+    assert 'Server-Timing' not in response.headers
+
+
+def test_slow_query_log(instrumented_client, caplog):
+    instrumented_client.application.config['SLOW_QUERY_MS'] = 0
+    headers = login(instrumented_client, 'will.thomas@gmail.com', 'thisIsapassword')
+    with caplog.at_level(logging.WARNING):
+        instrumented_client.get('/logs/me/2/trips/', headers=headers)
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith('Slow query') and 'GET /logs/me/2/trips/' in message
+               for message in messages)
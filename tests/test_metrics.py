@@ -0,0 +1,74 @@
+"""
+Tests of the request metrics
+
+The metrics are global to the app, so the tests compare the counts before and
+after their requests
+"""
+import threading
+from metrics import Metrics, metrics
+
+
+def response_count(blueprint: str, endpoint: str, status: int) -> int:
+    """
+    The number of responses recorded for the endpoint and status code
+    """
+    return metrics.snapshot()['responses'].get((blueprint, endpoint, status), 0)
+
+
+def test_metrics_route(client, headers):
+    client.get('/logs/me/2/trips/', headers=headers)
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.data.decode()
+    for name in ('http_request_duration_seconds', 'http_responses_total', 'app_errors_total',
+                 'db_pool_checked_out', 'db_pool_overflow', 'db_pool_size'):
+        assert f'# TYPE {name} ' in text
+    labels = 'blueprint="log",endpoint="log.get_all_trips"'
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} ' in text
+    assert f'http_responses_total{{{labels},status="200"}} ' in text
+
+
+def test_responses_and_errors_are_counted(client, headers):
+    before = response_count('log', 'log.get_all_trips', 200)
+    errors = metrics.snapshot()['errors'].get('ValidationError', 0)
+    for _ in range(3):
+        client.get('/logs/me/2/trips/', headers=headers)
+    client.post('/logs/me/2/', json={'current_odo': -1}, headers=headers)
+    assert response_count('log', 'log.get_all_trips', 200) == before + 3
+    assert metrics.snapshot()['errors']['ValidationError'] == errors + 1
+    assert f'app_errors_total{{error="ValidationError"}} {errors + 1}\n' in \
+        client.get('/metrics').data.decode()
+
+
+def test_histogram_buckets(app):
+    test_metrics = Metrics(buckets=(0.1, 1))
+    for seconds in (0.05, 0.1, 0.5, 2):
+        test_metrics.observe('app', 'index', 200, seconds)
+    durations = test_metrics.snapshot()['durations'][('app', 'index')]
+    # the count of each bucket, of +Inf and the sum
+    assert durations == [2, 1, 1, 2.65]
+    with app.app_context():
+        lines = test_metrics.render().splitlines()
+    labels = 'blueprint="app",endpoint="index"'
+    assert f'http_request_duration_seconds_bucket{{{labels},le="0.1"}} 2' in lines
+    assert f'http_request_duration_seconds_bucket{{{labels},le="1"}} 3' in lines
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 4' in lines
+    assert f'http_request_duration_seconds_count{{{labels}}} 4' in lines
+
+
+def test_finished_threads_are_retired():
+    test_metrics = Metrics()
+    def record():
+        test_metrics.observe('app', 'index', 200, 0.01)
+        test_metrics.record_error('BadRequest')
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    totals = test_metrics.snapshot()
+    assert totals['responses'][('app', 'index', 200)] == 4
+    assert totals['errors'] == {'BadRequest': 4}
+    # the accumulators of the finished threads are folded into the retired totals
+    assert test_metrics.threads == []
@@ -0,0 +1,67 @@
+"""
+Tests of ``flask cli create`` upgrading a database created by an older version
+of the app
+"""
+from init import db
+from models.trip import Trip
+from models.consumption_stats import ConsumptionStats
+
+# the user_trips table before the unique trips constraint
+LEGACY_USER_TRIPS = '''
+CREATE TABLE user_trips (
+    id INTEGER NOT NULL PRIMARY KEY,
+    fuel_price FLOAT NOT NULL,
+    distance INTEGER NOT NULL,
+    user_car_id INTEGER NOT NULL REFERENCES user_cars (id) ON DELETE cascade
+)
+'''
+
+
+def create(app):
+    """
+    Run flask cli create and return its output
+    """
+    result = app.test_cli_runner().invoke(args=['cli', 'create'])
+    assert result.exception is None, result.output
+    return result.output
+
+
+def test_create_adds_the_unique_trips_constraint(app, client, headers):
+    with app.app_context():
+        db.session.execute(db.text('DROP TABLE user_trips'))
+        db.session.execute(db.text(LEGACY_USER_TRIPS))
+        db.session.execute(db.insert(Trip), [
+            {'id': 1, 'user_car_id': 2, 'fuel_price': 1.9, 'distance': 400},
+            {'id': 2, 'user_car_id': 2, 'fuel_price': 1.9, 'distance': 400},
+            {'id': 3, 'user_car_id': 2, 'fuel_price': 1.95, 'distance': 800},
+            {'id': 4, 'user_car_id': 1, 'fuel_price': 1.9, 'distance': 400}
+        ])
+        db.session.commit()
+    assert 'unique trips constraint added' in create(app)
+    with app.app_context():
+        assert db.session.scalars(db.select(Trip.id).order_by(Trip.id)).all() == [1, 3, 4]
+    # the trip calculator saves the trip once with ON CONFLICT
+    for _ in range(2):
+        response = client.post(
+            '/logs/me/2/trip/calculator/', json={'distance': 300, 'fuel_price': 2.0},
+            headers=headers
+        )
+        assert response.status_code == 200
+    with app.app_context():
+        assert db.session.scalar(
+            db.select(db.func.count()).select_from(Trip).filter_by(user_car_id=2)
+        ) == 3
+    # it's only added once
+    assert 'unique trips constraint' not in create(app)
+
+
+def test_create_builds_the_missing_stats(app, client):
+    # a database upgraded from before the consumption stats
+    with app.app_context():
+        db.session.execute(db.delete(ConsumptionStats))
+        db.session.commit()
+    assert 'Consumption stats built for 2 user cars' in create(app)
+    with app.app_context():
+        stats = db.session.get(ConsumptionStats, 2)
+        assert (stats.log_count, stats.total_fuel) == (6, 420)
+    assert 'Consumption stats built' not in create(app)
@@ -0,0 +1,68 @@
+"""
+Tests of the keyset pagination of the list routes
+"""
+import json
+from base64 import urlsafe_b64encode
+
+
+def cursor(values) -> str:
+    """
+    Encode a cursor like pagination.encode_cursor
+    """
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def test_next_link_pages_through_the_logs(client, headers):
+    first = client.get('/logs/me/2/?limit=4', headers=headers)
+    assert first.status_code == 200
+    assert len(first.json) == 4
+    next_url = first.headers['Link'].split(';')[0].strip('<>')
+    assert 'format' not in next_url
+    second = client.get(next_url, headers=headers)
+    assert [log['id'] for log in first.json + second.json] == \
+        [log['id'] for log in client.get('/logs/me/2/', headers=headers).json]
+    assert 'Link' not in second.headers
+
+
+def test_next_link_pages_through_added_logs(client, headers):
+    # the logs added through the API have the float timestamps of the default
+    for odometer in (120000, 120500, 121000):
+        response = client.post('/logs/me/2/', json={
+            'current_odo': odometer, 'fuel_quantity': 40, 'fuel_price': 2.0
+        }, headers=headers)
+        assert response.status_code == 200
+    ids = []
+    next_url = '/logs/me/2/?limit=7'
+    while next_url:
+        response = client.get(next_url, headers=headers)
+        assert response.status_code == 200, response.json
+        ids += [log['id'] for log in response.json]
+        next_url = response.headers.get('Link', '').split(';')[0].strip('<>')
+    assert len(ids) == 9
+    assert ids == [log['id'] for log in client.get('/logs/me/2/', headers=headers).json]
+
+
+def test_ndjson_next_link_keeps_the_format(client, headers):
+    first = client.get('/logs/me/2/?limit=4&format=ndjson', headers=headers)
+    assert first.mimetype == 'application/x-ndjson'
+    assert len(first.get_data(as_text=True).splitlines()) == 4
+    next_url = first.headers['Link'].split(';')[0].strip('<>')
+    assert 'format=ndjson' in next_url
+    second = client.get(next_url, headers=headers)
+    assert second.mimetype == 'application/x-ndjson'
+    assert len(second.get_data(as_text=True).splitlines()) == 2
+
+
+def test_cursor_values_must_match_the_key_types(client, headers):
+    for values in (['2023-05-01', 1], [1684000000, 'x'], [1684000000, True], [1684000000],
+                   [float('nan'), 1]):
+        response = client.get(f'/logs/me/2/?limit=2&after={cursor(values)}', headers=headers)
+        assert response.status_code == 400
+        assert response.json == {'valiadtion_error': {'after': ['Invalid cursor']}}
+    response = client.get(f'/logs/me/2/?limit=2&after={cursor([0, 0])}', headers=headers)
+    assert response.status_code == 200
+
+
+def test_invalid_trip_cursor(client, headers):
+    response = client.get(f"/logs/me/2/trips/?after={cursor(['1'])}", headers=headers)
+    assert response.status_code == 400
@@ -0,0 +1,85 @@
+"""
+Tests of the password hashing pool
+
+The logins get 429 when the pool and its queue are full, and the password is
+rehashed on login when the work factor has changed
+"""
+import threading
+import pytest
+from init import db
+from metrics import metrics
+from models.user import User
+from password_hashing import password_hasher
+
+CREDENTIALS = {'email': 'will.thomas@gmail.com', 'password': 'thisIsapassword'}
+
+
+def password_hash(app) -> str:
+    """
+    The password hash of will.thomas@gmail.com
+    """
+    with app.app_context():
+        return db.session.scalar(db.select(User.password).filter_by(email=CREDENTIALS['email']))
+
+
+@pytest.fixture
+def saturated_pool(app):
+    """
+    A pool of one worker and no queue, the worker is kept busy until the end of the test
+    """
+    password_hasher.configure(1, 0)
+    started = threading.Event()
+    release = threading.Event()
+    def hold():
+        started.set()
+        release.wait(10)
+    thread = threading.Thread(target=password_hasher.run, args=(hold,))
+    thread.start()
+    assert started.wait(10)
+    yield
+    release.set()
+    thread.join()
+    password_hasher.configure(app.config['BCRYPT_WORKERS'], app.config['BCRYPT_QUEUE_SIZE'])
+
+
+def test_saturated_pool(client, saturated_pool):
+    errors = metrics.snapshot()['errors'].get('PasswordHashingBusy', 0)
+    response = client.post('/login', json=CREDENTIALS)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    assert response.json == {'too_many_requests': 'Server is busy, try again later'}
+    assert metrics.snapshot()['errors']['PasswordHashingBusy'] == errors + 1
+
+
+def test_slot_is_given_back(app, client):
+    password_hasher.configure(1, 0)
+    try:
+        # each login takes the only slot and gives it back when the hash is done
+        for _ in range(3):
+            assert client.post('/login', json=CREDENTIALS).status_code == 200
+    finally:
+        password_hasher.configure(app.config['BCRYPT_WORKERS'], app.config['BCRYPT_QUEUE_SIZE'])
+
+
+def test_rehash_on_login(app, client, monkeypatch):
+    seeded_hash = password_hash(app)
+    assert seeded_hash.split('$')[2] == '04'
+    response = client.post('/login', json=CREDENTIALS)
+    assert response.status_code == 200
+    # the work factor hasn't changed
+    assert password_hash(app) == seeded_hash
+    monkeypatch.setitem(app.config, 'BCRYPT_LOG_ROUNDS', 5)
+    assert client.post('/login', json=CREDENTIALS).status_code == 200
+    rehashed = password_hash(app)
+    assert rehashed.split('$')[2] == '05'
+    # the password still works and isn't rehashed again
+    assert client.post('/login', json=CREDENTIALS).status_code == 200
+    assert password_hash(app) == rehashed
+
+
+def test_wrong_password_isnt_rehashed(app, client, monkeypatch):
+    seeded_hash = password_hash(app)
+    monkeypatch.setitem(app.config, 'BCRYPT_LOG_ROUNDS', 5)
+    response = client.post('/login', json=dict(CREDENTIALS, password='wrongpassword'))
+    assert response.status_code == 401
+    assert password_hash(app) == seeded_hash
@@ -0,0 +1,142 @@
+"""
+Tests of the read replica routing
+
+An app is created with a replica bind on the test database, so the reads can
+be checked by the engine they're sent to. The reads of GET requests and of the
+views marked with read_replica go to the replica, everything else and the reads
+of users that just wrote go to the primary
+"""
+import pytest
+import config
+import replicas
+from sqlalchemy import event
+from app import create_app
+from conftest import DB_DIR, login
+from init import db
+from replicas import StickyUsers
+
+LOG_ENTRY = {'current_odo': 125000, 'fuel_quantity': 45, 'fuel_price': 1.95}
+
+
+@pytest.fixture
+def replica_app(client, monkeypatch):
+    """
+    App with a replica bind on the seeded database of the client fixture, and
+    no sticky users
+    """
+    monkeypatch.setattr(config.DevConfig, 'SQLALCHEMY_BINDS',
+                        {'replica_1': f'sqlite:///{DB_DIR}/test.db'})
+    monkeypatch.setattr(config.DevConfig, 'REPLICA_BINDS', ['replica_1'])
+    monkeypatch.setattr(replicas, 'sticky_users', StickyUsers())
+    yield create_app()
+    # the metadata of the bind is shared by the apps, the other tests' app has no replica
+    db.metadatas.pop('replica_1', None)
+
+
+@pytest.fixture
+def statements(replica_app):
+    """
+    The statements sent to the primary and the replica, by bind name
+    """
+    sent = {'primary': [], 'replica': []}
+    with replica_app.app_context():
+        engines = {'primary': db.engines[None], 'replica': db.engines['replica_1']}
+    listeners = []
+    for name, engine in engines.items():
+        def before_cursor_execute(conn, cursor, statement, *args, name=name):
+            sent[name].append(statement)
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        listeners.append((engine, before_cursor_execute))
+    yield sent
+    for engine, listener in listeners:
+        event.remove(engine, 'before_cursor_execute', listener)
+
+
+@pytest.fixture
+def replica_client(replica_app):
+    """
+    Test client of the app with a replica
+    """
+    return replica_app.test_client()
+
+
+@pytest.fixture
+def user_headers(replica_client):
+    """
+    Authorization header of will.thomas@gmail.com
+    """
+    return login(replica_client, 'will.thomas@gmail.com', 'thisIsapassword')
+
+
+def clear(statements: dict):
+    """
+    Forget the statements sent so far
+    """
+    for sent in statements.values():
+        sent.clear()
+
+
+def test_get_reads_from_the_replica(replica_client, user_headers, statements):
+    clear(statements)
+    response = replica_client.get('/logs/me/2/', headers=user_headers)
+    assert response.status_code == 200
+    assert statements['replica']
+    assert statements['primary'] == []
+
+
+def test_writes_go_to_the_primary(replica_client, user_headers, statements):
+    clear(statements)
+    response = replica_client.post('/logs/me/2/', json=LOG_ENTRY, headers=user_headers)
+    assert response.status_code == 200, response.json
+    assert any(statement.startswith('INSERT') for statement in statements['primary'])
+    # the reads of requests that aren't read only also go to the primary
+    assert statements['replica'] == []
+
+
+def test_read_replica_view(replica_client, user_headers, statements):
+    clear(statements)
+    response = replica_client.post('/logs/me/2/expenditure/', json={
+        'from_date': '2023-05-01', 'to_date': '2023-06-30'
+    }, headers=user_headers)
+    assert response.status_code == 200, response.json
+    assert statements['replica']
+    assert statements['primary'] == []
+
+
+def test_user_is_sticky_after_writing(replica_client, user_headers, statements):
+    other_headers = login(replica_client, 'john.smith@test.com', 'password123')
+    replica_client.post('/logs/me/2/', json=LOG_ENTRY, headers=user_headers)
+    clear(statements)
+    # the user that wrote reads its write from the primary
+    response = replica_client.get('/logs/me/2/', headers=user_headers)
+    assert response.json[-1]['current_odo'] == 125000
+    assert statements['primary']
+    assert statements['replica'] == []
+    # the other users still read from the replica
+    clear(statements)
+    assert replica_client.get('/logs/me/1/', headers=other_headers).status_code == 200
+    assert statements['replica']
+    assert statements['primary'] == []
+
+
+def test_sticky_user_expires(replica_app, replica_client, user_headers, statements,
+                             monkeypatch):
+    monkeypatch.setitem(replica_app.config, 'REPLICA_STICKY_SECONDS', 0)
+    replica_client.post('/logs/me/2/', json=LOG_ENTRY, headers=user_headers)
+    clear(statements)
+    replica_client.get('/logs/me/2/', headers=user_headers)
+    assert statements['replica']
+    assert statements['primary'] == []
+
+
+def test_sticky_users_remove_the_expired(monkeypatch):
+    monkeypatch.setattr(replicas, 'STICKY_USERS_SIZE', 2)
+    sticky_users = StickyUsers()
+    sticky_users.stick(1, 0)
+    sticky_users.stick(2, 60)
+    assert not sticky_users.is_sticky(1)
+    assert sticky_users.is_sticky(2)
+    # at the size the expired users are removed before adding
+    sticky_users.stick(3, 60)
+    assert sorted(sticky_users._expires) == [2, 3]
+    assert not sticky_users.is_sticky(4)
@@ -0,0 +1,189 @@
+"""
+Tests of the background report jobs
+
+The jobs run on the report job workers, the tests poll a job until it's
+finished. A finished job is reused for the same user car, kind and parameters
+until a write marks it stale
+"""
+import time
+from init import db
+from models.report_job import ReportJob, ReportJobChunk, PENDING, RUNNING
+from models.user_car import UserCar
+from report_jobs import report_job_runner
+
+REPORT_BODY = {'from_date': '2023-01-01', 'to_date': '2023-12-31', 'period': 'month'}
+
+
+def wait(client, headers, job_id: int) -> dict:
+    """
+    Poll the job until it's done or failed and return its status
+    """
+    for _ in range(200):
+        job = client.get(f'/logs/me/jobs/{job_id}/', headers=headers).json
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'Report job {job_id} is still {job["status"]}')
+
+
+def start_job(client, headers, url: str, **kwargs) -> dict:
+    """
+    Start a new job and wait for it to finish
+    """
+    response = client.post(url, headers=headers, **kwargs)
+    assert response.status_code == 202, response.json
+    assert response.headers['Location'] == f"/logs/me/jobs/{response.json['id']}/"
+    return wait(client, headers, response.json['id'])
+
+
+def test_expenditure_report_job_result(client, headers):
+    job = start_job(client, headers, '/logs/me/2/expenditure/report/jobs/', json=REPORT_BODY)
+    assert job['status'] == 'done'
+    result = client.get(job['result'], headers=headers)
+    report = client.post('/logs/me/2/expenditure/report/', json=REPORT_BODY, headers=headers)
+    assert result.status_code == report.status_code
+    assert result.json == report.json
+
+
+def test_export_job_is_saved_in_chunks(app, client, headers, monkeypatch):
+    # one log entry or trip in each chunk of the export
+    monkeypatch.setattr('export.EXPORT_CHUNK_SIZE', 1)
+    job = start_job(client, headers, '/logs/me/export/jobs/?format=csv')
+    result = client.get(job['result'], headers=headers)
+    body = result.data
+    export = client.get('/logs/me/export/?format=csv', headers=headers).data
+    assert body == export
+    assert result.headers['Content-Disposition'] == 'attachment; filename=fuel_log.csv'
+    with app.app_context():
+        chunks = db.session.scalar(
+            db.select(db.func.count()).select_from(ReportJobChunk).filter_by(job_id=job['id'])
+        )
+    # the CSV header and each of the rows
+    assert chunks == len(export.splitlines())
+
+
+def test_job_is_reused(client, headers):
+    job = start_job(client, headers, '/logs/me/2/expenditure/report/jobs/', json=REPORT_BODY)
+    # the same parameters in any order
+    response = client.post(
+        '/logs/me/2/expenditure/report/jobs/',
+        json=dict(reversed(list(REPORT_BODY.items()))), headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json['id'] == job['id']
+    assert response.json['result'] == job['result']
+    # other parameters are a new job
+    response = client.post(
+        '/logs/me/2/expenditure/report/jobs/', json=dict(REPORT_BODY, period='year'), headers=headers
+    )
+    assert response.status_code == 202
+
+
+def test_log_write_invalidates_jobs(client, headers):
+    report = start_job(client, headers, '/logs/me/2/expenditure/report/jobs/', json=REPORT_BODY)
+    export = start_job(client, headers, '/logs/me/export/jobs/')
+    response = client.post(
+        '/logs/me/2/', json={'current_odo': 99999, 'fuel_quantity': 40, 'fuel_price': 2.0},
+        headers=headers
+    )
+    assert response.status_code == 200
+    # the user car's jobs and the user's jobs of all their cars are stale
+    response = client.post('/logs/me/2/expenditure/report/jobs/', json=REPORT_BODY, headers=headers)
+    assert response.status_code == 202
+    assert response.json['id'] != report['id']
+    assert client.post('/logs/me/export/jobs/', headers=headers).status_code == 202
+    # the stale results can still be downloaded
+    assert client.get(export['result'], headers=headers).status_code == 200
+
+
+def test_trip_write_invalidates_exports(client, headers):
+    start_job(client, headers, '/logs/me/2/export/jobs/')
+    assert client.post('/logs/me/2/export/jobs/', headers=headers).status_code == 200
+    assert client.delete('/logs/me/2/trips/2', headers=headers).status_code == 200
+    assert client.post('/logs/me/2/export/jobs/', headers=headers).status_code == 202
+
+
+def test_other_users_job_is_not_found(client, headers, admin_headers):
+    job = start_job(client, headers, '/logs/me/export/jobs/')
+    assert client.get(f"/logs/me/jobs/{job['id']}/", headers=admin_headers).status_code == 404
+    assert client.get(job['result'], headers=admin_headers).status_code == 404
+
+
+def test_clear_report_jobs_deletes_chunks(app, client, headers):
+    start_job(client, headers, '/logs/me/export/jobs/')
+    client.delete('/logs/me/2/trips/2', headers=headers)
+    result = app.test_cli_runner().invoke(args=['cli', 'clear-report-jobs'])
+    assert 'Report jobs deleted: 1' in result.output
+    with app.app_context():
+        assert db.session.scalar(db.select(db.func.count()).select_from(ReportJob)) == 0
+        assert db.session.scalar(db.select(db.func.count()).select_from(ReportJobChunk)) == 0
+
+
+def test_deleting_user_car_deletes_jobs(app, client, headers):
+    response = client.post('/cars/me/', json={
+        'make': 'Mazda', 'model': 'Tribute', 'model_trim': 'Sports', 'year': 2006, 'tank_size': 66
+    }, headers=headers)
+    user_car_id = response.json['id']
+    # the CSV header is the only chunk of the export
+    start_job(client, headers, f'/logs/me/{user_car_id}/export/jobs/?format=csv')
+    assert client.delete(f'/cars/me/{user_car_id}', headers=headers).status_code == 200
+    with app.app_context():
+        assert db.session.scalar(db.select(db.func.count()).select_from(ReportJob)) == 0
+        assert db.session.scalar(db.select(db.func.count()).select_from(ReportJobChunk)) == 0
+
+
+def test_resume_claims_job_once(app, client, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(report_job_runner, 'submit', submitted.append)
+    with app.app_context():
+        job = ReportJob.create('export', {'format': 'csv'}, db.session.get(UserCar, 2).user_id, 2)
+        # a job left running by a stopped process
+        job.status = RUNNING
+        job.started_at = int(time.time()) - app.config['REPORT_JOB_TIMEOUT'] - 1
+        db.session.commit()
+        job_id = job.id
+    with app.app_context():
+        # two requests read the job before either of them resumes it
+        first = db.session.get(ReportJob, job_id)
+        with app.app_context():
+            second = db.session.get(ReportJob, job_id)
+            assert report_job_runner.resume(second)
+            assert second.status == PENDING
+        assert not report_job_runner.resume(first)
+        # the job is reloaded with the status set by the other request
+        assert first.status == PENDING
+        # the resumed job isn't resumed again until it times out
+        assert not report_job_runner.resume(first)
+    assert submitted == [job_id]
+
+
+def test_catalog_writes_invalidate_jobs(app, client, headers, admin_headers):
+    report = start_job(client, headers, '/logs/me/2/expenditure/report/jobs/', json=REPORT_BODY)
+    export = start_job(client, headers, '/logs/me/export/jobs/')
+    with app.app_context():
+        car = db.session.get(UserCar, 2).car
+        car_id = car.id
+        car_info = {
+            'make': car.make, 'model': car.model, 'model_trim': 'Touring',
+            'year': car.year, 'tank_size': car.tank_size
+        }
+    response = client.put(f'/cars/{car_id}', json=car_info, headers=admin_headers)
+    assert response.status_code == 200, response.json
+    # the report has the car of the user car
+    response = client.post('/logs/me/2/expenditure/report/jobs/', json=REPORT_BODY, headers=headers)
+    assert response.status_code == 202
+    job = wait(client, headers, response.json['id'])
+    assert client.get(job['result'], headers=headers).json['user_car']['car']['model_trim'] == 'Touring'
+    assert client.post('/logs/me/export/jobs/', headers=headers).status_code == 202
+    with app.app_context():
+        stale = db.session.scalars(db.select(ReportJob.id).filter_by(stale=True)).all()
+    assert sorted(stale) == [report['id'], export['id']]
+
+
+def test_deleting_car_invalidates_jobs(app, client, headers, admin_headers):
+    export = start_job(client, headers, '/logs/me/export/jobs/')
+    with app.app_context():
+        car_id = db.session.get(UserCar, 2).car_id
+    assert client.delete(f'/cars/{car_id}', headers=admin_headers).status_code == 200
+    with app.app_context():
+        assert db.session.get(ReportJob, export['id']).stale
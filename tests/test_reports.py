@@ -0,0 +1,96 @@
+"""
+Tests of the expenditure reports read from the monthly log rollups
+
+The seeded user car 2 has log entries from 2023-05-07 to 2023-06-15. The
+periods cover whole months read from the rollups and partial months read from
+the log entries
+"""
+from datetime import datetime
+import pytest
+from init import db
+from models.log import LogEntry
+from models.log_rollup import LogRollup
+from reports import bucketed_expenditure, compare_expenditure
+
+PERIODS = [
+    ('2023-04-15', '2023-06-10'),
+    ('2023-05-01', '2023-07-01'),
+    ('2023-05-10', '2023-05-20'),
+    ('2023-01-01', '2023-12-31')
+]
+
+
+def timestamps(from_date: str, to_date: str) -> tuple:
+    """
+    The timestamps of the start of the from and to dates
+    """
+    return tuple(datetime.fromisoformat(date).timestamp() for date in (from_date, to_date))
+
+
+def raw_expenditure(user_car_id: int, from_date: float, to_date: float) -> tuple:
+    """
+    The log count and total cost of the period aggregated from the log entries
+    """
+    return db.session.execute(
+        db.select(
+            db.func.count(LogEntry.id),
+            db.func.coalesce(db.func.sum(LogEntry.fuel_price * LogEntry.fuel_quantity), 0)
+        ).where(
+            db.and_(
+                LogEntry.user_car_id == user_car_id,
+                LogEntry.date_added >= from_date,
+                LogEntry.date_added <= to_date
+            )
+        )
+    ).one()
+
+
+def assert_matches_raw(user_car_id: int):
+    """
+    Check the rollup path of the reports against the aggregate of the log entries
+    """
+    periods = [timestamps(*period) for period in PERIODS]
+    for row, period in zip(compare_expenditure(user_car_id, periods), periods):
+        log_count, total_cost = raw_expenditure(user_car_id, *period)
+        assert row.log_count == log_count
+        assert (row.total_cost or 0) == pytest.approx(total_cost)
+    rows = bucketed_expenditure(user_car_id, *timestamps('2023-01-01', '2023-12-31'), 'month')
+    assert [(row.period, row.log_count) for row in rows] == [('2023-05-01', 4), ('2023-06-01', 2)]
+
+
+def test_rollups_match_the_log_entries(app, client):
+    with app.app_context():
+        assert_matches_raw(2)
+
+
+def test_create_builds_the_missing_rollups(app, client):
+    # a database upgraded from before the rollups has log entries and no rollups
+    with app.app_context():
+        db.session.execute(db.delete(LogRollup))
+        db.session.commit()
+        row, = compare_expenditure(2, [timestamps('2023-05-01', '2023-07-01')])
+        assert row.log_count == 0
+    result = app.test_cli_runner().invoke(args=['cli', 'create'])
+    assert 'Log rollups built for 2 user cars' in result.output
+    with app.app_context():
+        assert_matches_raw(2)
+    # the rollups that match aren't rebuilt again
+    result = app.test_cli_runner().invoke(args=['cli', 'create'])
+    assert 'Log rollups built' not in result.output
+
+
+def test_log_writes_keep_the_rollups_in_step(app, client, headers):
+    client.post('/logs/me/2/import/', json=[
+        {'current_odo': 84000, 'fuel_quantity': 70, 'fuel_price': 2.01, 'date_added': '2023-05-30'},
+        {'current_odo': 84500, 'fuel_quantity': 50, 'fuel_price': 1.79, 'date_added': '2023-08-02'}
+    ], headers=headers)
+    with app.app_context():
+        log_id = db.session.scalar(db.select(LogEntry.id).filter_by(current_odo=80800))
+    client.put(f'/logs/me/2/{log_id}', json={'fuel_quantity': 75}, headers=headers)
+    client.delete(f'/logs/me/2/{log_id + 1}', headers=headers)
+    with app.app_context():
+        periods = [timestamps(*period) for period in PERIODS]
+        for row, period in zip(compare_expenditure(2, periods), periods):
+            log_count, total_cost = raw_expenditure(2, *period)
+            assert row.log_count == log_count
+            assert (row.total_cost or 0) == pytest.approx(total_cost)
@@ -0,0 +1,30 @@
+"""
+Tests of the seed-scale command
+
+The synthetic catalog is inserted without the schema, so its names are
+checked against the CarSchema validation here
+"""
+from blueprints.cli_bp import SEED_CATALOG, SEED_YEARS
+from init import db
+from models.car import Car, CarSchema
+
+
+def test_seed_catalog_is_valid():
+    for make, model, model_trim, tank_size in SEED_CATALOG:
+        car_info = {
+            'make': make, 'model': model, 'model_trim': model_trim,
+            'year': SEED_YEARS[-1], 'tank_size': tank_size
+        }
+        assert CarSchema().validate(car_info) == {}, car_info
+
+
+def test_seeded_cars_load(app, client):
+    result = app.test_cli_runner().invoke(
+        args=['cli', 'seed-scale', '--users', '2', '--cars-per-user', '1', '--logs-per-car', '5']
+    )
+    assert result.exception is None, result.output
+    with app.app_context():
+        cars = db.session.scalars(db.select(Car)).all()
+        assert len(cars) >= len(SEED_CATALOG) * len(SEED_YEARS)
+        for car in cars:
+            assert CarSchema().validate(CarSchema(exclude=['user_car']).dump(car)) == {}
@@ -0,0 +1,122 @@
+"""
+Tests of the batch trip calculator
+
+The trips are priced from the average consumption of their user car's stats,
+the same as the trip calculator, and the user cars without more than 2 log
+entries get a calc_error
+"""
+from init import db
+from models.consumption_stats import ConsumptionStats
+
+BATCH_URL = '/logs/me/trip/calculator/batch/'
+
+
+def add_user_car(client, headers) -> int:
+    """
+    Add a user car without log entries and return its id
+    """
+    response = client.post('/cars/me/', json={
+        'make': 'Mazda', 'model': 'Tribute', 'model_trim': 'Sports', 'year': 2006, 'tank_size': 66
+    }, headers=headers)
+    assert response.status_code == 200, response.json
+    return response.json['id']
+
+
+def test_batch_prices_trips(app, client, headers):
+    empty_car_id = add_user_car(client, headers)
+    trips = [
+        {'user_car_id': 2, 'distance': 250, 'fuel_price': 1.85},
+        {'distance': 175, 'fuel_price': 2.09},
+        {'user_car_id': empty_car_id, 'distance': 100, 'fuel_price': 1.9}
+    ]
+    response = client.post('/logs/me/2/trip/calculator/batch/', json={'trips': trips}, headers=headers)
+    assert response.status_code == 200, response.json
+    with app.app_context():
+        avg_consumption = db.session.get(ConsumptionStats, 2).avg_consumption
+    estimates = response.json['trips']
+    assert len(estimates) == 3
+    for trip, estimate in zip(trips[:2], estimates):
+        trip_fuel = avg_consumption * trip['distance'] / 100
+        assert estimate == {
+            'user_car_id': 2,
+            'distance': trip['distance'],
+            'fuel_price': trip['fuel_price'],
+            'avg_consumption': round(avg_consumption, 2),
+            'estimated_trip_fuel': round(trip_fuel, 2),
+            'estimated_trip_cost': round(trip_fuel * trip['fuel_price'], 2)
+        }
+    assert estimates[2] == {
+        'user_car_id': empty_car_id,
+        'distance': 100,
+        'fuel_price': 1.9,
+        'calc_error': 'Require more than 2 log entries for user car'
+    }
+
+
+def test_batch_matches_trip_calculator(client, headers):
+    trip = {'distance': 320, 'fuel_price': 1.97}
+    response = client.post('/logs/me/2/trip/calculator/batch/', json={'trips': [trip]}, headers=headers)
+    estimate = response.json['trips'][0]
+    quote = client.post(
+        '/logs/me/2/trip/calculator/?quote=true', json=trip, headers=headers
+    ).json
+    assert quote['esitmated_trip_cost'] == f"${format(estimate['estimated_trip_cost'], '.2f')}"
+    assert quote['estimated_trip_fuel'] == f"{format(estimate['estimated_trip_fuel'], '.2f')} L"
+
+
+def test_batch_saves_missing_stats(app, client, headers):
+    with app.app_context():
+        db.session.execute(db.delete(ConsumptionStats))
+        db.session.commit()
+    response = client.post(BATCH_URL, json={
+        'trips': [{'user_car_id': 2, 'distance': 100, 'fuel_price': 2}]
+    }, headers=headers)
+    assert response.status_code == 200
+    assert 'estimated_trip_cost' in response.json['trips'][0]
+    # the stats built for the batch are kept
+    with app.app_context():
+        assert db.session.get(ConsumptionStats, 2).log_count == 6
+
+
+def test_batch_other_users_car_is_not_found(client, headers):
+    response = client.post(BATCH_URL, json={
+        'trips': [{'user_car_id': 1, 'distance': 100, 'fuel_price': 2}]
+    }, headers=headers)
+    assert response.status_code == 404
+
+
+def test_trip_calculator_saves_missing_stats(app, client, headers):
+    with app.app_context():
+        db.session.execute(db.delete(ConsumptionStats))
+        db.session.commit()
+    response = client.post(
+        '/logs/me/2/trip/calculator/?quote=true',
+        json={'distance': 100, 'fuel_price': 2}, headers=headers
+    )
+    assert response.status_code == 200
+    with app.app_context():
+        assert db.session.get(ConsumptionStats, 2).log_count == 6
+
+
+def test_batch_car_without_distance(client, headers):
+    # the log entries of the user car have the same odometer
+    user_car_id = add_user_car(client, headers)
+    for _ in range(3):
+        response = client.post(f'/logs/me/{user_car_id}/', json={
+            'current_odo': 1000, 'fuel_quantity': 40, 'fuel_price': 2.0
+        }, headers=headers)
+        assert response.status_code == 200
+    response = client.post(BATCH_URL, json={'trips': [
+        {'user_car_id': user_car_id, 'distance': 100, 'fuel_price': 2},
+        {'user_car_id': 2, 'distance': 100, 'fuel_price': 2}
+    ]}, headers=headers)
+    assert response.status_code == 200, response.json
+    first, second = response.json['trips']
+    assert first['calc_error'] == 'Require more than 2 log entries for user car'
+    assert 'estimated_trip_cost' in second
+    response = client.post(
+        f'/logs/me/{user_car_id}/trip/calculator/?quote=true',
+        json={'distance': 100, 'fuel_price': 2}, headers=headers
+    )
+    assert response.status_code == 400
+    assert 'calc_error' in response.json
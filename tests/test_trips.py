@@ -0,0 +1,92 @@
+"""
+Tests of the SQL statements of the trip routes
+
+Each route loads the user and the user's cars once to verify the user car,
+the identity cache is off in the tests. The trips are selected with their
+ownership checked in the same query, see select_user_trips
+"""
+from conftest import count_statements, login
+from init import db
+from models.consumption_stats import ConsumptionStats
+
+# the user and the user's cars
+VERIFY_STATEMENTS = 2
+
+
+def test_trips_list_statements(app, client, headers):
+    with count_statements(app) as statements:
+        response = client.get('/logs/me/2/trips/', headers=headers)
+    assert response.status_code == 200
+    assert len(response.json) == 2
+    # the trips joined with the user car
+    assert len(statements) == VERIFY_STATEMENTS + 1
+
+
+def test_single_trip_statements(app, client, headers):
+    with count_statements(app) as statements:
+        response = client.get('/logs/me/2/trips/2/', headers=headers)
+    assert response.status_code == 200
+    assert response.json['id'] == 2
+    assert len(statements) == VERIFY_STATEMENTS + 1
+
+
+def test_update_trip_statements(app, client, headers):
+    with count_statements(app) as statements:
+        response = client.put(
+            '/logs/me/2/trips/2', json={'distance': 500, 'fuel_price': 2.0}, headers=headers
+        )
+    assert response.status_code == 200
+    assert response.json['distance'] == 500
+    # the trip, the update, marking the report jobs stale and reloading the
+    # trip after the commit
+    assert len(statements) == VERIFY_STATEMENTS + 4
+
+
+def test_delete_trip_statements(app, client, headers):
+    with count_statements(app) as statements:
+        response = client.delete('/logs/me/2/trips/2', headers=headers)
+    assert response.status_code == 200
+    # the trip, the delete and marking the report jobs stale
+    assert len(statements) == VERIFY_STATEMENTS + 3
+    assert client.get('/logs/me/2/trips/2/', headers=headers).status_code == 404
+
+
+def test_other_users_trip_is_not_found(app, client):
+    other = login(client, 'john.smith@test.com', 'password123')
+    with count_statements(app) as statements:
+        response = client.get('/logs/me/2/trips/2/', headers=other)
+    assert response.status_code == 404
+    # the user car isn't the user's, the trip isn't selected
+    assert len(statements) == VERIFY_STATEMENTS
+
+
+def test_invalid_quote_writes_nothing(app, client, headers):
+    with app.app_context():
+        db.session.execute(db.delete(ConsumptionStats))
+        db.session.commit()
+    with count_statements(app) as statements:
+        response = client.post(
+            '/logs/me/2/trip/calculator/?quote=maybe',
+            json={'distance': 100, 'fuel_price': 2}, headers=headers
+        )
+    assert response.status_code == 400
+    assert 'quote' in response.json['valiadtion_error']
+    # the stats aren't rebuilt before the query string is validated
+    assert len(statements) == VERIFY_STATEMENTS
+    with app.app_context():
+        assert db.session.get(ConsumptionStats, 2) is None
+
+
+def test_existing_trip_isnt_saved_again(app, client, headers):
+    trip = {'distance': 321, 'fuel_price': 1.87}
+    with count_statements(app) as statements:
+        response = client.post('/logs/me/2/trip/calculator/', json=trip, headers=headers)
+    assert response.status_code == 200
+    assert any(statement.startswith('UPDATE report_jobs') for statement in statements)
+    with count_statements(app) as statements:
+        response = client.post('/logs/me/2/trip/calculator/', json=trip, headers=headers)
+    assert response.status_code == 200
+    # nothing was inserted, the report jobs aren't marked stale
+    assert not any(statement.startswith('UPDATE report_jobs') for statement in statements)
+    trips = client.get('/logs/me/2/trips/', headers=headers).json
+    assert [(t['distance'], t['fuel_price']) for t in trips].count((321, 1.87)) == 1